@@ -0,0 +1,247 @@
+import hashlib
+import os
+import re
+import time
+import zipfile
+from multiprocessing.pool import ThreadPool
+
+import config as c
+import logs
+from utils import read_json, write_json_atomic
+
+log = logs.get_log(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+MANIFEST_MAX_AGE_SECS = 24 * 60 * 60
+
+
+class ArtifactCache(object):
+    """Content addressed download cache.
+
+    Downloads are streamed in large chunks to cache_dir/partial and resumed with HTTP range requests if interrupted,
+    provided the server's ETag shows the file hasn't changed since.
+    Once complete and verified, they are moved to cache_dir/blobs/<sha256>. Artifacts that are only needed until
+    they're extracted, like the sim, should be evicted afterwards so they don't take up space twice.
+    Cached URLs are revalidated against the server's ETag, unless fetched by checksum.
+    """
+    def __init__(self, cache_dir=None, chunk_size=CHUNK_SIZE):
+        self.cache_dir = cache_dir or c.ARTIFACT_CACHE_DIR
+        self.chunk_size = chunk_size
+        self.blob_dir = os.path.join(self.cache_dir, 'blobs')
+        self.partial_dir = os.path.join(self.cache_dir, 'partial')
+        self.manifest_dir = os.path.join(self.cache_dir, 'manifests')
+        self.index_filename = os.path.join(self.cache_dir, 'index.json')
+
+    def get_blob_path(self, sha256):
+        return os.path.join(self.blob_dir, sha256)
+
+    @staticmethod
+    def _to_entry(value):
+        if isinstance(value, str):
+            return dict(sha256=value, etag=None)  # Written before ETags were recorded
+        return value
+
+    def _get_index_entry(self, url):
+        value = read_json(self.index_filename, default={}).get(url)
+        return None if value is None else self._to_entry(value)
+
+    def lookup(self, url, sha256=None):
+        """Path of the cached artifact for url (or with the given checksum), or None if it's not cached"""
+        if sha256 is None:
+            entry = self._get_index_entry(url)
+            sha256 = entry and entry['sha256']
+        if sha256 is not None and os.path.exists(self.get_blob_path(sha256)):
+            return self.get_blob_path(sha256)
+        return None
+
+    def is_current(self, url):
+        """Whether the server's ETag for url still matches the cached download. Assumes it does if the server can't
+        be reached or doesn't send ETags."""
+        import requests
+        entry = self._get_index_entry(url)
+        if entry is None or not entry['etag']:
+            return True
+        try:
+            response = requests.head(url, timeout=10)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            log.warning('Could not revalidate %s, using cached version - error was %r', url, e)
+            return True
+        etag = response.headers.get('etag', '').strip('"')
+        return not etag or etag == entry['etag']
+
+    def evict(self, url):
+        """Deletes the cached download of url, i.e. once it's been extracted"""
+        index = read_json(self.index_filename, default={})
+        value = index.pop(url, None)
+        if value is None:
+            return
+        write_json_atomic(index, self.index_filename)
+        sha256 = self._to_entry(value)['sha256']
+        blob_path = self.get_blob_path(sha256)
+        if os.path.exists(blob_path) and all(self._to_entry(v)['sha256'] != sha256 for v in index.values()):
+            os.remove(blob_path)
+
+    def fetch(self, url, sha256=None):
+        """Returns the path of the cached artifact, downloading it first if needed.
+
+        sha256: Expected checksum, raises RuntimeError if the download doesn't match.
+        """
+        path = self.lookup(url, sha256)
+        if path is not None and (sha256 is not None or self.is_current(url)):
+            log.info('Using cached %s', url)
+            return path
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.partial_dir, exist_ok=True)
+        part_filename = os.path.join(self.partial_dir, hashlib.sha256(url.encode('utf-8')).hexdigest() + '.part')
+        actual_sha256, etag = self._download(url, part_filename)
+        if sha256 is not None and actual_sha256 != sha256:
+            self._remove_partial(part_filename)
+            raise RuntimeError('Checksum mismatch for %s, expected %s got %s' % (url, sha256, actual_sha256))
+        path = self.get_blob_path(actual_sha256)
+        os.replace(part_filename, path)
+        self._remove_partial(part_filename)
+        index = read_json(self.index_filename, default={})
+        index[url] = dict(sha256=actual_sha256, etag=etag)
+        write_json_atomic(index, self.index_filename)
+        return path
+
+    @staticmethod
+    def _get_etag_filename(part_filename):
+        return part_filename + '.etag.json'
+
+    def _remove_partial(self, part_filename):
+        for filename in [part_filename, self._get_etag_filename(part_filename)]:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def _download(self, url, part_filename):
+        """Downloads or resumes url into part_filename and returns its sha256 and ETag"""
+        import requests
+        from clint.textui import progress
+
+        sha256 = hashlib.sha256()
+        md5 = hashlib.md5()
+        offset = 0
+        etag_filename = self._get_etag_filename(part_filename)
+        partial_etag = None
+        if os.path.exists(part_filename):
+            partial_etag = read_json(etag_filename, default={}).get('etag')
+            if partial_etag and not partial_etag.startswith('W/'):
+                # Hash what we already have so the checksum covers the whole file
+                with open(part_filename, 'rb') as f:
+                    for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                        sha256.update(chunk)
+                        md5.update(chunk)
+                        offset += len(chunk)
+            else:
+                log.info('No strong ETag recorded for the partial download of %s, restarting', url)
+        # If-Range makes the server send the whole file instead of the range if it's changed since
+        headers = {'Range': 'bytes=%d-' % offset, 'If-Range': partial_etag} if offset else {}
+        request = requests.get(url, stream=True, headers=headers)
+        if request.status_code == 404:
+            raise RuntimeError('Download URL not accessible %s' % url)
+        if request.status_code == 416:
+            # Partial file is no longer valid for what's on the server
+            request.close()
+            self._remove_partial(part_filename)
+            return self._download(url, part_filename)
+        request.raise_for_status()
+        response_etag = request.headers.get('etag')
+        if offset and request.status_code == 206 and response_etag != partial_etag:
+            # Server ignored If-Range and sent a range of a different file
+            log.info('%s changed on the server since the partial download, restarting', url)
+            request.close()
+            self._remove_partial(part_filename)
+            return self._download(url, part_filename)
+        if offset and request.status_code != 206:
+            log.info('%s changed on the server or it does not support resuming downloads, restarting', url)
+            sha256 = hashlib.sha256()
+            md5 = hashlib.md5()
+            offset = 0
+        elif offset:
+            log.info('Resuming download of %s at %d bytes', url, offset)
+        else:
+            log.info('Downloading %s...', url)
+        if not offset:
+            write_json_atomic(dict(etag=response_etag), etag_filename)
+
+        content_length = request.headers.get('content-length')
+        expected_size = None if content_length is None else offset + int(content_length)
+        num_chunks = None if content_length is None else int(content_length) // self.chunk_size + 1
+        with open(part_filename, 'ab' if offset else 'wb') as f:
+            for chunk in progress.bar(request.iter_content(chunk_size=self.chunk_size), expected_size=num_chunks):
+                if chunk:
+                    f.write(chunk)
+                    sha256.update(chunk)
+                    md5.update(chunk)
+        size = os.path.getsize(part_filename)
+        if expected_size is not None and size != expected_size:
+            raise RuntimeError('Incomplete download of %s, got %d of %d bytes. Rerun to resume.' %
+                               (url, size, expected_size))
+        etag = (response_etag or '').strip('"')
+        if re.match('^[0-9a-f]{32}$', etag) and etag != md5.hexdigest():
+            # S3 ETags of non-multipart uploads are the object's md5
+            self._remove_partial(part_filename)
+            raise RuntimeError('Corrupt download of %s, md5 %s does not match ETag %s' % (url, md5.hexdigest(), etag))
+        log.info('done.')
+        return sha256.hexdigest(), etag or None
+
+    def get_manifest(self, key, fetch, max_age_secs=MANIFEST_MAX_AGE_SECS):
+        """Returns the JSON serializable result of fetch(), cached for max_age_secs.
+
+        Falls back to a stale cached value if fetch fails, i.e. when offline.
+        """
+        filename = os.path.join(self.manifest_dir, key + '.json')
+        cached = read_json(filename)
+        if cached is not None and time.time() - cached['fetched'] < max_age_secs:
+            return cached['value']
+        try:
+            value = fetch()
+        except Exception as e:
+            if cached is None:
+                raise
+            log.warning('Could not refresh %s, using cached version - error was %r', key, e)
+            return cached['value']
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        write_json_atomic(dict(fetched=time.time(), value=value), filename)
+        return value
+
+
+def extract(zip_path, directory, num_workers=8):
+    """Extracts zip_path to directory with members written in parallel.
+
+    Extraction can't start before the download finishes as a zip's table of contents is at the end of the file.
+    """
+    log.info('Unzipping %s to %s...', zip_path, directory)
+    with zipfile.ZipFile(zip_path) as zip_ref:
+        members = zip_ref.namelist()
+        for member in members:
+            if member.endswith('/'):
+                os.makedirs(os.path.join(directory, member), exist_ok=True)
+
+    def extract_members(worker_members):
+        # ZipFile isn't thread safe, so each worker reads from its own handle
+        with zipfile.ZipFile(zip_path) as worker_zip:
+            for member in worker_members:
+                worker_zip.extract(member, directory)
+
+    files = [m for m in members if not m.endswith('/')]
+    num_workers = max(1, min(num_workers, len(files)))
+    pool = ThreadPool(num_workers)
+    try:
+        pool.map(extract_members, [files[i::num_workers] for i in range(num_workers)])
+    finally:
+        pool.close()
+        pool.join()
+    log.info('done.')
+
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = ArtifactCache()
+    return _cache
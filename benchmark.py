@@ -0,0 +1,256 @@
+import csv
+import math
+import os
+import time
+from collections import namedtuple
+
+import config as c
+import logs
+from utils import write_json_atomic
+
+log = logs.get_log(__name__)
+
+LAP_FIELDS = ['episode #', 'score', 'progress reward', 'lane deviation penalty', 'gforce penalty', 'got stuck',
+              'start', 'end', 'lap time']
+
+# Per look significance of the sequential test against a reference run. Testing after every lap inflates false
+# positives, so this is about Pocock's per look level for tens of looks at 5% overall.
+SEQUENTIAL_ALPHA = 0.007
+
+# The Score fields of a lap, which can be sent between processes
+Lap = namedtuple('Lap', ['total', 'progress_reward', 'lane_deviation_penalty', 'gforce_penalty', 'got_stuck',
+                         'start_time', 'end_time', 'episode_time'])
+
+
+def to_lap(score):
+    return Lap(*[getattr(score, field) for field in Lap._fields])
+
+
+class StreamingQuantile(object):
+    """P-squared estimate of a quantile (Jain and Chlamtac 1985) in constant memory and time per observation.
+    Exact for the first five observations."""
+    def __init__(self, p=0.5):
+        self.p = p
+        self.heights = []
+        self.positions = [0, 1, 2, 3, 4]
+        self.desired = [0, 2 * p, 4 * p, 2 + 2 * p, 4]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        q = self.heights
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+        n = self.positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def _parabolic(self, i, d):
+        q = self.heights
+        n = self.positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+            (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+    def get(self):
+        q = self.heights
+        if not q:
+            return None
+        if len(q) < 5:
+            # Exact, interpolated like np.percentile
+            index = self.p * (len(q) - 1)
+            low = int(math.floor(index))
+            high = int(math.ceil(index))
+            return q[low] + (q[high] - q[low]) * (index - low)
+        return q[2]
+
+
+class RunningStats(object):
+    """Count, mean, variance (Welford), min, max and a streaming median that are O(1) to update"""
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.min = None
+        self.max = None
+        self.median_estimate = StreamingQuantile(0.5)
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        self.min = x if self.min is None else min(self.min, x)
+        self.max = x if self.max is None else max(self.max, x)
+        self.median_estimate.add(x)
+
+    @property
+    def variance(self):
+        """Population variance, i.e. np.var"""
+        return self.m2 / self.count if self.count else 0.
+
+    @property
+    def sample_variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    @property
+    def median(self):
+        return self.median_estimate.get()
+
+    def as_dict(self):
+        return dict(count=self.count, mean=self.mean, std=self.std, variance=self.variance,
+                    sample_variance=self.sample_variance, median=self.median, min=self.min, max=self.max)
+
+
+def normal_quantile(p):
+    """Inverse of the standard normal CDF, by bisection"""
+    low, high = -40., 40.
+    for _ in range(100):
+        mid = (low + high) / 2
+        if 0.5 * (1 + math.erf(mid / math.sqrt(2))) < p:
+            low = mid
+        else:
+            high = mid
+    return (low + high) / 2
+
+
+def t_quantile(p, df):
+    """Student's t quantile from the Cornish-Fisher expansion around the normal, within ~0.01 for df >= 3"""
+    if df < 1:
+        return float('inf')
+    z = normal_quantile(p)
+    terms = [(z ** 3 + z) / 4,
+             (5 * z ** 5 + 16 * z ** 3 + 3 * z) / 96,
+             (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / 384,
+             (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3 - 945 * z) / 92160]
+    return z + sum(term / df ** (i + 1) for i, term in enumerate(terms))
+
+
+def ci_half_width(stats, confidence=0.95):
+    """Half width of the t confidence interval on the mean score"""
+    if stats.count < 2:
+        return float('inf')
+    return t_quantile(0.5 + confidence / 2, stats.count - 1) * math.sqrt(stats.sample_variance / stats.count)
+
+
+def welch_test(stats, reference):
+    """Welch's t statistic and degrees of freedom for the mean score vs a reference run's summary, i.e. the
+    summary JSON of an earlier benchmark"""
+    var = stats.sample_variance / stats.count
+    ref_var = reference['sample_variance'] / reference['count']
+    diff = stats.mean - reference['mean']
+    if var + ref_var == 0:
+        return (math.copysign(float('inf'), diff) if diff else 0.), float('inf')
+    t = diff / math.sqrt(var + ref_var)
+    df = (var + ref_var) ** 2 / ((var ** 2 / max(stats.count - 1, 1)) +
+                                 (ref_var ** 2 / max(reference['count'] - 1, 1)))
+    return t, df
+
+
+class EarlyStopping(object):
+    """Decides when a benchmark has enough laps: when the confidence interval on the mean score is narrower than
+    ci_half_width, when the mean is significantly better or worse than a reference run, or at max_laps.
+    Only max_laps applies by default."""
+    def __init__(self, max_laps=None, min_laps=10, ci_half_width=None, confidence=0.95, reference=None,
+                 alpha=SEQUENTIAL_ALPHA):
+        self.max_laps = max_laps or c.BENCHMARK_MAX_LAPS
+        self.min_laps = min_laps
+        self.ci_half_width = ci_half_width
+        self.confidence = confidence
+        self.reference = reference
+        self.alpha = alpha
+
+    def check(self, stats):
+        """Reason to stop, or None to keep going"""
+        if stats.count >= self.max_laps:
+            return 'reached %d laps' % self.max_laps
+        if stats.count < self.min_laps:
+            return None
+        if self.ci_half_width is not None:
+            half_width = ci_half_width(stats, self.confidence)
+            if half_width <= self.ci_half_width:
+                return '%g%% confidence interval +/- %.1f' % (self.confidence * 100, half_width)
+        if self.reference is not None:
+            t, df = welch_test(stats, self.reference)
+            if abs(t) >= t_quantile(1 - self.alpha / 2, df):
+                return '%s than reference mean %.1f (t = %.2f)' % ('better' if t > 0 else 'worse',
+                                                                   self.reference['mean'], t)
+        return None
+
+
+class BenchmarkWriter(object):
+    """Appends one row per lap to a CSV and atomically replaces a JSON summary of running statistics, so that
+    the cost per lap is constant and a crash loses at most the lap being written"""
+    def __init__(self, experiment=None, benchmark_dir=None, stopping=None):
+        benchmark_dir = benchmark_dir or c.BENCHMARK_DIR
+        os.makedirs(benchmark_dir, exist_ok=True)
+        file_prefix = experiment + '_' if experiment else ''
+        self.csv_filename = os.path.join(benchmark_dir, '%s%s.csv' % (file_prefix, c.DATE_STR))
+        self.summary_filename = os.path.join(benchmark_dir, '%s%s_summary.json' % (file_prefix, c.DATE_STR))
+        self.stats = RunningStats()
+        self.stopping = stopping or EarlyStopping()
+        self.stop_reason = None
+
+    def add_lap(self, score):
+        """Record a lap from a Score or Lap, returns the running stats"""
+        self.stats.add(score.total)
+        row = [self.stats.count, score.total, score.progress_reward, score.lane_deviation_penalty,
+               score.gforce_penalty, score.got_stuck, format_time(score.start_time), format_time(score.end_time),
+               score.episode_time]
+        self.append_row(row)
+        self.stop_reason = self.stopping.check(self.stats)
+        self.write_summary()
+        return self.stats
+
+    def is_done(self):
+        return self.stop_reason is not None
+
+    def append_row(self, row):
+        write_header = not os.path.exists(self.csv_filename)
+        with open(self.csv_filename, 'a', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            if write_header:
+                writer.writerow(LAP_FIELDS)
+            writer.writerow(row)
+            csv_file.flush()
+            os.fsync(csv_file.fileno())
+
+    def write_summary(self):
+        summary = self.stats.as_dict()
+        summary['laps_file'] = os.path.basename(self.csv_filename)
+        summary['ci_half_width'] = ci_half_width(self.stats, self.stopping.confidence) if self.stats.count > 1 else None
+        summary['confidence'] = self.stopping.confidence
+        summary['stop_reason'] = self.stop_reason
+        summary['updated'] = format_time(time.time())
+        write_json_atomic(summary, self.summary_filename)
+
+
+def format_time(timestamp):
+    import arrow
+    return str(arrow.get(timestamp).to('local'))
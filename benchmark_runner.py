@@ -0,0 +1,145 @@
+"""Runs benchmark laps on several sims at once and merges their scores into one results file, stopping as soon as
+the mean score is known well enough rather than after a fixed number of laps.
+
+    python benchmark_runner.py --sims 127.0.0.1:9876 127.0.0.1:9877 --baseline --ci-half-width 50
+
+Each sim must already be running and listening on its address, i.e. on other machines or started with different
+ports. One agent process drives each sim. As workers don't start their sims, they can't restart them, so a worker
+whose sim fails ends and the others carry on. Pass --reference <earlier>_summary.json to stop once the mean is
+significantly better or worse than an earlier run.
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+
+import config as c
+from benchmark import BenchmarkWriter, EarlyStopping, RunningStats, SEQUENTIAL_ALPHA, to_lap
+from utils import read_json
+import logs
+
+log = logs.get_log(__name__)
+
+
+class LapQueueWriter(object):
+    """Stands in for a worker env's BenchmarkWriter, sending its laps to the runner, which records them and decides
+    when every worker should stop"""
+    def __init__(self, lap_queue, stop_event, worker_id, csv_filename):
+        self.lap_queue = lap_queue
+        self.stop_event = stop_event
+        self.worker_id = worker_id
+        self.csv_filename = csv_filename
+        self.stats = RunningStats()  # This worker's laps only
+
+    def add_lap(self, score):
+        self.stats.add(score.total)
+        self.lap_queue.put((self.worker_id, to_lap(score)))
+        return self.stats
+
+    def is_done(self):
+        return self.stop_event.is_set()
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(':')
+    return host or c.SIM_HOST, int(port)
+
+
+def run_worker(worker_id, sim_address, lap_queue, stop_event, csv_filename, experiment, agent_kwargs):
+    # Attach to the running sim instead of spawning one, which would kill the sims of the other workers
+    c.REUSE_OPEN_SIM = True
+    from tensorflow_agent import agent
+    try:
+        agent.run(experiment, should_benchmark=True, sim_address=sim_address,
+                  benchmark_writer=LapQueueWriter(lap_queue, stop_event, worker_id, csv_filename), **agent_kwargs)
+    finally:
+        lap_queue.put((worker_id, None))
+
+
+def run(sim_addresses, stopping=None, experiment=None, benchmark_dir=None, **agent_kwargs):
+    """Benchmarks agent.run(**agent_kwargs) with one worker process per sim address. Returns the BenchmarkWriter
+    with the merged laps."""
+    writer = BenchmarkWriter(experiment, benchmark_dir, stopping)
+    lap_queue = multiprocessing.Queue()
+    stop_event = multiprocessing.Event()
+    workers = []
+    for worker_id, sim_address in enumerate(sim_addresses):
+        worker = multiprocessing.Process(target=run_worker, args=(worker_id, sim_address, lap_queue, stop_event,
+                                                                  writer.csv_filename, experiment, agent_kwargs))
+        worker.start()
+        workers.append(worker)
+    try:
+        collect_laps(writer, lap_queue, stop_event, workers)
+    except KeyboardInterrupt:
+        log.info('keyboard interrupt detected, stopping workers')
+        stop_event.set()
+    for worker in workers:
+        worker.join()
+    return writer
+
+
+def collect_laps(writer, lap_queue, stop_event, workers):
+    """Records laps from workers until they've all exited, telling them to stop once the writer is done"""
+    num_running = len(workers)
+    while num_running:
+        try:
+            worker_id, lap = lap_queue.get(timeout=1)
+        except queue.Empty:
+            if not any(worker.is_alive() for worker in workers):
+                log.error('Workers exited without finishing')
+                break
+            continue
+        if lap is None:
+            num_running -= 1
+        elif writer.is_done():
+            log.info('ignoring lap from worker %d finished after stopping', worker_id)
+        else:
+            stats = writer.add_lap(lap)
+            log.info('benchmark lap #%d from worker %d score: %f - average: %f', stats.count, worker_id, lap.total,
+                     stats.mean)
+            if writer.is_done():
+                log.info('stopping benchmark: %s', writer.stop_reason)
+                stop_event.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark an agent on several sims, stopping early when possible')
+    parser.add_argument('--sims', nargs='*', default=['%s:%d' % (c.SIM_HOST, c.SIM_PORT)],
+                        help='host:port of each running sim')
+    parser.add_argument('-e', '--env-id', nargs='?', default='DeepDrive-v0', help='Select the environment to run')
+    parser.add_argument('-n', '--experiment-name', nargs='?', default=None, help='Name of your experiment')
+    parser.add_argument('--net-path', nargs='?', default=None, help='Path to the tensorflow checkpoint to benchmark')
+    parser.add_argument('--baseline', action='store_true', default=False, help='Benchmark the baseline agent')
+    parser.add_argument('--path-follower', action='store_true', default=False,
+                        help='Benchmark the sim\'s path follower')
+    parser.add_argument('--backbone', nargs='?', default=None)
+    parser.add_argument('--fps', type=int, default=c.DEFAULT_FPS, help='Frames / steps per second')
+    parser.add_argument('--clock', default='wall', choices=['wall', 'step', 'observation'])
+    parser.add_argument('--min-laps', type=int, default=10, help='Laps to run before stopping early')
+    parser.add_argument('--max-laps', type=int, default=c.BENCHMARK_MAX_LAPS)
+    parser.add_argument('--ci-half-width', type=float, default=None,
+                        help='Stop once the confidence interval on the mean score is within +/- this')
+    parser.add_argument('--confidence', type=float, default=0.95)
+    parser.add_argument('--reference', default=None,
+                        help='Summary JSON of an earlier benchmark - stop once the mean is significantly different')
+    parser.add_argument('--alpha', type=float, default=SEQUENTIAL_ALPHA,
+                        help='Significance per lap of the test against --reference')
+    args = parser.parse_args()
+
+    reference = None
+    if args.reference:
+        reference = read_json(args.reference)
+        if reference is None:
+            raise ValueError('Could not read reference summary %s' % args.reference)
+    stopping = EarlyStopping(max_laps=args.max_laps, min_laps=args.min_laps, ci_half_width=args.ci_half_width,
+                             confidence=args.confidence, reference=reference, alpha=args.alpha)
+    writer = run([parse_address(address) for address in args.sims], stopping, args.experiment_name,
+                 env_id=args.env_id, net_path=args.net_path, run_baseline_agent=args.baseline,
+                 path_follower=args.path_follower, backbone=args.backbone, fps=args.fps, clock=args.clock)
+    log.info('%d laps, mean score %f, stopped because: %s', writer.stats.count, writer.stats.mean,
+             writer.stop_reason or 'workers finished')
+    log.info('wrote results to %s', os.path.normpath(writer.csv_filename))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""SQLite catalog of recorded frames, with one row per frame, so that datasets can be summarized, filtered and
+balanced without opening every HDF5 file.
+
+The recorder adds files as it writes them. To build or refresh the catalog for existing recordings:
+
+    python catalog.py <recording-dir> --workers 8
+"""
+import argparse
+import glob
+import json
+import os
+import sqlite3
+from multiprocessing import Pool
+
+import numpy as np
+
+import config as c
+import logs
+
+log = logs.get_log(__name__)
+
+CATALOG_FILENAME = 'catalog.sqlite'
+FRAME_COLUMNS = ['session', 'file', 'frame_index', 'camera_config', 'speed', 'steering', 'throttle', 'spin',
+                 'is_game_driving', 'selection_weight']
+CAMERA_CONFIG_KEYS = ['name', 'field_of_view', 'capture_width', 'capture_height']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    file TEXT PRIMARY KEY,
+    session TEXT,
+    mtime REAL,
+    size INTEGER,
+    num_frames INTEGER
+);
+CREATE TABLE IF NOT EXISTS frames (
+    session TEXT,
+    file TEXT,
+    frame_index INTEGER,
+    camera_config TEXT,
+    speed REAL,
+    steering REAL,
+    throttle REAL,
+    spin REAL,
+    is_game_driving INTEGER,
+    selection_weight REAL,
+    PRIMARY KEY (file, frame_index)
+);
+CREATE INDEX IF NOT EXISTS frames_session ON frames (session);
+CREATE INDEX IF NOT EXISTS frames_steering ON frames (steering);
+'''
+
+
+def _to_python(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+    return value
+
+
+def read_frame_rows(filename):
+    """Catalog rows for every frame in an HDF5 recording, without reading any image data.
+    Session and file are filled in by the Catalog."""
+    import h5py
+    rows = []
+    with h5py.File(filename, 'r') as f:
+        for frame_index, frame_name in enumerate(f):
+            frame = f[frame_name]
+            attrs = frame.attrs
+            cameras = []
+            for camera_name in frame:
+                camera_attrs = frame[camera_name].attrs
+                cameras.append({k: _to_python(camera_attrs[k]) for k in CAMERA_CONFIG_KEYS if k in camera_attrs})
+            angular_velocity = attrs.get('angular_velocity')
+            rows.append(dict(
+                frame_index=frame_index,
+                camera_config=json.dumps(cameras, sort_keys=True),
+                speed=_to_python(attrs.get('speed')),
+                steering=_to_python(attrs.get('steering')),
+                throttle=_to_python(attrs.get('throttle')),
+                spin=None if angular_velocity is None else float(angular_velocity[2]),
+                is_game_driving=_to_python(attrs.get('is_game_driving')),
+                selection_weight=_to_python(attrs.get('selection_weight', 1.)),
+            ))
+    return rows
+
+
+def _read_file(args):
+    filename, rel_path = args
+    try:
+        return rel_path, read_frame_rows(filename)
+    except Exception as e:
+        log.error('Could not read %s - skipping. Error was %r', filename, e)
+        return rel_path, None
+
+
+def get_split_files(recording_dir, train=True):
+    """The first HDF5 file in glob's listing order is for eval, the rest for training. Listing order rather than
+    sorted order, so the eval file, and so eval losses, stay comparable with earlier runs."""
+    files = glob.glob(recording_dir + '/**/*.hdf5', recursive=True)
+    return files[1:] if train else files[0:1]
+
+
+class Catalog(object):
+    """read_only: For readers such as training processes. Only the recorder and catalog.py update the catalog."""
+    def __init__(self, recording_dir=None, read_only=False):
+        self.recording_dir = recording_dir or c.RECORDING_DIR
+        self.filename = os.path.join(self.recording_dir, CATALOG_FILENAME)
+        if read_only:
+            self.conn = sqlite3.connect('file:%s?mode=ro' % self.filename, uri=True, timeout=60)
+        else:
+            os.makedirs(self.recording_dir, exist_ok=True)
+            # Recorder threads each write with their own connection, so wait for locks rather than failing
+            self.conn = sqlite3.connect(self.filename, timeout=60)
+            self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def get_rel_path(self, filename):
+        return os.path.relpath(os.path.abspath(filename), os.path.abspath(self.recording_dir))
+
+    @staticmethod
+    def get_session(rel_path):
+        return os.path.dirname(rel_path) or '.'
+
+    def add_file(self, filename, rows=None):
+        """Add or replace the frames of an HDF5 recording"""
+        rel_path = self.get_rel_path(filename)
+        if rows is None:
+            rows = read_frame_rows(filename)
+        session = self.get_session(rel_path)
+        stat = os.stat(filename)
+        with self.conn:
+            self.conn.execute('DELETE FROM frames WHERE file = ?', (rel_path,))
+            self.conn.executemany(
+                'INSERT INTO frames (%s) VALUES (%s)' % (', '.join(FRAME_COLUMNS), ', '.join('?' * len(FRAME_COLUMNS))),
+                [tuple(dict(row, session=session, file=rel_path)[k] for k in FRAME_COLUMNS) for row in rows])
+            self.conn.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                              (rel_path, session, stat.st_mtime, stat.st_size, len(rows)))
+
+    def remove_file(self, rel_path):
+        with self.conn:
+            self.conn.execute('DELETE FROM frames WHERE file = ?', (rel_path,))
+            self.conn.execute('DELETE FROM files WHERE file = ?', (rel_path,))
+
+    def update(self, num_workers=None, rebuild=False):
+        """Catalogs new and changed HDF5 files in parallel and drops deleted ones. Unchanged files aren't opened
+        unless rebuild is True."""
+        on_disk = {}
+        for filename in glob.glob(self.recording_dir + '/**/*.hdf5', recursive=True):
+            on_disk[self.get_rel_path(filename)] = filename
+        cataloged = {row[0]: (row[1], row[2]) for row in self.conn.execute('SELECT file, mtime, size FROM files')}
+        for rel_path in set(cataloged) - set(on_disk):
+            self.remove_file(rel_path)
+        to_read = []
+        for rel_path, filename in sorted(on_disk.items()):
+            stat = os.stat(filename)
+            if rebuild or cataloged.get(rel_path) != (stat.st_mtime, stat.st_size):
+                to_read.append((filename, rel_path))
+        if not to_read:
+            return 0
+        log.info('Cataloging %d recording files', len(to_read))
+        pool = None if num_workers == 1 or len(to_read) == 1 else Pool(num_workers)
+        num_added = 0
+        try:
+            results = map(_read_file, to_read) if pool is None else pool.imap_unordered(_read_file, to_read)
+            for rel_path, rows in results:
+                if rows is not None:
+                    self.add_file(on_disk[rel_path], rows)
+                    num_added += 1
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return num_added
+
+    def query(self, where='1', params=(), columns=FRAME_COLUMNS, order_by='file, frame_index'):
+        """Frames matching an SQL where clause as a list of dicts, i.e. query('speed > ?', (100,))"""
+        cursor = self.conn.execute('SELECT %s FROM frames WHERE %s ORDER BY %s' %
+                                   (', '.join(columns), where, order_by), params)
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def count_frames(self, where='1', params=()):
+        return self.conn.execute('SELECT COUNT(*) FROM frames WHERE %s' % where, params).fetchone()[0]
+
+    def get_sessions(self):
+        """Frame count and camera configs per session"""
+        ret = {}
+        for session, camera_config, num_frames in self.conn.execute(
+                'SELECT session, camera_config, COUNT(*) FROM frames GROUP BY session, camera_config'):
+            stats = ret.setdefault(session, dict(num_frames=0, camera_configs=[]))
+            stats['num_frames'] += num_frames
+            stats['camera_configs'].append(json.loads(camera_config))
+        return ret
+
+    def get_steering_histogram(self, bins=10):
+        steering = np.array([row[0] for row in self.conn.execute(
+            'SELECT steering FROM frames WHERE steering IS NOT NULL')], dtype=np.float64)
+        return np.histogram(steering, bins=bins, range=(-1, 1))
+
+    def select_balanced(self, bins=10, per_bin=None, where='is_game_driving = 1', params=(), seed=c.RNG_SEED):
+        """Sample frames so that each steering bin is equally represented. per_bin defaults to the count of the
+        smallest non-empty bin."""
+        rows = self.query(where + ' AND steering IS NOT NULL', params, columns=['file', 'frame_index', 'steering'])
+        if not rows:
+            return []
+        steering = np.array([row['steering'] for row in rows])
+        bin_ids = np.digitize(steering, np.linspace(-1, 1, bins + 1)[1:-1])
+        by_bin = [np.flatnonzero(bin_ids == b) for b in range(bins)]
+        by_bin = [b for b in by_bin if len(b)]
+        if per_bin is None:
+            per_bin = min(len(b) for b in by_bin)
+        rng = np.random.RandomState(seed)
+        selected = np.concatenate([rng.choice(b, min(per_bin, len(b)), replace=False) for b in by_bin])
+        return [rows[i] for i in sorted(selected)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or refresh the frame catalog for a recording directory')
+    parser.add_argument('recording_dir', nargs='?', default=c.RECORDING_DIR)
+    parser.add_argument('--rebuild', action='store_true', default=False, help='Re-read every file')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    catalog = Catalog(args.recording_dir)
+    num_added = catalog.update(num_workers=args.workers, rebuild=args.rebuild)
+    log.info('Cataloged %d files - %d frames in %d sessions', num_added, catalog.count_frames(),
+             len(catalog.get_sessions()))
+    counts, edges = catalog.get_steering_histogram()
+    for count, low, high in zip(counts, edges[:-1], edges[1:]):
+        log.info('steering %+.1f to %+.1f: %d', low, high, count)
+    catalog.close()
+
+
+if __name__ == '__main__':
+    main()
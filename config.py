@@ -2,6 +2,7 @@ import random
 import os
 import sys
 import glob
+import types
 
 from datetime import datetime
 import numpy as np
@@ -9,6 +10,7 @@ import numpy as np
 # Net
 NUM_TARGETS = 6
 BASELINE_IMAGE_SHAPE = (227, 227, 3)
+DEFAULT_BACKBONE = 'alexnet'  # See tensorflow_agent/net.py for others
 
 # Normalization
 SPIN_THRESHOLD = 1.0
@@ -20,6 +22,14 @@ MEAN_PIXEL = np.array([104., 117., 123.], np.float32)
 FRAMES_PER_HDF5_FILE = 1000
 MAX_RECORDED_OBSERVATIONS = FRAMES_PER_HDF5_FILE * 250
 NUM_TRAIN_FILES_TO_QUEUE = 2000 // FRAMES_PER_HDF5_FILE
+# 1: Mean subtracted float32 images (files without a format_version attribute), 2: The env's uint8 images
+HDF5_FORMAT_VERSION = 2
+
+# Recording frame selection, see tensorflow_agent/frame_selector.py
+RECORD_MIN_FRAME_DIFF = 0.01  # Mean absolute difference from the last kept frame as a fraction of full scale
+RECORD_STRAIGHT_KEEP_PROB = 0.25
+RECORD_STEERING_THRESHOLD = 0.05
+RECORD_RECOVERY_STEPS = 16  # Frames after random actions that are always kept
 
 # OS 
 IS_LINUX = sys.platform == 'linux' or sys.platform == 'linux2'
@@ -27,7 +37,11 @@ IS_MAC = sys.platform == 'darwin'
 IS_UNIX = IS_LINUX or IS_MAC or 'bsd' in sys.platform.lower()
 IS_WINDOWS = sys.platform == 'win32'
 
-# DEEPDRIVE_DIR
+# DEEPDRIVE_DIR and the directories under it are resolved on first access (see DeepdriveDirs) so that importing
+# config never prompts for input or writes files.
+DEEPDRIVE_CONFIG_DIR = os.path.expanduser('~') + '/.deepdrive'
+
+
 def _get_deepdrive_dir():
     dir_config_file = os.path.join(DEEPDRIVE_CONFIG_DIR, 'deepdrive_dir')
     if os.path.exists(dir_config_file):
@@ -62,29 +76,88 @@ def _ensure_python_bin_config():
     with open(py_bin, 'w') as _dpbf:
         _dpbf.write(sys.executable)
 
-DEEPDRIVE_DIR = os.environ.get('DEEPDRIVE_DIR')
-DEEPDRIVE_CONFIG_DIR = os.path.expanduser('~') + '/.deepdrive'
-os.makedirs(DEEPDRIVE_CONFIG_DIR, exist_ok=True)
-if DEEPDRIVE_DIR is None:
-    DEEPDRIVE_DIR = _get_deepdrive_dir()
-_ensure_python_bin_config()
 
+class DeepdriveDirs(object):
+    """Resolves DEEPDRIVE_DIR (from the environment, ~/.deepdrive or by asking) the first time it or one of the
+    directories derived from it is accessed. Also available as module attributes, i.e. config.RECORDING_DIR"""
+    def __init__(self):
+        self._deepdrive_dir = None
+
+    @property
+    def DEEPDRIVE_DIR(self):
+        if self._deepdrive_dir is None:
+            os.makedirs(DEEPDRIVE_CONFIG_DIR, exist_ok=True)
+            self._deepdrive_dir = os.environ.get('DEEPDRIVE_DIR') or _get_deepdrive_dir()
+            _ensure_python_bin_config()
+        return self._deepdrive_dir
+
+    # Data directories
+    @property
+    def RECORDING_DIR(self):
+        return os.path.join(self.DEEPDRIVE_DIR, 'recordings')
+
+    @property
+    def GYM_DIR(self):
+        return os.path.join(self.DEEPDRIVE_DIR, 'gym')
+
+    @property
+    def LOG_DIR(self):
+        return os.path.join(self.DEEPDRIVE_DIR, 'log')
+
+    @property
+    def BENCHMARK_DIR(self):
+        return os.path.join(self.DEEPDRIVE_DIR, 'benchmark')
+
+    @property
+    def TENSORFLOW_OUT_DIR(self):
+        return os.path.join(self.DEEPDRIVE_DIR, 'tensorflow')
+
+    @property
+    def WEIGHTS_DIR(self):
+        return os.path.join(self.DEEPDRIVE_DIR, 'weights')
+
+    @property
+    def MICROBENCH_DIR(self):
+        return os.path.join(self.DEEPDRIVE_DIR, 'microbench')
+
+    @property
+    def ARTIFACT_CACHE_DIR(self):
+        return os.path.join(self.DEEPDRIVE_DIR, 'cache')
+
+    @property
+    def SIM_PATH(self):
+        return os.path.join(self.DEEPDRIVE_DIR, 'sim')
+
+    # Weights
+    @property
+    def BASELINE_WEIGHTS_DIR(self):
+        return os.path.join(self.WEIGHTS_DIR, 'baseline_agent_weights')
+
+    @property
+    def BVLC_CKPT_PATH(self):
+        return os.path.join(self.WEIGHTS_DIR, BVLC_CKPT_NAME)
+
+
+dirs = DeepdriveDirs()
+
+
+class _ConfigModule(types.ModuleType):
+    def __getattr__(self, name):
+        # Only called for attributes not defined in the module, i.e. the lazy directories
+        if isinstance(getattr(DeepdriveDirs, name, None), property):
+            return getattr(dirs, name)
+        raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
+
+
+sys.modules[__name__].__class__ = _ConfigModule
 
 # Data directories
 DIR_DATE_FORMAT = '%Y-%m-%d__%I-%M-%S%p'
 DATE_STR = datetime.now().strftime(DIR_DATE_FORMAT)
-RECORDING_DIR = os.path.join(DEEPDRIVE_DIR, 'recordings')
-GYM_DIR = os.path.join(DEEPDRIVE_DIR, 'gym')
-LOG_DIR = os.path.join(DEEPDRIVE_DIR, 'log')
-BENCHMARK_DIR = os.path.join(DEEPDRIVE_DIR, 'benchmark')
-TENSORFLOW_OUT_DIR = os.path.join(DEEPDRIVE_DIR, 'tensorflow')
-WEIGHTS_DIR = os.path.join(DEEPDRIVE_DIR, 'weights')
 
 # Weights
-BASELINE_WEIGHTS_DIR = os.path.join(WEIGHTS_DIR, 'baseline_agent_weights')
 BASELINE_WEIGHTS_VERSION = 'model.ckpt-143361'
 BVLC_CKPT_NAME = 'bvlc_alexnet.ckpt'
-BVLC_CKPT_PATH = os.path.join(WEIGHTS_DIR, BVLC_CKPT_NAME)
 
 # Urls
 BASE_URL = 'https://s3-us-west-1.amazonaws.com/deepdrive'
@@ -104,10 +177,25 @@ else:
     SIM_START_COMMAND = None
 
 REUSE_OPEN_SIM = 'DEEPDRIVE_REUSE_OPEN_SIM' in os.environ
-SIM_PATH = os.path.join(DEEPDRIVE_DIR, 'sim')
+
+# Address of the sim's RPC server, see benchmark_runner.py for running against several sims
+SIM_HOST = os.environ.get('DEEPDRIVE_SIM_HOST', '127.0.0.1')
+SIM_PORT = int(os.environ.get('DEEPDRIVE_SIM_PORT', 9876))
+
+# Attaching to the sim - readiness is polled every SIM_POLL_SECS, backing off to SIM_MAX_POLL_SECS
+SIM_CONNECT_TIMEOUT = 60
+SIM_POLL_SECS = 0.01
+SIM_MAX_POLL_SECS = 0.25
+
+# Watchdog - the sim is restarted if it exits or no frame arrives for this many step periods
+SIM_STALL_PERIODS = 100
+SIM_MAX_RESTARTS = 20
 
 DEFAULT_CAM = dict(name='forward cam 227x227 60 FOV', field_of_view=60, capture_width=227, capture_height=227,
          relative_position=[150, 1.0, 200],
          relative_rotation=[0.0, 0.0, 0.0])
 
 DEFAULT_FPS = 8
+
+# Most laps to run in a benchmark, which can also stop early, see benchmark.EarlyStopping
+BENCHMARK_MAX_LAPS = 50
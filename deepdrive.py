@@ -5,6 +5,7 @@ import logs
 
 import config as c
 import random_name
+from gym_deepdrive.envs.clock import get_clock
 
 # noinspection PyUnresolvedReferences
 from gym_deepdrive.envs.deepdrive_gym_env import gym_action as action
@@ -12,7 +13,14 @@ log = logs.get_log(__name__)
 
 
 def start(experiment_name=None, env='DeepDrive-v0', sess=None, start_dashboard=True, should_benchmark=True,
-          cameras=None, use_sim_start_command=False, render=False, fps=c.DEFAULT_FPS):
+          cameras=None, use_sim_start_command=False, render=False, fps=c.DEFAULT_FPS, clock='wall', required_fields=None,
+          history_length=None, sim_address=None, benchmark_writer=None):
+    """clock: 'wall' to run in real time, 'step' to advance episode time by 1 / fps per step, or 'observation' to
+    use the timestamps in observations - the latter runs as fast as the sim produces frames
+    required_fields: Observation fields to compute every step, others are computed when first accessed
+    history_length: Number of recent frames and telemetry values to keep, see DeepDriveEnv.get_frame_history
+    sim_address: (host, port) of the sim's RPC server, defaults to c.SIM_HOST, c.SIM_PORT
+    benchmark_writer: Where to record benchmark laps, see benchmark_runner.py"""
     env = gym.make(env)
     env = gym.wrappers.Monitor(env, directory=c.GYM_DIR, force=True)
     env.seed(0)
@@ -24,7 +32,12 @@ def start(experiment_name=None, env='DeepDrive-v0', sess=None, start_dashboard=T
     dd_env.fps = fps
     dd_env.experiment = experiment_name.replace(' ', '_')
     dd_env.period = 1. / fps
+    dd_env.set_clock(get_clock(clock, dd_env.period))
+    dd_env.set_required_fields(required_fields)
+    dd_env.set_history(history_length)
     dd_env.set_use_sim_start_command(use_sim_start_command)
+    if sim_address is not None:
+        dd_env.set_sim_address(*sim_address)
     dd_env.open_sim()
     if use_sim_start_command:
         input('Press any key when the game has loaded')  # TODO: Find a better way to do this. Waiting for the hwnd and focusing does not work in windows.
@@ -35,6 +48,6 @@ def start(experiment_name=None, env='DeepDrive-v0', sess=None, start_dashboard=T
         dd_env.start_dashboard()
     if should_benchmark:
         log.info('Benchmarking enabled - will save results to %s', c.BENCHMARK_DIR)
-        dd_env.init_benchmarking()
+        dd_env.init_benchmarking(benchmark_writer)
     env.reset()
     return env
@@ -0,0 +1,204 @@
+"""Export recorded camera images and depth heatmaps to PNG frames or to a video per session, i.e. to review a day
+of recordings.
+
+    python export_recordings.py <recording-dir> --out <dir> --format video --fps 8
+
+Files (PNG) or sessions (video) are exported in parallel, reading one camera frame at a time, and anything already
+exported is skipped, so this can be re-run as recording continues.
+"""
+import argparse
+import glob
+import os
+import shutil
+import subprocess
+from collections import OrderedDict
+from multiprocessing import Pool, cpu_count
+
+import h5py
+import numpy as np
+
+import config as c
+from utils import depth_heatmap, get_hdf5_format_version, read_json, to_uint8_image, write_json_atomic
+import logs
+
+log = logs.get_log(__name__)
+
+STREAMS = ['image', 'depth']
+PNG_PREFIXES = dict(image='i_', depth='z_')  # As in utils.save_camera
+VIDEO_EXTENSION = '.mp4'
+VIDEO_MANIFEST_FILENAME = 'videos.json'
+
+
+def get_sessions(recording_dir):
+    """{session dir relative to recording_dir: its HDF5 files in recording order}"""
+    sessions = OrderedDict()
+    for filename in sorted(glob.glob(recording_dir + '/**/*.hdf5', recursive=True)):
+        session = os.path.relpath(os.path.dirname(filename), recording_dir)
+        sessions.setdefault(session, []).append(filename)
+    return sessions
+
+
+def iter_cameras(filename, streams=STREAMS, skip=None):
+    """Yields (frame index, camera index, {stream: RGB uint8 array}) one camera at a time, so memory use doesn't
+    grow with the file. skip(frame index, camera index) avoids reading and decompressing cameras that aren't needed."""
+    with h5py.File(filename, 'r') as file:
+        is_legacy = get_hdf5_format_version(file) < 2
+        for frame_index, frame_name in enumerate(file):
+            frame = file[frame_name]
+            for camera_index, camera_name in enumerate(frame):
+                if skip is not None and skip(frame_index, camera_index):
+                    continue
+                camera = frame[camera_name]
+                rgbs = {}
+                if 'image' in streams:
+                    image = camera['image'][()]
+                    rgbs['image'] = to_uint8_image(image) if is_legacy else image
+                if 'depth' in streams:
+                    rgbs['depth'] = depth_heatmap(camera['depth'][()])
+                yield frame_index, camera_index, rgbs
+
+
+def get_png_path(out_dir, session, filename, stream, frame_index, camera_index):
+    name = '%s%s_%s_%s.png' % (PNG_PREFIXES[stream], os.path.splitext(os.path.basename(filename))[0],
+                               str(frame_index).zfill(5), str(camera_index).zfill(2))
+    return os.path.join(out_dir, session, name)
+
+
+def export_pngs(filename, session, out_dir, streams=STREAMS):
+    """Writes a PNG per stream and camera of each frame not already exported. Returns the number written."""
+    from PIL import Image
+
+    def is_exported(frame_index, camera_index):
+        return all(os.path.exists(get_png_path(out_dir, session, filename, stream, frame_index, camera_index))
+                   for stream in streams)
+
+    os.makedirs(os.path.join(out_dir, session), exist_ok=True)
+    num_written = 0
+    for frame_index, camera_index, rgbs in iter_cameras(filename, streams, skip=is_exported):
+        for stream, rgb in rgbs.items():
+            path = get_png_path(out_dir, session, filename, stream, frame_index, camera_index)
+            # Written under a temporary name so an interrupted export is redone, not skipped
+            Image.fromarray(rgb).save(path + '.tmp', format='PNG')
+            os.replace(path + '.tmp', path)
+            num_written += 1
+    return num_written
+
+
+class VideoWriter(object):
+    """Pipes RGB frames to an ffmpeg process which encodes them to H.264. The video appears at path on close."""
+    def __init__(self, path, width, height, fps=c.DEFAULT_FPS, threads=1, ffmpeg='ffmpeg'):
+        self.path = path
+        self.shape = (height, width, 3)
+        self.tmp_path = os.path.join(os.path.dirname(path), '.tmp_' + os.path.basename(path))
+        cmd = [ffmpeg, '-y', '-loglevel', 'error',
+               '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', '%dx%d' % (width, height), '-r', str(fps), '-i', '-',
+               '-an', '-c:v', 'libx264', '-threads', str(threads), '-pix_fmt', 'yuv420p',
+               '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',  # yuv420p needs even dimensions, cameras are i.e. 227x227
+               '-f', 'mp4', self.tmp_path]
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+    def write(self, rgb):
+        self.process.stdin.write(np.ascontiguousarray(rgb, dtype=np.uint8).tobytes())
+
+    def close(self):
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError('ffmpeg failed writing %s with code %d' % (self.path, self.process.returncode))
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self.process.kill()
+        self.process.wait()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def export_videos(files, session, out_dir, streams=STREAMS, fps=c.DEFAULT_FPS, threads=1):
+    """Encodes a video per stream and camera of a session, skipping the session if its files haven't changed since
+    the last export. Camera sizes can change between episodes, which starts a new video. Returns the paths written."""
+    session_dir = os.path.join(out_dir, session)
+    manifest_filename = os.path.join(session_dir, VIDEO_MANIFEST_FILENAME)
+    file_names = [os.path.basename(f) for f in files]
+    manifest = read_json(manifest_filename)
+    if manifest is not None and manifest['files'] == file_names:
+        return []
+    os.makedirs(session_dir, exist_ok=True)
+    writers = {}  # (stream, camera index): VideoWriter
+    num_segments = {}
+    paths = []
+    try:
+        for filename in files:
+            for _, camera_index, rgbs in iter_cameras(filename, streams):
+                for stream, rgb in rgbs.items():
+                    key = (stream, camera_index)
+                    writer = writers.get(key)
+                    if writer is None or writer.shape != rgb.shape:
+                        if writer is not None:
+                            writer.close()
+                        segment = num_segments[key] = num_segments.get(key, 0) + 1
+                        path = os.path.join(session_dir, '%s_camera%s_%s%s' % (
+                            stream, str(camera_index).zfill(2), str(segment).zfill(3), VIDEO_EXTENSION))
+                        writer = writers[key] = VideoWriter(path, rgb.shape[1], rgb.shape[0], fps, threads)
+                        paths.append(path)
+                    writer.write(rgb)
+    except Exception:
+        for writer in writers.values():
+            writer.abort()
+        raise
+    for writer in writers.values():
+        writer.close()
+    write_json_atomic(dict(files=file_names, videos=[os.path.basename(p) for p in paths]), manifest_filename)
+    return paths
+
+
+def _export(args):
+    name, export_fn, fn_args, fn_kwargs = args
+    try:
+        return name, export_fn(*fn_args, **fn_kwargs)
+    except Exception as e:
+        log.error('Could not export %s - skipping - error was %r', name, e)
+        return name, None
+
+
+def export(recording_dir, out_dir, video=False, streams=STREAMS, fps=c.DEFAULT_FPS, num_workers=None):
+    """Exports every session in recording_dir. Returns a list of (file or session, export result), where the result
+    is None if the export failed."""
+    num_workers = num_workers or cpu_count()
+    tasks = []
+    for session, files in get_sessions(recording_dir).items():
+        if video:
+            # Sessions are the unit of work, so give each ffmpeg a share of the cores
+            threads = max(1, cpu_count() // num_workers)
+            tasks.append((session, export_videos, (files, session, out_dir),
+                          dict(streams=streams, fps=fps, threads=threads)))
+        else:
+            tasks += [(filename, export_pngs, (filename, session, out_dir), dict(streams=streams))
+                      for filename in files]
+    with Pool(num_workers) as pool:
+        results = []
+        for result in pool.imap_unordered(_export, tasks):
+            results.append(result)
+            log.info('exported %d of %d %s', len(results), len(tasks), 'sessions' if video else 'files')
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export recorded camera images and depth to PNG frames or video')
+    parser.add_argument('recording_dir', nargs='?', default=c.RECORDING_DIR)
+    parser.add_argument('--out', default=None, help='Defaults to <recording-dir>/export')
+    parser.add_argument('--format', default='png', choices=['png', 'video'])
+    parser.add_argument('--streams', nargs='*', default=STREAMS, choices=STREAMS)
+    parser.add_argument('--fps', type=int, default=c.DEFAULT_FPS, help='Video frame rate')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    if args.format == 'video' and shutil.which('ffmpeg') is None:
+        raise RuntimeError('Video export needs ffmpeg on the PATH')
+    out_dir = args.out or os.path.join(args.recording_dir, 'export')
+    results = export(args.recording_dir, out_dir, video=args.format == 'video', streams=args.streams, fps=args.fps,
+                     num_workers=args.workers)
+    num_failed = sum(1 for _, result in results if result is None)
+    log.info('Exported %s to %s%s', args.recording_dir, out_dir, ' - %d failed' % num_failed if num_failed else '')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import time
+
+
+class WallClock(object):
+    """Wall time - episodes run at real time speed"""
+    is_real_time = True
+    is_backend_time = False
+
+    def now(self):
+        return time.time()
+
+    def tick(self, obz):
+        pass
+
+
+class StepClock(object):
+    """Advances by a fixed period every step, so episode time doesn't depend on how long steps take. Steps are still
+    regulated to 1 / period fps, as the sim runs in real time. Starts at the current epoch time so lap start and end
+    times are dates."""
+    is_real_time = False
+    is_backend_time = False
+
+    def __init__(self, period, start=None):
+        self.period = period
+        self.time = time.time() if start is None else start
+
+    def now(self):
+        return self.time
+
+    def tick(self, obz):
+        self.time += self.period
+
+
+class ObservationClock(object):
+    """Advances by the difference between timestamps supplied in consecutive observations, i.e. the sim's
+    capture_timestamp, for replayed or sped-up backends which set the pace, so steps aren't regulated.
+    Starts at the current epoch time like StepClock."""
+    is_real_time = False
+    is_backend_time = True
+
+    def __init__(self, key='capture_timestamp', start=None):
+        self.key = key
+        self.time = time.time() if start is None else start
+        self.last_timestamp = None
+
+    def now(self):
+        return self.time
+
+    def tick(self, obz):
+        if not obz or self.key not in obz:
+            return
+        timestamp = obz[self.key]
+        if self.last_timestamp is not None and timestamp > self.last_timestamp:
+            self.time += timestamp - self.last_timestamp
+        self.last_timestamp = timestamp
+
+
+CLOCKS = ['wall', 'step', 'observation']
+
+
+def get_clock(name, period):
+    if name == 'wall':
+        return WallClock()
+    elif name == 'step':
+        return StepClock(period)
+    elif name == 'observation':
+        return ObservationClock()
+    else:
+        raise ValueError('Unknown clock %r, expected one of %r' % (name, CLOCKS))
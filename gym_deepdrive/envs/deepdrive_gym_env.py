@@ -1,36 +1,33 @@
-import csv
 import subprocess
-import deepdrive_client
-import deepdrive_capture
 import os
 import queue
-import random
 import time
 from collections import deque, OrderedDict
+from functools import partial
 from multiprocessing import Process, Queue
 from subprocess import Popen
-import pkg_resources
 from distutils.version import LooseVersion as semvar
 
 
-import arrow
 import gym
 import numpy as np
-from boto.s3.connection import S3Connection
 from gym import spaces
 from gym.utils import seeding
-try:
-    import pyglet
-    from pyglet.gl import GLubyte
-except:
-    pyglet = None
 
+import artifacts
 import config as c
 import logs
 import utils
+from benchmark import BenchmarkWriter
+from gym_deepdrive.envs.clock import WallClock
+from gym_deepdrive.envs.history import ObservationHistory, TELEMETRY_FIELDS
 from utils import obj2dict, download
 from dashboard import dashboard_fn
 
+# Native extensions that load the sim's shared libraries - only imported once we connect
+deepdrive_client = utils.LazyImport('deepdrive_client')
+deepdrive_capture = utils.LazyImport('deepdrive_capture')
+
 log = logs.get_log(__name__)
 SPEED_LIMIT_KPH = 64.
 
@@ -42,8 +39,8 @@ class Score(object):
     progress_reward = 0
     got_stuck = False
 
-    def __init__(self):
-        self.start_time = time.time()
+    def __init__(self, start_time=None):
+        self.start_time = time.time() if start_time is None else start_time
         self.end_time = None
         self.episode_time = 0
 
@@ -98,7 +95,12 @@ class DeepDriveEnv(gym.Env):
         self.preprocess_with_tensorflow = preprocess_with_tensorflow
         self.sess = None
         self.prev_observation = None
-        self.start_time = time.time()
+        self.required_fields = []
+        self.history = None
+
+        # All episode timing goes through the clock so that episodes can run faster than real time, see set_clock
+        self.clock = WallClock()
+        self.start_time = self.clock.now()
         self.step_num = 0
         self.prev_step_time = None
         self.display_stats = OrderedDict()
@@ -113,6 +115,10 @@ class DeepDriveEnv(gym.Env):
         self.dashboard_queue = None
         self.should_exit = False
         self.sim_process = None
+        self.startup_timings = OrderedDict()  # Seconds taken by each stage of starting and attaching to the sim
+        self.startup_mark = None
+        self.last_frame_time = None
+        self.sim_restarts = 0
         self.client_id = None
         self.has_control = None
         self.cameras = None
@@ -128,6 +134,8 @@ class DeepDriveEnv(gym.Env):
         self.fps = None
         self.period = None
         self.experiment = None
+        self.sim_host = c.SIM_HOST
+        self.sim_port = c.SIM_PORT
 
         if not c.REUSE_OPEN_SIM:
             if utils.get_sim_bin_path() is None:
@@ -139,7 +147,7 @@ class DeepDriveEnv(gym.Env):
                     raise NotImplementedError('Sim download not yet implemented for this OS')
             utils.ensure_executable(utils.get_sim_bin_path())
 
-        self.client_version = pkg_resources.get_distribution("deepdrive").version
+        self.client_version = get_client_version()
         # TODO: Check with connection version
 
         # collision detection  # TODO: Remove in favor of in-game detection
@@ -149,7 +157,7 @@ class DeepDriveEnv(gym.Env):
         self.start_distance_along_route = 0
 
         # reward
-        self.score = Score()
+        self.score = Score(self.clock.now())
 
         # laps
         self.lap_number = None
@@ -159,12 +167,13 @@ class DeepDriveEnv(gym.Env):
         # benchmarking - carries over across resets
         self.should_benchmark = False
         self.done_benchmarking = False
-        self.trial_scores = []
+        self.benchmark_writer = None
 
     def open_sim(self):
-        self._kill_competing_procs()
         if c.REUSE_OPEN_SIM:
             return
+        self._kill_competing_procs()
+        self._start_startup_timer()
         if self.use_sim_start_command:
             log.info('Starting simulator with command %s - this will take a few seconds.',
                      c.SIM_START_COMMAND)
@@ -203,11 +212,13 @@ class DeepDriveEnv(gym.Env):
         else:
             log.info('Starting simulator at %s (takes a few seconds the first time).', utils.get_sim_bin_path())
             self.sim_process = Popen([utils.get_sim_bin_path()])
+        self._mark_startup('spawn')
 
     def close_sim(self):
         log.info('Closing sim')
         if self.sim_process is not None:
             self.sim_process.kill()
+            self.sim_process.wait()
 
 
 
@@ -229,6 +240,13 @@ class DeepDriveEnv(gym.Env):
 
 
 
+    def set_clock(self, clock):
+        """Use a WallClock, StepClock or ObservationClock (see clock.py) for episode timing"""
+        self.clock = clock
+        self.start_time = clock.now()
+        self.score = Score(clock.now())
+        self.set_forward_progress()
+
     def set_use_sim_start_command(self, use_sim_start_command):
         self.use_sim_start_command = use_sim_start_command
 
@@ -240,23 +258,34 @@ class DeepDriveEnv(gym.Env):
             os_name = 'linux'
         else:
             raise RuntimeError('Unexpected OS')
-        sim_prefix = 'sim/deepdrive-sim-'
-        conn = S3Connection(anon=True)
-        bucket = conn.get_bucket('deepdrive')
-        deepdrive_version = pkg_resources.get_distribution('deepdrive').version
+        deepdrive_version = get_client_version()
         major_minor = deepdrive_version[:deepdrive_version.rindex('.')]
-        sim_versions = list(bucket.list(sim_prefix + os_name + '-' + major_minor))
-
-        latest_sim_file, path_version = sorted([(x.name, x.name.split('.')[-2])
-                                           for x in sim_versions],
-                                          key=lambda y: y[1])[-1]
+        sim_prefix = 'sim/deepdrive-sim-' + os_name + '-' + major_minor
+
+        def list_sim_files():
+            from boto.s3.connection import S3Connection
+            conn = S3Connection(anon=True)
+            bucket = conn.get_bucket('deepdrive')
+            return [x.name for x in bucket.list(sim_prefix)]
+
+        # Listing the bucket is slow, so the list is cached for a day
+        sim_files = artifacts.get_cache().get_manifest(sim_prefix.replace('/', '_'), list_sim_files)
+        latest_sim_file, path_version = sorted([(name, name.split('.')[-2]) for name in sim_files],
+                                               key=lambda y: y[1])[-1]
         return '/' + latest_sim_file
 
-    def init_benchmarking(self):
+    def init_benchmarking(self, benchmark_writer=None):
+        """benchmark_writer: Anything with add_lap(score) and is_done(), defaults to a BenchmarkWriter"""
         self.should_benchmark = True
-        os.makedirs(c.BENCHMARK_DIR, exist_ok=True)
+        self.benchmark_writer = benchmark_writer or BenchmarkWriter(self.experiment)
+
+    def set_sim_address(self, host, port):
+        self.sim_host = host
+        self.sim_port = port
 
     def init_pyglet(self, cameras):
+        if import_pyglet()[0] is None:
+            return
         q = Queue(maxsize=1)
         p = Process(target=render_cameras, args=(q, cameras))
         p.start()
@@ -282,9 +311,17 @@ class DeepDriveEnv(gym.Env):
         dd_action = Action.from_gym(action)
         self.send_control(dd_action)
         obz = self.get_observation()
+        restart_reason = self.check_sim_health(obz)
+        if restart_reason is not None:
+            # End the episode - benchmark and recording state live outside the episode and carry over
+            self.restart_sim(restart_reason)
+            return None, 0, True, {'sim_restarted': True, 'restart_reason': restart_reason}
+        if obz and self.history is not None:
+            self.history.push(obz)
+        self.clock.tick(obz)
         if obz and 'is_game_driving' in obz:
             self.has_control = not obz['is_game_driving']
-        now = time.time()
+        now = self.clock.now()
         done = False
         reward = self.get_reward(obz, now)
         done = self.compute_lap_statistics(done, obz)
@@ -303,7 +340,45 @@ class DeepDriveEnv(gym.Env):
 
         return obz, reward, done, info
 
+    def check_sim_health(self, obz):
+        """Returns why the sim needs a restart, or None if it's healthy"""
+        if self.sim_process is not None and self.sim_process.poll() is not None:
+            return 'sim exited with code %r' % self.sim_process.returncode
+        now = time.time()
+        if obz:
+            self.last_frame_time = now
+        elif self.last_frame_time is not None:
+            stall_secs = c.SIM_STALL_PERIODS * (self.period or 1. / c.DEFAULT_FPS)
+            if now - self.last_frame_time > stall_secs:
+                return 'no frames for %.1fs' % (now - self.last_frame_time)
+        return None
+
+    def restart_sim(self, reason):
+        if self.sim_process is None:
+            # i.e. with REUSE_OPEN_SIM, where reconnecting would just poll the unhealthy sim until timing out
+            raise RuntimeError('Sim at %s:%d is unhealthy (%s) and was not started by this process, so it can\'t be '
+                               'restarted' % (self.sim_host, self.sim_port, reason))
+        self.sim_restarts += 1
+        if self.sim_restarts > c.SIM_MAX_RESTARTS:
+            raise RuntimeError('Sim failed (%s) after %d restarts, giving up' % (reason, c.SIM_MAX_RESTARTS))
+        log.error('Restarting sim (%d/%d) - %s', self.sim_restarts, c.SIM_MAX_RESTARTS, reason)
+        try:
+            deepdrive_capture.close()
+            deepdrive_client.close(self.client_id)
+        except Exception as e:
+            log.warning('Error closing connection to unhealthy sim - %r', e)
+        self.client_id = 0
+        self.connection_props = None
+        self.close_sim()
+        self.open_sim()
+        self.connect(self.cameras)
+        self.prev_observation = None
+        self.lap_number = None
+
     def regulate_fps(self):
+        if self.clock.is_backend_time:
+            # The backend sets the pace, i.e. a replay, so step as fast as it produces frames
+            return
         now = time.time()
         if self.previous_action_time:
             delta = now - self.previous_action_time
@@ -324,14 +399,15 @@ class DeepDriveEnv(gym.Env):
             self.prev_lap_score = self.score.total
             if self.should_benchmark:
                 self.log_benchmark_trial()
-                if len(self.trial_scores) >= 50:
-                    self.done_benchmarking = True
             else:
                 log.info('lap %d complete with score of %f', self.total_laps, self.score.total)
 
             done = True  # One lap per episode
             self.log_up_time()
         self.lap_number = lap_number
+        if self.should_benchmark and self.benchmark_writer.is_done():
+            # Checked every step, as a parallel benchmark can finish during this env's lap
+            self.done_benchmarking = True
         return done
 
     def get_reward(self, obz, now):
@@ -341,7 +417,6 @@ class DeepDriveEnv(gym.Env):
                 step_time = now - self.prev_step_time
             else:
                 step_time = None
-            now = time.time()
             time_penalty = now - self.score.start_time - self.score.episode_time
             self.score.episode_time = now - self.score.start_time
             if self.score.episode_time < 2.5:
@@ -359,13 +434,16 @@ class DeepDriveEnv(gym.Env):
             self.display_stats['episode score']['value'] = self.score.total
             self.display_stats['episode score']['total'] = self.score.total
 
-            log.debug('reward %r', reward)
-            log.debug('score %r', self.score.total)
+            if logs.DEBUG_ENABLED:
+                log.debug('reward %r', reward)
+                log.debug('score %r', self.score.total)
 
         return reward
 
     def log_up_time(self):
-        log.info('up for %r' % arrow.get(time.time()).humanize(other=arrow.get(self.start_time), only_distance=True))
+        import arrow
+        log.info('up for %r' % arrow.get(self.clock.now()).humanize(other=arrow.get(self.start_time),
+                                                                      only_distance=True))
 
     def get_lane_deviation_penalty(self, obz, time_passed):
         lane_deviation_penalty = 0
@@ -381,8 +459,7 @@ class DeepDriveEnv(gym.Env):
         gforce_penalty = 0
         if 'acceleration' in obz:
             if time_passed is not None:
-                a = obz['acceleration']
-                gforces = np.sqrt(a.dot(a)) / 980  # g = 980 cm/s**2
+                gforces = DeepDriveRewardCalculator.get_gforces(obz['acceleration'])
                 self.display_stats['g-forces']['value'] = gforces
                 self.display_stats['g-forces']['total'] = gforces
                 gforce_penalty = DeepDriveRewardCalculator.get_gforce_penalty(gforces, time_passed)
@@ -418,7 +495,7 @@ class DeepDriveEnv(gym.Env):
             self.steps_crawling += 1
             if obz['throttle'] > 0 and obz['brake'] == 0 and obz['handbrake'] == 0:
                 self.steps_crawling_with_throttle_on += 1
-            time_crawling = time.time() - self.last_forward_progress_time
+            time_crawling = self.clock.now() - self.last_forward_progress_time
             portion_crawling = self.steps_crawling_with_throttle_on / max(1, self.steps_crawling)
             if self.steps_crawling_with_throttle_on > 20 and time_crawling > 10 and portion_crawling > 0.8:
                 log.warn('No progress made while throttle on - assuming stuck and ending episode. steps crawling: %r, '
@@ -434,47 +511,23 @@ class DeepDriveEnv(gym.Env):
         return ret
 
     def log_benchmark_trial(self):
-        self.score.end_time = time.time()
+        self.score.end_time = self.clock.now()
         self.score.episode_time = self.score.end_time - self.score.start_time
         log.info('episode time %r', self.score.episode_time)
-        self.trial_scores.append(self.score)
-        totals = [s.total for s in self.trial_scores]
-        median = np.median(totals)
-        average = np.mean(totals)
-        high = max(totals)
-        low = min(totals)
-        std = np.std(totals)
-        log.info('benchmark lap #%d score: %f - average: %f', len(self.trial_scores), self.score.total, average)
-        file_prefix = self.experiment + '_' if self.experiment else ''
-        filename = os.path.join(c.BENCHMARK_DIR, '%s%s.csv' % (file_prefix, c.DATE_STR))
-        with open(filename, 'w', newline='') as csv_file:
-            writer = csv.writer(csv_file)
-            for i, score in enumerate(self.trial_scores):
-                if i == 0:
-                    writer.writerow(['episode #', 'score', 'progress reward', 'lane deviation penalty',
-                                     'gforce penalty', 'got stuck', 'start', 'end', 'lap time'])
-                writer.writerow([i + 1, score.total,
-                                 score.progress_reward, score.lane_deviation_penalty,
-                                 score.gforce_penalty, score.got_stuck, str(arrow.get(score.start_time).to('local')),
-                                 str(arrow.get(score.end_time).to('local')),
-                                 score.episode_time])
-            writer.writerow([])
-            writer.writerow(['median score', median])
-            writer.writerow(['avg score', average])
-            writer.writerow(['std', std])
-            writer.writerow(['high score', high])
-            writer.writerow(['low score', low])
-
-        log.info('median score %r', median)
-        log.info('avg score %r', average)
-        log.info('std %r', std)
-        log.info('high score %r', high)
-        log.info('low score %r', low)
+        if self.benchmark_writer is None:
+            self.benchmark_writer = BenchmarkWriter(self.experiment)
+        stats = self.benchmark_writer.add_lap(self.score)
+        log.info('benchmark lap #%d score: %f - average: %f', stats.count, self.score.total, stats.mean)
+        log.info('median score %r', stats.median)
+        log.info('avg score %r', stats.mean)
+        log.info('std %r', stats.std)
+        log.info('high score %r', stats.max)
+        log.info('low score %r', stats.min)
         log.info('progress_reward %r', self.score.progress_reward)
         log.info('lane_deviation_penalty %r', self.score.lane_deviation_penalty)
         log.info('gforce_penalty %r', self.score.gforce_penalty)
         log.info('episode_time %r', self.score.episode_time)
-        log.info('wrote results to %s', os.path.normpath(filename))
+        log.info('wrote results to %s', os.path.normpath(self.benchmark_writer.csv_filename))
 
     def release_agent_control(self):
         self.has_control = deepdrive_client.release_agent_control(self.client_id) is not None
@@ -484,19 +537,21 @@ class DeepDriveEnv(gym.Env):
 
     # noinspection PyAttributeOutsideInit
     def set_forward_progress(self):
-        self.last_forward_progress_time = time.time()
+        self.last_forward_progress_time = self.clock.now()
         self.steps_crawling_with_throttle_on = 0
         self.steps_crawling = 0
 
     def reset(self):
         self.prev_observation = None
+        if self.history is not None:
+            self.history.clear()
         self.reset_agent()
         self.step_num = 0
         self.distance_along_route = 0
         self.start_distance_along_route = 0
         self.prev_step_time = None
-        self.score = Score()
-        self.start_time = time.time()
+        self.score = Score(self.clock.now())
+        self.start_time = self.clock.now()
         log.info('Reset complete')
 
     def change_viewpoint(self, cameras, use_sim_start_command):
@@ -532,54 +587,94 @@ class DeepDriveEnv(gym.Env):
             if self.one_frame_render:
                 for camera in self.prev_observation['cameras']:
                     utils.show_camera(camera['image'], camera['depth'])
-            elif self.pyglet_render and pyglet is not None and self.pyglet_queue is not None:
+            elif self.pyglet_render and self.pyglet_queue is not None:
                 self.pyglet_queue.put(self.prev_observation['cameras'])
 
     def seed(self, seed=None):
         self.np_random = seeding.np_random(seed)
         # TODO: Generate random actions with this seed
 
+    def set_required_fields(self, fields):
+        """Observation fields are computed on first access. Fields listed here are computed every step instead.
+        Camera fields are prefixed with 'cameras.', i.e. ['speed', 'cameras.image']"""
+        self.required_fields = list(fields or [])
+
+    def set_history(self, k, camera_fields=('image',), telemetry_fields=TELEMETRY_FIELDS):
+        """Keep the last k frames and telemetry values within the episode in preallocated ring buffers, see
+        get_frame_history. k of 0 or None turns history off."""
+        self.history = ObservationHistory(k, camera_fields, telemetry_fields) if k else None
+
+    def get_frame_history(self, camera_index=0, field='image', n=None):
+        """(n, height, width, channels) view of the camera's last n frames, oldest first, i.e. for frame stacking.
+        Valid until the next step."""
+        return self.history.get_frames(camera_index, field, n)
+
+    def get_telemetry_history(self, field, n=None):
+        return self.history.get_telemetry(field, n)
+
     def preprocess_observation(self, observation):
         if observation:
-            ret = obj2dict(observation, exclude=['cameras'])
+            ret = obj2dict(observation, exclude=['cameras'], lazy=True)
             if observation.camera_count > 0 and getattr(observation, 'cameras', None) is not None:
                 cameras = observation.cameras
                 ret['cameras'] = self.preprocess_cameras(cameras)
             else:
                 ret['cameras'] = []
+            for field in self.required_fields:
+                if field.startswith('cameras.'):
+                    for camera in ret['cameras']:
+                        camera.get(field[len('cameras.'):])
+                else:
+                    ret.get(field)
         else:
             ret = None
         return ret
 
     def preprocess_cameras(self, cameras):
+        """Only preprocessing is deferred. The raw capture buffers are copied now, as the native capture memory can
+        be reused by the next step or freed on restart before lazy fields are read, i.e. when recordings are saved."""
         ret = []
         for camera in cameras:
-            image = camera.image_data.reshape(camera.capture_height, camera.capture_width, 3)
-            depth = camera.depth_data.reshape(camera.capture_height, camera.capture_width)
-            start_preprocess = time.time()
-            if self.preprocess_with_tensorflow:
-                import tf_utils  # avoid hard requirement on tensorflow
-                if self.sess is None:
-                    raise Exception('No tensorflow session. Did you call set_tf_session?')
-                # This runs ~2x slower (18ms on a gtx 980) than CPU when we are not running a model due to
-                # transfer overhead, but we do it anyway to keep training and testing as similar as possible.
-                image = tf_utils.preprocess_image(image, self.sess)
-                depth = tf_utils.preprocess_depth(depth, self.sess)
-            else:
-                image = utils.preprocess_image(image)
-                depth = utils.preprocess_depth(depth)
-
-            end_preprocess = time.time()
-            log.debug('preprocess took %rms', (end_preprocess - start_preprocess) * 1000.)
-            camera_out = obj2dict(camera, exclude=['image', 'depth'])
-            camera_out['image'] = image
+            camera_out = obj2dict(camera, exclude=['image', 'depth', 'image_data', 'depth_data'], lazy=True)
+            image_data = np.array(camera.image_data, copy=True)
+            depth_data = np.array(camera.depth_data, copy=True)
+            camera_out['image_data'] = image_data
+            camera_out['depth_data'] = depth_data
+            camera_out.set_lazy('image', partial(self.preprocess_camera_image, image_data, camera.capture_height,
+                                                 camera.capture_width))
+            camera_out.set_lazy('depth', partial(self.preprocess_camera_depth, depth_data, camera.capture_height,
+                                                 camera.capture_width))
             if self.pyglet_render:
                 # Keep copy of image without mean subtraction etc that agent does
-                camera_out['image_raw'] = image
-            camera_out['depth'] = depth
+                camera_out.set_lazy('image_raw', partial(camera_out.__getitem__, 'image'))
             ret.append(camera_out)
         return ret
 
+    def preprocess_camera_image(self, image_data, height, width):
+        image = image_data.reshape(height, width, 3)
+        start_preprocess = time.time()
+        if self.preprocess_with_tensorflow:
+            # This runs ~2x slower (18ms on a gtx 980) than CPU when we are not running a model due to
+            # transfer overhead, but we do it anyway to keep training and testing as similar as possible.
+            image = self._get_tf_utils().preprocess_image(image, self.sess)
+        else:
+            image = utils.preprocess_image(image)
+        if logs.DEBUG_ENABLED:
+            log.debug('image preprocess took %rms', (time.time() - start_preprocess) * 1000.)
+        return image
+
+    def preprocess_camera_depth(self, depth_data, height, width):
+        depth = depth_data.reshape(height, width)
+        if self.preprocess_with_tensorflow:
+            return self._get_tf_utils().preprocess_depth(depth, self.sess)
+        return utils.preprocess_depth(depth)
+
+    def _get_tf_utils(self):
+        import tf_utils  # avoid hard requirement on tensorflow
+        if self.sess is None:
+            raise Exception('No tensorflow session. Did you call set_tf_session?')
+        return tf_utils
+
     def get_observation(self):
         try:
             obz = deepdrive_capture.step()
@@ -588,7 +683,6 @@ class DeepDriveEnv(gym.Env):
             ret = None
         else:
             ret = self.preprocess_observation(obz)
-        log.debug('completed capture step')
         self.prev_observation = ret
         return ret
 
@@ -602,42 +696,14 @@ class DeepDriveEnv(gym.Env):
                                             brake=action.brake, handbrake=action.handbrake)
 
     def connect(self, cameras=None, render=False):
-        def _connect():
-            try:
-                self.connection_props = deepdrive_client.create('127.0.0.1', 9876)
-                if isinstance(self.connection_props, int):
-                    raise Exception('You have an old version of the deepdrive client - try uninstalling and reinstalling with pip')
-                if not self.connection_props or not self.connection_props['max_capture_resolution']:
-                    # Try again
-                    return
-                self.client_id = self.connection_props['client_id']
-                server_version = semvar(self.connection_props['server_protocol_version']).version
-                # TODO: For dev, store hash of .cpp and .h files on extension build inside VERSION_DEV, then when
-                #   connecting, compute same hash and compare. (Need to figure out what to do on dev packaged version as
-                #   files may change - maybe ignore as it's uncommon).
-                #   Currently, we timestamp the build, and set that as the version in the extension. This is fine unless
-                #   you change shared code and build the extension only, then the versions won't change, and you could
-                #   see incompatibilities.
-
-                if semvar(self.client_version).version[:2] != server_version[:2]:
-                    raise RuntimeError('Server and client major/minor version do not match - server is %s and client is %s' %
-                                       (server_version, self.client_version))
-
-            except deepdrive_client.time_out:
-                _connect()
-
-        _connect()
-        cxn_attempts = 0
-        max_cxn_attempts = 10
-        while not self.connection_props:
-            cxn_attempts += 1
-            sleep = cxn_attempts + random.random() * 2  # splay to avoid thundering herd
-            log.warning('Connection to environment failed, retry (%d/%d) in %d seconds',
-                        cxn_attempts, max_cxn_attempts, round(sleep, 0))
-            time.sleep(sleep)
-            _connect()
-            if cxn_attempts >= max_cxn_attempts:
-                raise RuntimeError('Could not connect to the environment')
+        """Attach to the sim, polling each stage at short intervals until it's ready or SIM_CONNECT_TIMEOUT passes"""
+        if self.startup_mark is None:
+            self._start_startup_timer()
+        deadline = time.time() + c.SIM_CONNECT_TIMEOUT
+        self.connection_props = utils.poll(self._try_create_client, deadline - time.time())
+        if not self.connection_props:
+            raise RuntimeError('Could not connect to the environment')
+        self._mark_startup('rpc')
 
         if cameras is None:
             cameras = [c.DEFAULT_CAM]
@@ -652,44 +718,75 @@ class DeepDriveEnv(gym.Env):
                                                               cam['name'])
 
             shared_mem = deepdrive_client.get_shared_memory(self.client_id)
-            self.reset_capture(shared_mem[0], shared_mem[1])
+            self.reset_capture(shared_mem[0], shared_mem[1], timeout=deadline - time.time())
             self._init_observation_space()
         else:
             self.raise_connect_fail()
+        self._mark_startup('shared_mem')
         if render:
             self.init_pyglet(cameras)
 
-        self._perform_first_step()
+        self._perform_first_step(timeout=deadline - time.time())
+        self._mark_startup('first_frame')
+        self.last_frame_time = time.time()
         self.has_control = False
+        log.info('Attached to sim - %s', ', '.join('%s %dms' % (k, v * 1000) for k, v in
+                                                   self.startup_timings.items()))
+        self.startup_mark = None
 
-    def _perform_first_step(self):
-        obz = None
-        read_obz_count = 0
-        while obz is None:
-            if read_obz_count > 10:
-                error_msg = 'Failed first step of environment'
-                log.error(error_msg)
-                raise RuntimeError(error_msg)
+    def _try_create_client(self):
+        """Returns the connection properties if the sim's RPC server is up, else None"""
+        try:
+            connection_props = deepdrive_client.create(self.sim_host, self.sim_port)
+        except deepdrive_client.time_out:
+            return None
+        if isinstance(connection_props, int):
+            raise Exception('You have an old version of the deepdrive client - try uninstalling and reinstalling with pip')
+        if not connection_props or not connection_props['max_capture_resolution']:
+            # Not ready yet
+            return None
+        self.client_id = connection_props['client_id']
+        server_version = semvar(connection_props['server_protocol_version']).version
+        # TODO: For dev, store hash of .cpp and .h files on extension build inside VERSION_DEV, then when
+        #   connecting, compute same hash and compare. (Need to figure out what to do on dev packaged version as
+        #   files may change - maybe ignore as it's uncommon).
+        #   Currently, we timestamp the build, and set that as the version in the extension. This is fine unless
+        #   you change shared code and build the extension only, then the versions won't change, and you could
+        #   see incompatibilities.
+
+        if semvar(self.client_version).version[:2] != server_version[:2]:
+            raise RuntimeError('Server and client major/minor version do not match - server is %s and client is %s' %
+                               (server_version, self.client_version))
+        return connection_props
+
+    def _start_startup_timer(self):
+        self.startup_timings = OrderedDict()
+        self.startup_mark = time.time()
+
+    def _mark_startup(self, stage):
+        """Records the time since the previous startup stage finished"""
+        now = time.time()
+        self.startup_timings[stage] = now - self.startup_mark
+        self.startup_mark = now
+
+    def _perform_first_step(self, timeout=c.SIM_CONNECT_TIMEOUT):
+        def step():
             try:
-                obz = deepdrive_capture.step()
+                return deepdrive_capture.step()
             except SystemError as e:
                 log.error('caught error during step' + str(e))
-            time.sleep(0.25)
-            read_obz_count += 1
 
-    def reset_capture(self, shared_mem_name, shared_mem_size):
-        n = 10
-        sleep = 0.1
+        if utils.poll(step, timeout) is None:
+            error_msg = 'Failed first step of environment'
+            log.error(error_msg)
+            raise RuntimeError(error_msg)
+
+    def reset_capture(self, shared_mem_name, shared_mem_size, timeout=c.SIM_CONNECT_TIMEOUT):
         log.debug('Connecting to deepdrive...')
-        while n > 0:
-            # TODO: Establish some handshake so we don't hardcode size here and in Unreal project
-            if deepdrive_capture.reset(shared_mem_name, shared_mem_size):
-                log.debug('Connected to deepdrive shared capture memory')
-                return
-            n -= 1
-            sleep *= 2
-            log.debug('Sleeping %r', sleep)
-            time.sleep(sleep)
+        # TODO: Establish some handshake so we don't hardcode size here and in Unreal project
+        if utils.poll(lambda: deepdrive_capture.reset(shared_mem_name, shared_mem_size), timeout):
+            log.debug('Connected to deepdrive shared capture memory')
+            return
         log.error('Could not connect to deepdrive capture memory at %s', shared_mem_name)
         self.raise_connect_fail()
 
@@ -736,38 +833,49 @@ class DeepDriveEnv(gym.Env):
 
 
 class DeepDriveRewardCalculator(object):
+    MAX_REWARD = 1e2
+    LANE_DEVIATION_COEFF = 0.1
+    LANE_DEVIATION_THRESHOLD = 200  # Tuned for Canyons spline - change for future maps
+    GFORCE_COEFF = 24  # 24 meters of reward every second you do this
+    GFORCE_THRESHOLD = 0.5
+    MAX_TIME_WEIGHTED_GS = 5  # Don't allow a large frame skip to ruin the approximation
+    PROGRESS_COEFF = 1.0
+    LAP_COMPLETE_VELOCITY = -400 * 100
+
     @staticmethod
     def clip(reward):
         # time_passed not parameter in order to set hard limits on reward magnitude
-        return min(max(reward, -1e2), 1e2)
+        return min(max(reward, -DeepDriveRewardCalculator.MAX_REWARD), DeepDriveRewardCalculator.MAX_REWARD)
 
     @staticmethod
     def get_lane_deviation_penalty(lane_deviation, time_passed):
         lane_deviation_penalty = 0
         if lane_deviation < 0:
             raise ValueError('Lane deviation should be positive')
-        if time_passed is not None and lane_deviation > 200:  # Tuned for Canyons spline - change for future maps
-            lane_deviation_coeff = 0.1
+        if time_passed is not None and lane_deviation > DeepDriveRewardCalculator.LANE_DEVIATION_THRESHOLD:
+            lane_deviation_coeff = DeepDriveRewardCalculator.LANE_DEVIATION_COEFF
             lane_deviation_penalty = lane_deviation_coeff * time_passed * lane_deviation ** 2 / 100.
-        log.debug('distance_to_center_of_lane %r', lane_deviation)
+        if logs.DEBUG_ENABLED:
+            log.debug('distance_to_center_of_lane %r', lane_deviation)
         lane_deviation_penalty = DeepDriveRewardCalculator.clip(lane_deviation_penalty)
         return lane_deviation_penalty
 
     @staticmethod
     def get_gforce_penalty(gforces, time_passed):
-        log.debug('gforces %r', gforces)
+        if logs.DEBUG_ENABLED:
+            log.debug('gforces %r', gforces)
         gforce_penalty = 0
         if gforces < 0:
             raise ValueError('G-Force should be positive')
-        if gforces > 0.5:
+        if gforces > DeepDriveRewardCalculator.GFORCE_THRESHOLD:
             # https://www.quora.com/Hyperloop-What-is-a-physically-comfortable-rate-of-acceleration-for-human-beings
             time_weighted_gs = time_passed * gforces
-            time_weighted_gs = min(time_weighted_gs,
-                                   5)  # Don't allow a large frame skip to ruin the approximation
-            balance_coeff = 24  # 24 meters of reward every second you do this
+            time_weighted_gs = min(time_weighted_gs, DeepDriveRewardCalculator.MAX_TIME_WEIGHTED_GS)
+            balance_coeff = DeepDriveRewardCalculator.GFORCE_COEFF
             gforce_penalty = time_weighted_gs * balance_coeff
-            log.debug('accumulated_gforce %r', time_weighted_gs)
-            log.debug('gforce_penalty %r', gforce_penalty)
+            if logs.DEBUG_ENABLED:
+                log.debug('accumulated_gforce %r', time_weighted_gs)
+                log.debug('gforce_penalty %r', gforce_penalty)
         gforce_penalty = DeepDriveRewardCalculator.clip(gforce_penalty)
         return gforce_penalty
 
@@ -775,18 +883,81 @@ class DeepDriveRewardCalculator(object):
     def get_progress_reward(progress, time_passed):
         if time_passed is not None:
             step_velocity = progress / time_passed
-            if step_velocity < -400 * 100:
+            if step_velocity < DeepDriveRewardCalculator.LAP_COMPLETE_VELOCITY:
                 # Lap completed
                 # TODO: Read the lap length on reset and
                 log.debug('assuming lap complete, progress zero')
                 progress = 0
         progress_reward = progress / 100.  # cm=>meters
-        balance_coeff = 1.0
+        balance_coeff = DeepDriveRewardCalculator.PROGRESS_COEFF
         progress_reward *= balance_coeff
         progress_reward = DeepDriveRewardCalculator.clip(progress_reward)
         return progress_reward
 
+    # Array versions of the above for scoring whole trajectories at once, i.e. relabel_rewards.py.
+    # A time_passed of NaN is equivalent to None in the scalar versions.
+
+    @staticmethod
+    def clip_array(rewards):
+        return np.clip(rewards, -DeepDriveRewardCalculator.MAX_REWARD, DeepDriveRewardCalculator.MAX_REWARD)
+
+    @staticmethod
+    def get_lane_deviation_penalties(lane_deviations, time_passed, coeff=LANE_DEVIATION_COEFF,
+                                     threshold=LANE_DEVIATION_THRESHOLD):
+        lane_deviations = np.asarray(lane_deviations, dtype=np.float64)
+        time_passed = np.asarray(time_passed, dtype=np.float64)
+        if np.any(lane_deviations < 0):
+            raise ValueError('Lane deviation should be positive')
+        with np.errstate(invalid='ignore'):
+            penalties = coeff * time_passed * lane_deviations ** 2 / 100.
+            penalties = np.where((lane_deviations > threshold) & ~np.isnan(time_passed), penalties, 0.)
+        return DeepDriveRewardCalculator.clip_array(penalties)
+
+    @staticmethod
+    def get_gforce_penalties(gforces, time_passed, coeff=GFORCE_COEFF, threshold=GFORCE_THRESHOLD):
+        gforces = np.asarray(gforces, dtype=np.float64)
+        time_passed = np.asarray(time_passed, dtype=np.float64)
+        if np.any(gforces < 0):
+            raise ValueError('G-Force should be positive')
+        with np.errstate(invalid='ignore'):
+            time_weighted_gs = np.minimum(time_passed * gforces, DeepDriveRewardCalculator.MAX_TIME_WEIGHTED_GS)
+            penalties = np.where((gforces > threshold) & ~np.isnan(time_passed), time_weighted_gs * coeff, 0.)
+        return DeepDriveRewardCalculator.clip_array(penalties)
+
+    @staticmethod
+    def get_progress_rewards(progress, time_passed, coeff=PROGRESS_COEFF):
+        progress = np.asarray(progress, dtype=np.float64)
+        time_passed = np.asarray(time_passed, dtype=np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            lap_completed = progress / time_passed < DeepDriveRewardCalculator.LAP_COMPLETE_VELOCITY
+        progress = np.where(lap_completed, 0., progress)
+        rewards = progress / 100. * coeff  # cm=>meters
+        return DeepDriveRewardCalculator.clip_array(rewards)
+
+    @staticmethod
+    def get_gforces(accelerations):
+        """G-forces from an array of acceleration vectors in cm/s**2"""
+        a = np.asarray(accelerations, dtype=np.float64)
+        return np.sqrt(np.sum(a * a, axis=-1)) / 980  # g = 980 cm/s**2
+
+
+def get_client_version():
+    import pkg_resources
+    return pkg_resources.get_distribution('deepdrive').version
+
+
+def import_pyglet():
+    """Returns (pyglet, GLubyte), or (None, None) if pyglet or OpenGL are unavailable"""
+    try:
+        import pyglet
+        from pyglet.gl import GLubyte
+        return pyglet, GLubyte
+    except:
+        return None, None
+
+
 def render_cameras(render_queue, cameras):
+    pyglet, GLubyte = import_pyglet()
     if pyglet is None:
         return
     widths = []
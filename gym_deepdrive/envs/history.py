@@ -0,0 +1,81 @@
+import numpy as np
+
+TELEMETRY_FIELDS = ['speed', 'steering', 'throttle', 'brake', 'angular_velocity', 'acceleration', 'forward_vector']
+
+
+class RingHistory(object):
+    """The last k values of a fixed shape array, available as a contiguous view into a preallocated buffer.
+
+    Values are written in place one after the other. When the buffer is full, the newest k - 1 values are moved to
+    the front, so with the default capacity of 8k there is one such move per 7k pushes and no allocations.
+    Views are only valid until the next push - copy them to keep them longer.
+    """
+    def __init__(self, k, shape, dtype, capacity=None):
+        self.k = k
+        self.capacity = capacity or 8 * k
+        if self.capacity < 2 * k:
+            raise ValueError('Capacity must be at least twice the history length')
+        self.buffer = np.zeros((self.capacity,) + tuple(shape), dtype=dtype)
+        self.end = 0  # One past the newest value
+        self.count = 0
+
+    def push(self, value):
+        if self.end == self.capacity:
+            keep = self.k - 1
+            if keep:
+                self.buffer[:keep] = self.buffer[self.end - keep:self.end]
+            self.end = keep
+        self.buffer[self.end] = value
+        self.end += 1
+        self.count = min(self.count + 1, self.k)
+
+    def last(self, n=None):
+        """Up to n (default k) most recent values, oldest first"""
+        n = self.count if n is None else min(n, self.count)
+        return self.buffer[self.end - n:self.end]
+
+    def clear(self):
+        self.end = 0
+        self.count = 0
+
+
+class ObservationHistory(object):
+    """Recent camera frames and telemetry, so agents can stack frames or take differences without keeping copies of
+    observations. Buffers are allocated on the first observation, and again if camera sizes change."""
+    def __init__(self, k, camera_fields=('image',), telemetry_fields=TELEMETRY_FIELDS):
+        self.k = k
+        self.camera_fields = list(camera_fields)
+        self.telemetry_fields = list(telemetry_fields)
+        self.cameras = []  # One {field: RingHistory} per camera
+        self.telemetry = {}
+
+    @staticmethod
+    def _push(histories, name, value, k):
+        value = np.asarray(value)
+        history = histories.get(name)
+        if history is None or history.buffer.shape[1:] != value.shape or history.buffer.dtype != value.dtype:
+            history = histories[name] = RingHistory(k, value.shape, value.dtype)
+        history.push(value)
+
+    def push(self, obz):
+        cameras = obz['cameras']
+        if len(self.cameras) != len(cameras):
+            self.cameras = [{} for _ in cameras]
+        for camera, histories in zip(cameras, self.cameras):
+            for field in self.camera_fields:
+                self._push(histories, field, camera[field], self.k)
+        for field in self.telemetry_fields:
+            if field in obz:
+                self._push(self.telemetry, field, obz[field], self.k)
+
+    def get_frames(self, camera_index=0, field='image', n=None):
+        """(n, height, width, ...) view of the last n frames of a camera, oldest first"""
+        return self.cameras[camera_index][field].last(n)
+
+    def get_telemetry(self, field, n=None):
+        return self.telemetry[field].last(n)
+
+    def clear(self):
+        for histories in self.cameras + [self.telemetry]:
+            for history in histories.values():
+                history.clear()
@@ -1,37 +1,152 @@
+import atexit
+import copy
+import json
+import multiprocessing.util
 import os
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import sys
 
 import config as c
 
 
-os.makedirs(c.LOG_DIR, exist_ok=True)
+class LazyRotatingFileHandler(logging.Handler):
+    """Creates the log directory and opens the log file on the first record, so importing a module that calls
+    get_log does not resolve DEEPDRIVE_DIR or touch the filesystem"""
+    def __init__(self, filename, **kwargs):
+        logging.Handler.__init__(self)
+        self.filename = filename
+        self.kwargs = kwargs
+        self.handler = None
+
+    def setFormatter(self, fmt):
+        logging.Handler.setFormatter(self, fmt)
+        if self.handler is not None:
+            self.handler.setFormatter(fmt)
+
+    def emit(self, record):
+        if self.handler is None:
+            log_dir = os.path.dirname(self.get_filename())
+            os.makedirs(log_dir, exist_ok=True)
+            self.handler = RotatingFileHandler(self.get_filename(), **self.kwargs)
+            self.handler.setFormatter(self.formatter)
+        self.handler.emit(record)
+
+    def get_filename(self):
+        return os.path.join(c.LOG_DIR, self.filename)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line. Fields passed with extra={...} are included alongside the standard ones."""
+    STANDARD_ATTRS = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+
+    def format(self, record):
+        ret = dict(time=record.created, name=record.name, level=record.levelname, message=record.getMessage(),
+                   process=record.process, thread=record.threadName)
+        for k, v in record.__dict__.items():
+            if k not in self.STANDARD_ATTRS:
+                ret[k] = v
+        if record.exc_info:
+            ret['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(ret, default=repr)
+
+
+class AsyncHandler(QueueHandler):
+    """Puts records on a queue for a background thread to write to the sink handlers, so that formatting, file
+    writes and rotation don't happen on the caller's thread. Only the message is interpolated on the caller's thread,
+    so later changes to logged objects don't show up. Threads don't survive fork, so a child process gets its own
+    queue and listener on its first record."""
+    def __init__(self, sinks):
+        QueueHandler.__init__(self, None)
+        self.sinks = list(sinks)
+        self.listener = None
+        self.pid = None
+
+    def emit(self, record):
+        if self.pid != os.getpid():
+            self.start()
+        QueueHandler.emit(self, record)
+
+    def prepare(self, record):
+        """Unlike QueueHandler.prepare, leaves formatting, including of exc_info, to the sinks"""
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def start(self):
+        self.pid = os.getpid()
+        self.queue = queue.Queue()
+        self.listener = QueueListener(self.queue, *self.sinks)
+        self.listener.start()
+        atexit.register(self.stop)
+        # multiprocessing children exit without running atexit handlers
+        multiprocessing.util.Finalize(self, self.stop, exitpriority=-100)
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+        if self.listener is not None:
+            self.listener.handlers = tuple(self.sinks)
+
+    def stop(self):
+        """Writes any queued records and stops the listener thread"""
+        if self.listener is not None and self.pid == os.getpid():
+            listener, self.listener, self.pid = self.listener, None, None
+            listener.stop()
+
+
 log_format = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-log_rotator = RotatingFileHandler(os.path.join(c.LOG_DIR, 'log.txt'), maxBytes=(1048576 * 5), backupCount=7)
+log_rotator = LazyRotatingFileHandler('log.txt', maxBytes=(1048576 * 5), backupCount=7)
 log_rotator.setFormatter(log_format)
+console_handler = logging.StreamHandler(sys.stdout)
+console_handler.setFormatter(log_format)
+async_handler = AsyncHandler([console_handler, log_rotator])
+rotator_handlers = {}
 log_level = logging.INFO
 all_loggers = []
 
-def get_log(namespace, rotator=log_rotator):
+# Check before building expensive debug messages or issuing several log.debug calls in per-step code, i.e.
+#   if logs.DEBUG_ENABLED:
+#       log.debug(...)
+# as this is a single global lookup. Kept in sync with set_level.
+DEBUG_ENABLED = log_level <= logging.DEBUG
+
+
+def get_log(namespace, rotator=None):
     ret = logging.getLogger(namespace)
     ret.setLevel(log_level)
-    ch = logging.StreamHandler(sys.stdout)
-    ch.setFormatter(log_format)
-    ret.addHandler(ch)
-    ret.addHandler(rotator)
-    all_loggers.append(ret)
+    if rotator is None:
+        handler = async_handler
+    else:
+        if rotator not in rotator_handlers:
+            rotator_handlers[rotator] = AsyncHandler([console_handler, rotator])
+        handler = rotator_handlers[rotator]
+    if not any(isinstance(h, AsyncHandler) for h in ret.handlers):
+        ret.addHandler(handler)
+    if ret not in all_loggers:
+        all_loggers.append(ret)
     return ret
 
 
 def set_level(level):
-    global log_level
+    global log_level, DEBUG_ENABLED
     log_level = level
+    DEBUG_ENABLED = level <= logging.DEBUG
     for l in all_loggers:
         l.setLevel(level)
 
+
+def add_json_sink(filename='log.jsonl'):
+    """Also write all logs as JSON lines to filename, relative to the log directory unless absolute"""
+    sink = LazyRotatingFileHandler(filename, maxBytes=(1048576 * 5), backupCount=7)
+    sink.setFormatter(JsonFormatter())
+    async_handler.add_sink(sink)
+    return sink
+
+
 def log_manual():
-    test_log_rotator = RotatingFileHandler(os.path.join(c.LOG_DIR, 'test.txt'), maxBytes=3, backupCount=7)
+    test_log_rotator = LazyRotatingFileHandler('test.txt', maxBytes=3, backupCount=7)
     log1 = get_log('log1', rotator=test_log_rotator)
     log2 = get_log('log2', rotator=test_log_rotator)
     log1.info('asdf')
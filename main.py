@@ -9,7 +9,6 @@ import time
 import camera_config
 import config as c
 import logs
-import deepdrive
 
 
 def main():
@@ -23,8 +22,12 @@ def main():
                         help='Trains tensorflow agent on stored driving data')
     parser.add_argument('--use-last-model', action='store_true', default=False,
                         help='Run the most recently trained model')
-    parser.add_argument('--recording-dir', nargs='?', default=c.RECORDING_DIR, help='Where to store and read recorded '
-                                                                                    'environment data from')
+    parser.add_argument('--use-best-model', action='store_true', default=False,
+                        help='Run the checkpoint with the lowest eval loss from the most recent training session')
+    parser.add_argument('--recording-dir', nargs='?', default=None, help='Where to store and read recorded environment data '
+                                                                           'from. Defaults to <DEEPDRIVE_DIR>/recordings')
+    parser.add_argument('--record-all-frames', action='store_true', default=False,
+                        help='Record every frame, instead of skipping near duplicates and most straight driving')
     parser.add_argument('--render', action='store_true', default=False,
                         help='SLOW: render of camera data in Python - Use Unreal for real time camera rendering')
     parser.add_argument('--record-recovery-from-random-actions', action='store_true', default=False,
@@ -33,43 +36,67 @@ def main():
                         help='Whether to let the in-game path follower drive')
     parser.add_argument('--net-path', nargs='?', default=None,
                         help='Path to the tensorflow checkpoint you want to test drive. '
-                             'i.e. /home/a/DeepDrive/tensorflow/2018-01-01__11-11-11AM_train/model.ckpt-98331')
+                             'i.e. /home/a/DeepDrive/tensorflow/2018-01-01__11-11-11AM_train/model.ckpt-98331, '
+                             'or a .tflite model exported with tensorflow_agent/quantize.py (mobilenet backbone only)')
     parser.add_argument('--resume-train', nargs='?', default=None,
                         help='Path to the tensorflow training session you want to resume, '
                              'i.e. /home/a/DeepDrive/tensorflow/2018-01-01__11-11-11AM_train')
     parser.add_argument('-v', '--verbose', help='Increase output verbosity',
                         action='store_true')
+    parser.add_argument('--json-log', nargs='?', const='log.jsonl', default=None,
+                        help='Also write logs as JSON lines to this file, relative to <DEEPDRIVE_DIR>/log')
     parser.add_argument('--camera-rigs', nargs='?', default=None, help='Name of camera rigs to use')
     parser.add_argument('-n', '--experiment-name', nargs='?', default=None, help='Name of your experiment')
     parser.add_argument('--fps', type=int, default=c.DEFAULT_FPS, help='Frames / steps per second')
+    parser.add_argument('--clock', default='wall', choices=['wall', 'step', 'observation'],
+                        help='Episode time source. "step" advances 1 / fps per step, "observation" uses sim '
+                             'timestamps and runs as fast as the sim produces frames')
+    parser.add_argument('--batch-size', type=int, default=None,
+                        help='Training batch size. By default, the fastest that fits in memory is measured on the '
+                             'first run on a host and reused after that, see tensorflow_agent/train/autotune.py')
+    parser.add_argument('--checkpoint-every-steps', type=int, default=1000,
+                        help='Training steps between checkpoints, which are written in the background')
+    parser.add_argument('--keep-best-checkpoints', type=int, default=3,
+                        help='Number of checkpoints with the lowest eval loss to keep, besides the most recent ones')
+    parser.add_argument('--num-towers', type=int, default=None,
+                        help='Number of devices to split each training batch across. Defaults to all local GPUs. '
+                             'Creates virtual CPU devices when there are no GPUs.')
+    parser.add_argument('--backbone', nargs='?', default=None,
+                        help='Network backbone to train or run, i.e. alexnet or mobilenet for CPU-only hosts. '
+                             'Defaults to the one the checkpoint was trained with, or %s' % c.DEFAULT_BACKBONE)
 
 
     args = parser.parse_args()
     if args.verbose:
         logs.set_level(logging.DEBUG)
+    if args.json_log:
+        logs.add_json_sink(args.json_log)
 
     if args.camera_rigs:
         camera_rigs = camera_config.rigs[args.camera_rigs]
     else:
         camera_rigs = camera_config.rigs['baseline_rigs']
 
-    if args.use_last_model:
+    if args.use_last_model or args.use_best_model:
         if args.train:
             args.resume_train = get_latest_model()
         else:
-            args.net_path = get_latest_model()
+            args.net_path = get_latest_model(best=args.use_best_model)
 
     if args.train:
         from tensorflow_agent.train import train
         # TODO: Add experiment name here as well, and integrate it into Tensorflow runs, recording names, model checkpoints, etc...
-        train.run(resume_dir=args.resume_train, recording_dir=args.recording_dir)
+        train.run(resume_dir=args.resume_train, recording_dir=args.recording_dir, batch_size=args.batch_size,
+                  num_towers=args.num_towers, checkpoint_every_steps=args.checkpoint_every_steps,
+                  keep_best_checkpoints=args.keep_best_checkpoints, backbone=args.backbone)
     elif args.path_follower:
+        import deepdrive
         done = False
         render = False
         episode_count = 1
         gym_env = None
         try:
-            gym_env = deepdrive.start(args.experiment_name, args.env_id, fps=args.fps)
+            gym_env = deepdrive.start(args.experiment_name, args.env_id, fps=args.fps, clock=args.clock)
             log.info('Path follower drive mode')
             for episode in range(episode_count):
                 if done:
@@ -99,18 +126,26 @@ def main():
                   should_record=args.record, net_path=args.net_path, env_id=args.env_id,
                   run_baseline_agent=args.baseline, render=args.render, camera_rigs=camera_rigs,
                   should_record_recovery_from_random_actions=args.record_recovery_from_random_actions,
-                  path_follower=args.path_follower, fps=args.fps)
+                  path_follower=args.path_follower, fps=args.fps, clock=args.clock,
+                  select_frames=not args.record_all_frames, backbone=args.backbone)
 
 
-def get_latest_model():
+def get_latest_model(best=False):
     train_dirs = glob.glob('%s/*_train' % c.TENSORFLOW_OUT_DIR)
-    latest_subdir = max(train_dirs, key=os.path.getmtime)
-    if not latest_subdir:
+    if not train_dirs:
         raise RuntimeError('Can not get latest model, no models found in % s' % c.TENSORFLOW_OUT_DIR)
-    latest_model = max(glob.glob('%s/model.ckpt-*.meta' % latest_subdir), key=os.path.getmtime)
-    if not latest_model:
+    latest_subdir = max(train_dirs, key=os.path.getmtime)
+    if best:
+        from tensorflow_agent.train.checkpoints import get_best_checkpoint
+        best_model = get_best_checkpoint(latest_subdir)
+        if best_model is not None:
+            return best_model
+        log.warning('No evaluated checkpoints in %s, using the latest one', latest_subdir)
+    models = glob.glob('%s/model.ckpt-*.index' % latest_subdir)
+    if not models:
         raise RuntimeError('Can not get latest model, no models found in %s' % latest_subdir)
-    latest_prefix = latest_model[:-len('.meta')]
+    latest_model = max(models, key=os.path.getmtime)
+    latest_prefix = latest_model[:-len('.index')]
     return latest_prefix
 
 
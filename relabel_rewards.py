@@ -0,0 +1,112 @@
+"""Recompute per-frame rewards for recorded HDF5 files in bulk, i.e. to try out reward coefficients across a whole
+dataset without re-running the sim.
+
+    python relabel_rewards.py <recording-dir> --gforce-coeff 12 --out rewards.npz
+"""
+import argparse
+import glob
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+import config as c
+from gym_deepdrive.envs.deepdrive_gym_env import DeepDriveRewardCalculator as Rewards
+from utils import read_hdf5_frame_attrs
+import logs
+
+log = logs.get_log(__name__)
+
+
+def _frame_values(frames, key, default=0.):
+    return np.array([frame.get(key, default) for frame in frames], dtype=np.float64)
+
+
+def get_time_passed(frames, period=1. / c.DEFAULT_FPS):
+    """Seconds between each frame and the previous one, NaN for the first frame. Uses the sim's capture timestamps
+    when they were recorded, else assumes frames were recorded every period seconds."""
+    if frames and all('capture_timestamp' in frame for frame in frames):
+        time_passed = np.diff(_frame_values(frames, 'capture_timestamp'))
+    else:
+        time_passed = np.full(max(len(frames) - 1, 0), period, dtype=np.float64)
+    return np.concatenate([[np.nan], time_passed])
+
+
+def get_frame_rewards(frames, period=1. / c.DEFAULT_FPS, progress_coeff=Rewards.PROGRESS_COEFF,
+                      gforce_coeff=Rewards.GFORCE_COEFF, gforce_threshold=Rewards.GFORCE_THRESHOLD,
+                      lane_deviation_coeff=Rewards.LANE_DEVIATION_COEFF,
+                      lane_deviation_threshold=Rewards.LANE_DEVIATION_THRESHOLD):
+    """Rewards for consecutive recorded frames as computed by DeepDriveEnv.get_reward, excluding the wall clock based
+    time penalty and spawn grace period"""
+    time_passed = get_time_passed(frames, period)
+    progress = np.concatenate([[0.], np.diff(_frame_values(frames, 'distance_along_route'))])
+    accelerations = np.array([frame.get('acceleration', np.zeros(3)) for frame in frames], dtype=np.float64)
+    gforces = Rewards.get_gforces(accelerations.reshape(-1, 3))
+    lane_deviations = _frame_values(frames, 'distance_to_center_of_lane')
+
+    progress_reward = Rewards.get_progress_rewards(progress, time_passed, coeff=progress_coeff)
+    gforce_penalty = Rewards.get_gforce_penalties(gforces, time_passed, coeff=gforce_coeff,
+                                                  threshold=gforce_threshold)
+    lane_deviation_penalty = Rewards.get_lane_deviation_penalties(lane_deviations, time_passed,
+                                                                  coeff=lane_deviation_coeff,
+                                                                  threshold=lane_deviation_threshold)
+    return dict(reward=progress_reward - gforce_penalty - lane_deviation_penalty, progress_reward=progress_reward,
+                gforce_penalty=gforce_penalty, lane_deviation_penalty=lane_deviation_penalty)
+
+
+def _relabel_file(args):
+    filename, reward_kwargs = args
+    try:
+        return filename, get_frame_rewards(read_hdf5_frame_attrs(filename), **reward_kwargs)
+    except Exception as e:
+        log.error('Could not relabel %s - skipping - error was %r', filename, e)
+        return filename, None
+
+
+def relabel(recording_dir, num_workers=None, **reward_kwargs):
+    """Returns a list of (filename, rewards dict) for every HDF5 file in recording_dir"""
+    file_names = sorted(glob.glob(recording_dir + '/**/*.hdf5', recursive=True))
+    with Pool(num_workers) as pool:
+        results = pool.map(_relabel_file, [(f, reward_kwargs) for f in file_names])
+    return [(f, rewards) for f, rewards in results if rewards is not None]
+
+
+def save(results, out_filename):
+    """Concatenated per-frame rewards with offsets into them per file"""
+    lengths = [len(rewards['reward']) for _, rewards in results]
+    out = dict(files=np.array([os.path.relpath(f) for f, _ in results]),
+               offsets=np.cumsum([0] + lengths))
+    for key in ['reward', 'progress_reward', 'gforce_penalty', 'lane_deviation_penalty']:
+        out[key] = np.concatenate([rewards[key] for _, rewards in results]) if results else np.zeros(0)
+    np.savez(out_filename, **out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recompute per-frame rewards for recorded HDF5 files')
+    parser.add_argument('recording_dir', nargs='?', default=c.RECORDING_DIR)
+    parser.add_argument('--out', default=None, help='npz file to save per-frame rewards to')
+    parser.add_argument('--fps', type=float, default=c.DEFAULT_FPS,
+                        help='Recording frame rate, used when frames have no capture timestamp')
+    parser.add_argument('--progress-coeff', type=float, default=Rewards.PROGRESS_COEFF)
+    parser.add_argument('--gforce-coeff', type=float, default=Rewards.GFORCE_COEFF)
+    parser.add_argument('--gforce-threshold', type=float, default=Rewards.GFORCE_THRESHOLD)
+    parser.add_argument('--lane-deviation-coeff', type=float, default=Rewards.LANE_DEVIATION_COEFF)
+    parser.add_argument('--lane-deviation-threshold', type=float, default=Rewards.LANE_DEVIATION_THRESHOLD)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    results = relabel(args.recording_dir, num_workers=args.workers, period=1. / args.fps,
+                      progress_coeff=args.progress_coeff, gforce_coeff=args.gforce_coeff,
+                      gforce_threshold=args.gforce_threshold, lane_deviation_coeff=args.lane_deviation_coeff,
+                      lane_deviation_threshold=args.lane_deviation_threshold)
+    if not results:
+        raise RuntimeError('No recordings found in %s' % args.recording_dir)
+    rewards = np.concatenate([r['reward'] for _, r in results])
+    log.info('%d frames in %d files - mean reward per frame %f, total %f', len(rewards), len(results),
+             rewards.mean(), rewards.sum())
+    if args.out:
+        save(results, args.out)
+        log.info('wrote per-frame rewards to %s', args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,7 +11,10 @@ import numpy as np
 import config as c
 import deepdrive
 from gym_deepdrive.envs.deepdrive_gym_env import Action
+from tensorflow_agent.frame_selector import FrameSelector
 from tensorflow_agent.net import Net
+from tensorflow_agent.quantize import QuantizedNet, TFLITE_EXTENSION
+from tensorflow_agent.train.checkpoints import get_fc_rank, read_backbone_name
 from utils import save_hdf5, download
 import logs
 
@@ -21,7 +24,8 @@ log = logs.get_log(__name__)
 class Agent(object):
     def __init__(self, action_space, tf_session, env, should_record_recovery_from_random_actions=True,
                  should_record=False, net_path=None, use_frozen_net=False, random_action_count=0,
-                 non_random_action_count=5, path_follower=False, recording_dir=c.RECORDING_DIR):
+                 non_random_action_count=5, path_follower=False, recording_dir=None, select_frames=True,
+                 backbone=None):
         np.random.seed(c.RNG_SEED)
         self.action_space = action_space
         self.previous_action = None
@@ -37,12 +41,14 @@ class Agent(object):
         self.recorded_obz_count = 0
         self.performing_random_actions = False
         self.path_follower_mode = path_follower
-        self.recording_dir = recording_dir
+        self.recording_dir = recording_dir = recording_dir or c.RECORDING_DIR
 
         # Recording state
         self.should_record = should_record
         self.sess_dir = os.path.join(recording_dir, datetime.now().strftime(c.DIR_DATE_FORMAT))
         self.obz_recording = []
+        self.frame_selector = FrameSelector() if select_frames else None
+        self.last_random_action_step = None
 
         if should_record_recovery_from_random_actions:
             log.info('Mixing in random actions to increase data diversity (these are not recorded).')
@@ -52,18 +58,22 @@ class Agent(object):
         # Net
         self.sess = tf_session
         self.use_frozen_net = use_frozen_net
-        if net_path is not None:
-            self.load_net(net_path, use_frozen_net)
+        self.quantized_net = None
+        if net_path is not None and net_path.endswith(TFLITE_EXTENSION):
+            # Int8 model exported by tensorflow_agent/quantize.py
+            self.quantized_net = self.net = QuantizedNet(net_path)
+            self.net_input_placeholder = None
+        elif net_path is not None:
+            self.load_net(net_path, use_frozen_net, backbone)
         else:
             self.net = None
             self.net_input_placeholder = None
             self.sess = None
 
     def act(self, obz, reward, done):
-        if obz is not None:
+        if obz is not None and logs.DEBUG_ENABLED:
             log.debug('steering %r', obz['steering'])
             log.debug('throttle %r', obz['throttle'])
-            obz = self.preprocess_obz(obz)
 
         if self.should_record_recovery_from_random_actions:
             action = self.toggle_random_action()
@@ -72,7 +82,7 @@ class Agent(object):
             if obz is None or not obz['cameras']:
                 y = None
             else:
-                image = obz['cameras'][0]['image']
+                image = obz['cameras'][0]['image']  # uint8 - mean subtraction happens in the net's graph
                 y = self.get_net_out(image)
             action = self.get_next_action(obz, y)
         else:
@@ -80,13 +90,12 @@ class Agent(object):
 
         self.previous_action = action
         self.step += 1
+        if self.performing_random_actions:
+            self.last_random_action_step = self.step
 
         if obz and obz['is_game_driving'] == 1 and self.should_record:
-            self.obz_recording.append(obz)
-            # utils.save_camera(obz['cameras'][0]['image'], obz['cameras'][0]['depth'],
-            #                   os.path.join(self.sess_dir, str(self.total_obz).zfill(10)))
-            self.recorded_obz_count += 1
-        else:
+            self.maybe_record(obz)
+        elif logs.DEBUG_ENABLED:
             log.debug('Not recording frame')
 
         self.maybe_save()
@@ -95,7 +104,6 @@ class Agent(object):
         return action
 
     def get_next_action(self, obz, y):
-        log.debug('getting next action')
         if y is None:
             log.debug('net out is None')
             return self.previous_action or Action()
@@ -106,42 +114,49 @@ class Agent(object):
         desired_speed = desired_speed * c.SPEED_NORMALIZATION_FACTOR
         desired_speed_change = desired_speed_change * c.SPEED_NORMALIZATION_FACTOR
 
-        log.debug('desired_steering %f', desired_steering)
-        log.debug('desired_throttle %f', desired_throttle)
-
-        log.debug('desired_direction %f', desired_direction)
-        log.debug('desired_speed %f', desired_speed)
-        log.debug('desired_speed_change %f', desired_speed_change)
-        log.debug('desired_throttle %f', desired_throttle)
-        log.debug('desired_spin %f', desired_spin)
-
         actual_speed = obz['speed']
-        log.debug('actual_speed %f', actual_speed)
-        log.debug('desired_speed %f', desired_speed)
+        if logs.DEBUG_ENABLED:
+            log.debug('net out: steering %f throttle %f direction %f speed %f speed_change %f spin %f - actual speed '
+                      '%f', desired_steering, desired_throttle, desired_direction, desired_speed,
+                      desired_speed_change, desired_spin, actual_speed)
 
         target_speed = 9 * 100
-        log.debug('actual_speed %r' % actual_speed)
 
         # Network overfit on speed, plus it's nice to be able to change it,
         # so we just ignore output speed of net
         desired_throttle = abs(target_speed / max(actual_speed, 1e-3))
         desired_throttle = min(max(desired_throttle, 0.), 1.)
 
-        log.debug('desired_steering %f', desired_steering)
-        log.debug('desired_throttle %f', desired_throttle)
+        if logs.DEBUG_ENABLED:
+            log.debug('desired_steering %f desired_throttle %f', desired_steering, desired_throttle)
         smoothed_steering = 0.2 * self.previous_action.steering + 0.5 * desired_steering
         # desired_throttle = desired_throttle * 1.1
         action = Action(smoothed_steering, desired_throttle)
         return action
 
+    def maybe_record(self, obz):
+        if self.frame_selector is None:
+            selection_weight = 1.
+        else:
+            recovering = (self.last_random_action_step is not None and
+                          self.step - self.last_random_action_step <= c.RECORD_RECOVERY_STEPS)
+            selection_weight = self.frame_selector.select(obz, recovering)
+            if selection_weight is None:
+                return
+        obz['selection_weight'] = selection_weight
+        self.obz_recording.append(obz)  # uint8 images - mean subtraction happens in the net's graph
+        # utils.save_camera(obz['cameras'][0]['image'], obz['cameras'][0]['depth'],
+        #                   os.path.join(self.sess_dir, str(self.total_obz).zfill(10)))
+        self.recorded_obz_count += 1
+
     def maybe_save(self):
         if (
             self.should_record and self.recorded_obz_count % c.FRAMES_PER_HDF5_FILE == 0 and
-            self.recorded_obz_count != 0
+            self.obz_recording
            ):
             filename = os.path.join(self.sess_dir, '%s.hdf5' %
                                     str(self.recorded_obz_count // c.FRAMES_PER_HDF5_FILE).zfill(10))
-            save_hdf5(self.obz_recording, filename=filename)
+            save_hdf5(self.obz_recording, filename=filename, catalog_dir=self.recording_dir)
             log.info('Flushing output data')
             self.obz_recording = []
 
@@ -168,15 +183,17 @@ class Agent(object):
                 self.performing_random_actions = True
         return action
 
-    def load_net(self, net_path, is_frozen=False):
+    def load_net(self, net_path, is_frozen=False, backbone=None):
         '''
+        backbone: Defaults to the one recorded in the checkpoint's training directory
+
         Frozen nets can be generated with something like 
         
         `python freeze_graph.py --input_graph="C:\tmp\deepdrive\tensorflow_random_action\train\graph.pbtxt" --input_checkpoint="C:\tmp\deepdrive\tensorflow_random_action\train\model.ckpt-273141" --output_graph="C:\tmp\deepdrive\tensorflow_random_action\frozen_graph.pb" --output_node_names="model/add_2"`
         
         where model/add_2 is the auto-generated name for self.net.p 
         '''
-        self.net_input_placeholder = tf.placeholder(tf.float32, (None,) + c.BASELINE_IMAGE_SHAPE)
+        self.net_input_placeholder = tf.placeholder(tf.uint8, (None,) + c.BASELINE_IMAGE_SHAPE)
         if is_frozen:
             # TODO: Get frozen nets working
 
@@ -201,7 +218,8 @@ class Agent(object):
 
         else:
             with tf.variable_scope("model") as _vs:
-                self.net = Net(self.net_input_placeholder, c.NUM_TARGETS, is_training=False)
+                self.net = Net(self.net_input_placeholder, c.NUM_TARGETS, is_training=False,
+                               backbone=backbone or read_backbone_name(net_path), fc_rank=get_fc_rank(net_path))
             saver = tf.train.Saver()
             saver.restore(self.sess, net_path)
 
@@ -211,25 +229,20 @@ class Agent(object):
 
     def get_net_out(self, image):
         begin = time.time()
-        if self.use_frozen_net:
-            out_var = 'prefix/model/add_2'
+        if self.quantized_net is not None:
+            net_out = self.quantized_net.run(image)
         else:
-            out_var = self.net.p
-        net_out = self.sess.run(out_var, feed_dict={
-            self.net_input_placeholder: image.reshape(1, *image.shape),})
+            if self.use_frozen_net:
+                out_var = 'prefix/model/add_2'
+            else:
+                out_var = self.net.p
+            net_out = self.sess.run(out_var, feed_dict={
+                self.net_input_placeholder: image.reshape(1, *image.shape),})
         # print(net_out)
-        end = time.time()
-        log.debug('inference time %s', end - begin)
+        if logs.DEBUG_ENABLED:
+            log.debug('inference time %s', time.time() - begin)
         return net_out
 
-    def preprocess_obz(self, obz):
-        for camera in obz['cameras']:
-            image = camera['image']
-            image = image.astype(np.float32)
-            image -= c.MEAN_PIXEL
-            camera['image'] = image
-        return obz
-
     def set_random_action_repeat_count(self):
         if self.semirandom_sequence_step == (self.random_action_count + self.non_random_action_count):
             self.semirandom_sequence_step = 0
@@ -254,7 +267,8 @@ class Agent(object):
 
 def run(experiment, env_id='DeepDrivePreproTensorflow-v0', should_record=False, net_path=None, should_benchmark=True,
         run_baseline_agent=False, camera_rigs=None, should_rotate_sim_types=False,
-        should_record_recovery_from_random_actions=False, render=False, path_follower=False, fps=c.DEFAULT_FPS):
+        should_record_recovery_from_random_actions=False, render=False, path_follower=False, fps=c.DEFAULT_FPS,
+        clock='wall', select_frames=True, backbone=None, sim_address=None, benchmark_writer=None):
     if run_baseline_agent:
         net_path = ensure_baseline_weights(net_path)
     reward = 0
@@ -285,14 +299,15 @@ def run(experiment, env_id='DeepDrivePreproTensorflow-v0', should_record=False,
     use_sim_start_command_first_lap = c.SIM_START_COMMAND is not None
     gym_env = deepdrive.start(experiment, env_id, should_benchmark=should_benchmark, cameras=cameras,
                                   use_sim_start_command=use_sim_start_command_first_lap, render=render,
-                                  fps=fps)
+                                  fps=fps, clock=clock, sim_address=sim_address,
+                                  benchmark_writer=benchmark_writer)
     dd_env = gym_env.env
 
     # Perform random actions to reduce sampling error in the recorded dataset
     agent = Agent(gym_env.action_space, sess, env=gym_env.env,
                   should_record_recovery_from_random_actions=should_record_recovery_from_random_actions,
                   should_record=should_record, net_path=net_path, random_action_count=4, non_random_action_count=5,
-                  path_follower=path_follower)
+                  path_follower=path_follower, select_frames=select_frames, backbone=backbone)
     if net_path:
         log.info('Running tensorflow agent checkpoint: %s', net_path)
 
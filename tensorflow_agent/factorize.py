@@ -0,0 +1,167 @@
+"""Low-rank factorization of a trained net's fully connected layers with truncated SVD, reporting the size, latency
+and eval loss tradeoff per rank.
+
+    python -m tensorflow_agent.factorize <checkpoint> --ranks 64 128 256 512 --fine-tune-steps 2000
+
+Each rank is written to <train dir>/factorized_rank<rank>/ and can be run with main.py --net-path
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import config as c
+from tensorflow_agent.net import Net
+from tensorflow_agent.train.checkpoints import CHECKPOINT_PREFIX, get_checkpoint_step, get_fc_rank, \
+    read_backbone_name, record_backbone
+from tensorflow_agent.train.data_utils import get_dataset
+from tensorflow_agent.train.evaluate import compute_losses, load_eval_set
+import logs
+
+log = logs.get_log(__name__)
+
+FACTORIZED_LAYERS = ['fc6', 'fc7']
+
+
+def factorize_weights(w, rank):
+    """Best rank-r approximation u.dot(v) of w, splitting the singular values evenly between u and v"""
+    u, s, vt = np.linalg.svd(w, full_matrices=False)
+    root_s = np.sqrt(s[:rank])
+    return (u[:, :rank] * root_s).astype(w.dtype), (root_s[:, None] * vt[:rank]).astype(w.dtype)
+
+
+def get_fc_shapes(checkpoint_path):
+    """{layer: weight shape} of the factorizable layers in a checkpoint"""
+    shapes = tf.train.NewCheckpointReader(checkpoint_path).get_variable_to_shape_map()
+    return {layer: shapes['model/%s_W' % layer] for layer in FACTORIZED_LAYERS if 'model/%s_W' % layer in shapes}
+
+
+def is_useful_rank(shape, rank):
+    """Whether a rank factorization of an in x out weight has fewer parameters than the weight itself, i.e. rank is
+    below in * out / (in + out), which is also below min(in, out)"""
+    return rank * (shape[0] + shape[1]) < shape[0] * shape[1]
+
+
+def get_useful_ranks(fc_shapes, ranks):
+    """The ranks that shrink every factorized layer, logging the others"""
+    ret = []
+    for rank in ranks:
+        too_large = [layer for layer, shape in sorted(fc_shapes.items()) if not is_useful_rank(shape, rank)]
+        if too_large:
+            log.warning('skipping rank %d which would not shrink %s', rank,
+                        ', '.join('%s (%dx%d)' % ((layer,) + tuple(fc_shapes[layer])) for layer in too_large))
+        else:
+            ret.append(rank)
+    return ret
+
+
+def factorize_checkpoint(checkpoint_path, rank, out_dir=None):
+    """Writes a checkpoint for Net(fc_rank=rank) with the factorized fully connected weights of checkpoint_path and
+    everything else copied as-is. Returns the new checkpoint path."""
+    backbone = read_backbone_name(checkpoint_path)
+    for layer, shape in get_fc_shapes(checkpoint_path).items():
+        if rank > min(shape):
+            raise ValueError('Rank %d is larger than %s which is %dx%d' % ((rank, layer) + tuple(shape)))
+    out_dir = out_dir or os.path.join(os.path.dirname(checkpoint_path), 'factorized_rank%d' % rank)
+    os.makedirs(out_dir, exist_ok=True)
+    reader = tf.train.NewCheckpointReader(checkpoint_path)
+    values = {}
+    for name in reader.get_variable_to_shape_map():
+        values[name] = reader.get_tensor(name)
+    for layer in FACTORIZED_LAYERS:
+        w_name = 'model/%s_W' % layer
+        if w_name in values:
+            w = values.pop(w_name)
+            values['model/%s_U' % layer], values['model/%s_V' % layer] = factorize_weights(w, rank)
+    with tf.Graph().as_default():
+        x = tf.placeholder(tf.uint8, (None,) + c.BASELINE_IMAGE_SHAPE)
+        with tf.variable_scope("model"):
+            Net(x, c.NUM_TARGETS, is_training=False, backbone=backbone, fc_rank=rank)
+        assign_ops = [v.assign(values[v.op.name]) for v in tf.global_variables() if v.op.name in values]
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            sess.run(assign_ops)
+            path = tf.train.Saver().save(sess, os.path.join(out_dir, CHECKPOINT_PREFIX),
+                                         global_step=get_checkpoint_step(checkpoint_path))
+    record_backbone(out_dir, backbone, fc_rank=rank)
+    return path
+
+
+def fine_tune(checkpoint_path, rank, recording_dir, steps, batch_size=32, learning_rate=2e-6):
+    """Briefly trains a factorized checkpoint with the same loss as train.py to recover accuracy lost to
+    truncation. Returns the new checkpoint path."""
+    with tf.Graph().as_default():
+        x = tf.placeholder(tf.uint8, (None,) + c.BASELINE_IMAGE_SHAPE)
+        y = tf.placeholder(tf.float32, (None, c.NUM_TARGETS))
+        with tf.variable_scope("model"):
+            model = Net(x, c.NUM_TARGETS, backbone=read_backbone_name(checkpoint_path), fc_rank=rank)
+        loss = 0.5 * tf.reduce_sum(tf.square(model.p - y)) / tf.to_float(tf.shape(x)[0])
+        total_loss = loss + 0.0005 * tf.global_norm(tf.trainable_variables())
+        model_vars = tf.global_variables()
+        train_op = tf.train.AdamOptimizer(learning_rate).minimize(total_loss, global_step=model.global_step)
+        saver = tf.train.Saver(model_vars)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            saver.restore(sess, checkpoint_path)
+            batches = get_dataset(recording_dir, log).iterate_forever(batch_size)
+            for i in range(steps):
+                images, targets = next(batches)
+                _, step_loss = sess.run([train_op, loss], {x: images, y: targets})
+                if i % 100 == 0:
+                    log.info('rank %d fine tune step %d loss %f', rank, i, step_loss)
+            return saver.save(sess, os.path.join(os.path.dirname(checkpoint_path), CHECKPOINT_PREFIX),
+                              global_step=sess.run(model.global_step))
+
+
+def evaluate_checkpoint(checkpoint_path, images, targets, batch_size=32, num_latency_frames=100):
+    """Params, eval loss and batch 1 CPU latency"""
+    with tf.Graph().as_default():
+        x = tf.placeholder(tf.uint8, (None,) + c.BASELINE_IMAGE_SHAPE)
+        with tf.variable_scope("model"):
+            model = Net(x, c.NUM_TARGETS, is_training=False, backbone=read_backbone_name(checkpoint_path),
+                        fc_rank=get_fc_rank(checkpoint_path))
+        num_params = sum(int(np.prod(v.get_shape().as_list())) for v in tf.trainable_variables())
+        fc_params = sum(int(np.prod(v.get_shape().as_list())) for v in tf.trainable_variables()
+                        if any('/%s_' % layer in v.op.name for layer in FACTORIZED_LAYERS))
+        with tf.Session(config=tf.ConfigProto(device_count={'GPU': 0})) as sess:
+            tf.train.Saver().restore(sess, checkpoint_path)
+            losses = compute_losses(sess, model, x, images, targets, batch_size)
+            times = []
+            for image in images[:num_latency_frames]:
+                start = time.time()
+                sess.run(model.p, {x: image[None]})
+                times.append(time.time() - start)
+    return dict(num_params=num_params, fc_params=fc_params, eval_loss=float(0.5 * losses.sum() / losses.shape[0]),
+                ms=float(np.median(times)) * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Factorize the fully connected layers of a checkpoint per rank')
+    parser.add_argument('checkpoint', help='i.e. /home/a/DeepDrive/tensorflow/2018-01-01__11-11-11AM_train/model.ckpt-98331')
+    parser.add_argument('--ranks', nargs='*', type=int, default=[64, 128, 256, 512])
+    parser.add_argument('--recording-dir', default=None, help='Fine tunes on training files, reports on eval files')
+    parser.add_argument('--fine-tune-steps', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=32)
+    args = parser.parse_args()
+    recording_dir = args.recording_dir or c.RECORDING_DIR
+    images, targets = load_eval_set(recording_dir)
+
+    results = [('full', evaluate_checkpoint(args.checkpoint, images, targets, batch_size=args.batch_size))]
+    for rank in get_useful_ranks(get_fc_shapes(args.checkpoint), args.ranks):
+        path = factorize_checkpoint(args.checkpoint, rank)
+        results.append(('rank %d' % rank, evaluate_checkpoint(path, images, targets, args.batch_size)))
+        if args.fine_tune_steps:
+            path = fine_tune(path, rank, recording_dir, args.fine_tune_steps, args.batch_size)
+            results.append(('rank %d tuned' % rank, evaluate_checkpoint(path, images, targets, args.batch_size)))
+        log.info('wrote %s', path)
+
+    log.info('%-16s %12s %12s %12s %10s', 'net', 'params', 'fc params', 'eval loss', 'batch 1 ms')
+    for name, result in results:
+        log.info('%-16s %12d %12d %12.6f %10.2f', name, result['num_params'], result['fc_params'],
+                 result['eval_loss'], result['ms'])
+
+
+if __name__ == '__main__':
+    main()
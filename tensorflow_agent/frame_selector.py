@@ -0,0 +1,57 @@
+import numpy as np
+
+import config as c
+import logs
+
+log = logs.get_log(__name__)
+
+
+class FrameSelector(object):
+    """Decides which frames are worth recording.
+
+    Frames that look nearly the same as the last kept frame are skipped. Frames driving straight are kept with
+    probability straight_keep_prob, while turning, spinning and recovering from random actions are always kept.
+    Kept frames get a selection_weight of 1 / keep probability, so training can reweight to the driven distribution.
+    """
+    def __init__(self, min_diff=c.RECORD_MIN_FRAME_DIFF, straight_keep_prob=c.RECORD_STRAIGHT_KEEP_PROB,
+                 steering_threshold=c.RECORD_STEERING_THRESHOLD, spin_threshold=c.SPIN_THRESHOLD, downsample=8,
+                 rng=c.RNG):
+        self.min_diff = min_diff
+        self.straight_keep_prob = straight_keep_prob
+        self.steering_threshold = steering_threshold
+        self.spin_threshold = spin_threshold
+        self.downsample = downsample
+        self.rng = rng
+        self.last_thumbnail = None
+        self.kept = 0
+        self.skipped_duplicate = 0
+        self.skipped_straight = 0
+
+    def get_thumbnail(self, image):
+        """Cheap grayscale thumbnail in [0, 1]"""
+        thumbnail = image[::self.downsample, ::self.downsample].astype(np.float32)
+        if thumbnail.ndim == 3:
+            thumbnail = thumbnail.mean(axis=2)
+        return thumbnail / 255.
+
+    def get_keep_prob(self, obz, recovering=False):
+        if recovering:
+            return 1.
+        turning = abs(obz['steering']) >= self.steering_threshold
+        spinning = abs(obz['angular_velocity'][2]) >= self.spin_threshold
+        return 1. if turning or spinning else self.straight_keep_prob
+
+    def select(self, obz, recovering=False):
+        """Returns the selection weight to record obz with, or None to skip it"""
+        thumbnail = self.get_thumbnail(obz['cameras'][0]['image'])
+        if (not recovering and self.last_thumbnail is not None and
+                np.mean(np.abs(thumbnail - self.last_thumbnail)) < self.min_diff):
+            self.skipped_duplicate += 1
+            return None
+        keep_prob = self.get_keep_prob(obz, recovering)
+        if keep_prob < 1 and self.rng.random() >= keep_prob:
+            self.skipped_straight += 1
+            return None
+        self.last_thumbnail = thumbnail
+        self.kept += 1
+        return 1. / keep_prob
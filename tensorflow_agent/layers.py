@@ -38,6 +38,17 @@ def linear(x, name, size):
     return tf.matmul(x, w) + b
 
 
+def factorized_linear(x, name, size, rank):
+    """linear with its weights factored into input_size x rank and rank x size matrices, i.e. by truncated SVD of
+    trained weights - see tensorflow_agent/factorize.py"""
+    input_size = np.prod(list(map(int, x.get_shape()[1:])))
+    x = tf.reshape(x, [-1, input_size])
+    u = tf.get_variable(name + "_U", [input_size, rank], initializer=tf.random_normal_initializer(0.0, 0.005))
+    v = tf.get_variable(name + "_V", [rank, size], initializer=tf.random_normal_initializer(0.0, 0.005))
+    b = tf.get_variable(name + "_b", [size], initializer=tf.zeros_initializer)
+    return tf.matmul(tf.matmul(x, u), v) + b
+
+
 def max_pool_2x2(x):
     return tf.nn.max_pool(x, ksize=[1, 3, 3, 1], strides=[1, 2, 2, 1], padding='VALID')
 
@@ -45,3 +56,20 @@ def max_pool_2x2(x):
 def lrn(x):
     return tf.nn.local_response_normalization(x, depth_radius=2, alpha=2e-05, beta=0.75, bias=1.0)
 
+
+def depthwise_conv2d(x, name, kernel_size, stride):
+    input_features = int(x.get_shape()[3])
+    w = tf.get_variable(name + "_W", [kernel_size, kernel_size, input_features, 1],
+                        initializer=tf.variance_scaling_initializer(2.0))
+    b = tf.get_variable(name + "_b", [input_features], initializer=tf.zeros_initializer)
+    return tf.nn.bias_add(tf.nn.depthwise_conv2d(x, w, [1, stride, stride, 1], padding="SAME"), b)
+
+
+def separable_conv2d(x, name, num_features, stride):
+    """Depthwise 3x3 followed by pointwise 1x1 - roughly kernel_size^2 times fewer multiply-adds than a full conv"""
+    x = tf.nn.relu6(depthwise_conv2d(x, name + "_dw", 3, stride))
+    return tf.nn.relu6(conv2d(x, name + "_pw", num_features, 1, 1, 1))
+
+
+def global_avg_pool(x):
+    return tf.reduce_mean(x, [1, 2])
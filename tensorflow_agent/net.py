@@ -1,48 +1,109 @@
+from collections import OrderedDict
+
 import tensorflow as tf
 
-from tensorflow_agent.layers import conv2d, max_pool_2x2, linear, lrn
+import config as c
+from tensorflow_agent.layers import conv2d, max_pool_2x2, linear, factorized_linear, lrn, separable_conv2d, \
+    global_avg_pool
+
+BACKBONES = OrderedDict()
+
+
+def backbone(fn):
+    """Registers a function that maps preprocessed images to features for the control outputs, selected by its name
+    with Net(backbone=...), --backbone, etc... Backbones take (x, is_training, fc_rank), where fc_rank factorizes
+    their fully connected layers if set."""
+    BACKBONES[fn.__name__] = fn
+    return fn
+
+
+def get_backbone(name):
+    if name not in BACKBONES:
+        raise ValueError('Unknown backbone %r, choose from %s' % (name, ', '.join(BACKBONES)))
+    return BACKBONES[name]
 
 
 class Net(object):
-    """AlexNet architecture with modified final fully-connected layers regressed on driving control outputs (steering, throttle, etc...)"""
-    def __init__(self, x, num_targets=6, is_training=True):
+    """Backbone (AlexNet by default) with a final fully-connected layer regressed on driving control outputs (steering, throttle, etc...)"""
+    def __init__(self, x, num_targets=6, is_training=True, backbone=c.DEFAULT_BACKBONE, fc_rank=None):
         self.x = x
-
-        # phase = tf.placeholder(tf.bool, name='phase')  # Used for batch norm
-
-        conv1 = tf.nn.relu(conv2d(x, "conv1", 96, 11, 4, 1))
-        lrn1 = lrn(conv1)
-        maxpool1 = max_pool_2x2(lrn1)
-        conv2 = tf.nn.relu(conv2d(maxpool1, "conv2", 256, 5, 1, 2))
-        lrn2 = lrn(conv2)
-        maxpool2 = max_pool_2x2(lrn2)
-        conv3 = tf.nn.relu(conv2d(maxpool2, "conv3", 384, 3, 1, 1))  # Not sure why this isn't 2 groups, but pretrained net was trained like this so we're going with it.
-
-        # Avoid diverging from pretrained weights with things like batch norm for now.
-        # Perhaps try a modern small net like Inception V1, ResNet 18, or Resnet 50
-        # conv3 = tf.contrib.layers.batch_norm(conv3, scope='batchnorm3', is_training=phase,
-        #     # fused=True,
-        #     # data_format='NCHW',
-        #     # renorm=True
-        # )
-
-        conv4 = tf.nn.relu(conv2d(conv3, "conv4", 384, 3, 1, 2))
-        conv5 = tf.nn.relu(conv2d(conv4, "conv5", 256, 3, 1, 2))
-        maxpool5 = max_pool_2x2(conv5)
-        fc6 = tf.nn.relu(linear(maxpool5, "fc6", 4096))
-        if is_training:
-            fc6 = tf.nn.dropout(fc6, 0.5)
-        else:
-            fc6 = tf.nn.dropout(fc6, 1.0)
-
-        fc7 = tf.nn.relu(linear(fc6, "fc7", 4096))
-        # fc7 = tf.contrib.layers.batch_norm(fc7, scope='batchnorm7', is_training=phase)
-        if is_training:
-            fc7 = tf.nn.dropout(fc7, 0.95)
-        else:
-            fc7 = tf.nn.dropout(fc7, 1.0)
-
-        fc8 = linear(fc7, "fc8", num_targets)
+        self.backbone = backbone
+        self.fc_rank = fc_rank
+        x = preprocess_input(x)
+        features = get_backbone(backbone)(x, is_training, fc_rank)
+        fc8 = linear(features, "fc8", num_targets)
         self.p = fc8
         self.global_step = tf.get_variable("global_step", [], tf.int32, initializer=tf.zeros_initializer,
                                            trainable=False)
+
+
+def fc(x, name, size, rank=None):
+    return linear(x, name, size) if rank is None else factorized_linear(x, name, size, rank)
+
+
+@backbone
+def alexnet(x, is_training, fc_rank=None):
+    """AlexNet with grouped convs and LRN, compatible with the ImageNet pretrained BVLC weights"""
+
+    # phase = tf.placeholder(tf.bool, name='phase')  # Used for batch norm
+
+    conv1 = tf.nn.relu(conv2d(x, "conv1", 96, 11, 4, 1))
+    lrn1 = lrn(conv1)
+    maxpool1 = max_pool_2x2(lrn1)
+    conv2 = tf.nn.relu(conv2d(maxpool1, "conv2", 256, 5, 1, 2))
+    lrn2 = lrn(conv2)
+    maxpool2 = max_pool_2x2(lrn2)
+    conv3 = tf.nn.relu(conv2d(maxpool2, "conv3", 384, 3, 1, 1))  # Not sure why this isn't 2 groups, but pretrained net was trained like this so we're going with it.
+
+    # Avoid diverging from pretrained weights with things like batch norm for now.
+    # Perhaps try a modern small net like Inception V1, ResNet 18, or Resnet 50
+    # conv3 = tf.contrib.layers.batch_norm(conv3, scope='batchnorm3', is_training=phase,
+    #     # fused=True,
+    #     # data_format='NCHW',
+    #     # renorm=True
+    # )
+
+    conv4 = tf.nn.relu(conv2d(conv3, "conv4", 384, 3, 1, 2))
+    conv5 = tf.nn.relu(conv2d(conv4, "conv5", 256, 3, 1, 2))
+    maxpool5 = max_pool_2x2(conv5)
+    fc6 = tf.nn.relu(fc(maxpool5, "fc6", 4096, fc_rank))
+    if is_training:
+        fc6 = tf.nn.dropout(fc6, 0.5)
+    else:
+        fc6 = tf.nn.dropout(fc6, 1.0)
+
+    fc7 = tf.nn.relu(fc(fc6, "fc7", 4096, fc_rank))
+    # fc7 = tf.contrib.layers.batch_norm(fc7, scope='batchnorm7', is_training=phase)
+    if is_training:
+        fc7 = tf.nn.dropout(fc7, 0.95)
+    else:
+        fc7 = tf.nn.dropout(fc7, 1.0)
+    return fc7
+
+
+# (features, stride) of each depthwise separable block
+MOBILENET_BLOCKS = [(64, 1), (128, 2), (128, 1), (256, 2), (256, 1), (512, 2), (512, 1), (512, 1), (1024, 2),
+                    (1024, 1)]
+
+
+@backbone
+def mobilenet(x, is_training, fc_rank=None, width=0.5):
+    """MobileNet style stack of depthwise separable convs for CPU-only inference hosts. Trained from scratch as there
+    are no pretrained weights. width scales the number of features in every layer."""
+    net = tf.nn.relu6(conv2d(x, "conv1", int(32 * width), 3, 2, 1))
+    for i, (num_features, stride) in enumerate(MOBILENET_BLOCKS):
+        net = separable_conv2d(net, "sep%d" % (i + 1), int(num_features * width), stride)
+    net = global_avg_pool(net)
+    fc6 = tf.nn.relu(fc(net, "fc6", 256, fc_rank))
+    if is_training:
+        fc6 = tf.nn.dropout(fc6, 0.8)
+    return fc6
+
+
+def preprocess_input(x):
+    """Casts uint8 camera images to float and subtracts the mean pixel in-graph, so callers can feed raw frames
+    (4x fewer bytes than float32) and inference and training share the same preprocessing.
+    Float inputs are assumed to be already mean subtracted."""
+    if x.dtype == tf.uint8:
+        x = tf.cast(x, tf.float32) - c.MEAN_PIXEL
+    return x
@@ -0,0 +1,99 @@
+"""CPU inference latency and memory per backbone, to pick a backbone that fits the frame budget of a host.
+
+    python -m tensorflow_agent.net_benchmark --batch-sizes 1 32
+
+Each backbone runs in its own process so that peak memory is measured independently.
+"""
+import argparse
+import json
+import os
+import resource
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+import config as c
+import logs
+
+log = logs.get_log(__name__)
+
+
+def _get_peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def benchmark_backbone(backbone, batch_sizes=(1, 32), iterations=20, num_threads=None):
+    """Median seconds per batch with randomly initialized weights, on CPU"""
+    import tensorflow as tf
+    from tensorflow_agent.net import Net
+    rss_before = _get_peak_rss_mb()
+    with tf.Graph().as_default():
+        x = tf.placeholder(tf.uint8, (None,) + c.BASELINE_IMAGE_SHAPE)
+        with tf.variable_scope("model"):
+            net = Net(x, c.NUM_TARGETS, is_training=False, backbone=backbone)
+        num_params = sum(int(np.prod(v.get_shape().as_list())) for v in tf.trainable_variables())
+        config = tf.ConfigProto(device_count={'GPU': 0})
+        if num_threads:
+            config.intra_op_parallelism_threads = num_threads
+            config.inter_op_parallelism_threads = num_threads
+        ret = dict(backbone=backbone, num_params=num_params, batches={})
+        with tf.Session(config=config) as sess:
+            sess.run(tf.global_variables_initializer())
+            for batch_size in batch_sizes:
+                images = np.random.randint(0, 256, (batch_size,) + c.BASELINE_IMAGE_SHAPE).astype(np.uint8)
+                sess.run(net.p, {x: images})  # Warm up
+                times = []
+                for _ in range(iterations):
+                    start = time.time()
+                    sess.run(net.p, {x: images})
+                    times.append(time.time() - start)
+                secs = float(np.median(times))
+                ret['batches'][batch_size] = dict(secs=secs, frames_per_sec=batch_size / secs)
+    ret['peak_rss_mb'] = _get_peak_rss_mb()
+    ret['rss_increase_mb'] = ret['peak_rss_mb'] - rss_before
+    return ret
+
+
+def _benchmark_backbone(args):
+    return benchmark_backbone(*args)
+
+
+def run(backbones=None, batch_sizes=(1, 32), iterations=20, num_threads=None):
+    from tensorflow_agent.net import BACKBONES
+    backbones = backbones or list(BACKBONES)
+    results = []
+    for backbone in backbones:
+        pool = Pool(1)
+        try:
+            results.append(pool.apply(_benchmark_backbone, ((backbone, batch_sizes, iterations, num_threads),)))
+        finally:
+            pool.close()
+            pool.join()
+        result = results[-1]
+        log.info('%s: %.1fM params, peak RSS %dMB', backbone, result['num_params'] / 1e6, result['peak_rss_mb'])
+        for batch_size, stats in result['batches'].items():
+            log.info('    batch %d: %.1fms, %.1f frames/s', batch_size, stats['secs'] * 1000,
+                     stats['frames_per_sec'])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CPU inference for each network backbone')
+    parser.add_argument('--backbones', nargs='*', default=None, help='Defaults to all registered backbones')
+    parser.add_argument('--batch-sizes', nargs='*', type=int, default=[1, 32])
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--num-threads', type=int, default=None, help='Intra and inter op threads, i.e. 1 to '
+                                                                        'match a single core inference host')
+    parser.add_argument('--out', default=None, help='Write results to this JSON file')
+    args = parser.parse_args()
+    results = run(args.backbones, args.batch_sizes, args.iterations, args.num_threads)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
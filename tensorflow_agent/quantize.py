@@ -0,0 +1,156 @@
+"""Post-training int8 quantization of the driving net for CPU-only hosts, with an accuracy and latency report
+against the float net on the held-out (eval) recording.
+
+    python -m tensorflow_agent.quantize <checkpoint> --recording-dir <dir>
+
+Writes <checkpoint>.tflite, which can be run with main.py --net-path <checkpoint>.tflite
+
+Only backbones whose ops all have int8 TFLite kernels can be exported, i.e. mobilenet. AlexNet's local response
+normalization only has a float kernel.
+"""
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import config as c
+from tensorflow_agent.net import Net
+from tensorflow_agent.train.checkpoints import get_fc_rank, read_backbone_name
+from tensorflow_agent.train.data_utils import get_file_names, load_file, resize_to_baseline
+import logs
+
+log = logs.get_log(__name__)
+
+TFLITE_EXTENSION = '.tflite'
+TARGET_NAMES = ["spin", "direction", "speed", "speed_change", "steering", "throttle"]
+UNQUANTIZABLE_BACKBONES = {'alexnet': 'local response normalization has no int8 TFLite kernel'}
+
+
+def to_net_input(images):
+    """The quantized model takes mean subtracted float32 images so calibration and inference see the same values.
+    Quantization of the input happens inside the model."""
+    return np.asarray(images, dtype=np.float32) - c.MEAN_PIXEL
+
+
+def load_frames(recording_dir, train=True, max_frames=None):
+    images = []
+    targets = []
+    for file_name in get_file_names(recording_dir, train=train):
+        file_images, file_targets = load_file(file_name)
+        images += resize_to_baseline(file_images)
+        targets += file_targets
+        if max_frames is not None and len(images) >= max_frames:
+            break
+    return np.array(images[:max_frames], dtype=np.uint8), np.array(targets[:max_frames], dtype=np.float32)
+
+
+def export(checkpoint_path, calibration_images, out_path=None, backbone=None):
+    """Quantizes weights and activations to int8, calibrating activation ranges on calibration_images. Conversion
+    fails on ops without an int8 kernel rather than leaving them in float. Inputs and outputs stay float."""
+    backbone = backbone or read_backbone_name(checkpoint_path)
+    if backbone in UNQUANTIZABLE_BACKBONES:
+        raise ValueError('Can\'t quantize the %s backbone to int8: %s' % (backbone, UNQUANTIZABLE_BACKBONES[backbone]))
+    out_path = out_path or checkpoint_path + TFLITE_EXTENSION
+    with tf.Graph().as_default():
+        x = tf.placeholder(tf.float32, (1,) + c.BASELINE_IMAGE_SHAPE)
+        with tf.variable_scope("model"):
+            net = Net(x, c.NUM_TARGETS, is_training=False, backbone=backbone, fc_rank=get_fc_rank(checkpoint_path))
+        with tf.Session() as sess:
+            tf.train.Saver().restore(sess, checkpoint_path)
+            converter = tf.lite.TFLiteConverter.from_session(sess, [x], [net.p])
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+            def representative_dataset():
+                for image in calibration_images:
+                    yield [to_net_input(image[None])]
+
+            converter.representative_dataset = tf.lite.RepresentativeDataset(representative_dataset)
+            model = converter.convert()
+    with open(out_path, 'wb') as f:
+        f.write(model)
+    log.info('Wrote %.1fMB quantized model to %s', len(model) / 1e6, out_path)
+    return out_path
+
+
+class QuantizedNet(object):
+    """Runs an exported .tflite model with the same uint8 image in, control outputs out interface as the agent's
+    float net"""
+    def __init__(self, model_path, num_threads=None):
+        self.interpreter = tf.lite.Interpreter(model_path=model_path)
+        if num_threads is not None and hasattr(self.interpreter, 'set_num_threads'):
+            self.interpreter.set_num_threads(num_threads)
+        self.interpreter.allocate_tensors()
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+
+    def run(self, image):
+        self.interpreter.set_tensor(self.input_index, to_net_input(image.reshape(1, *image.shape)))
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_index).copy()
+
+
+def _median_secs(fn, images):
+    times = []
+    for image in images:
+        start = time.time()
+        fn(image)
+        times.append(time.time() - start)
+    return float(np.median(times))
+
+
+def report(checkpoint_path, tflite_path, images, targets, backbone=None, num_latency_frames=100):
+    """Loss per target of the float and quantized nets against the recorded targets, their disagreement, and batch 1
+    CPU latency"""
+    quantized = QuantizedNet(tflite_path)
+    with tf.Graph().as_default():
+        x = tf.placeholder(tf.uint8, (None,) + c.BASELINE_IMAGE_SHAPE)
+        with tf.variable_scope("model"):
+            net = Net(x, c.NUM_TARGETS, is_training=False, backbone=backbone or read_backbone_name(checkpoint_path),
+                      fc_rank=get_fc_rank(checkpoint_path))
+        with tf.Session(config=tf.ConfigProto(device_count={'GPU': 0})) as sess:
+            tf.train.Saver().restore(sess, checkpoint_path)
+
+            def run_float(image):
+                return sess.run(net.p, {x: image[None]})
+
+            float_out = np.concatenate([run_float(image) for image in images])
+            float_secs = _median_secs(run_float, images[:num_latency_frames])
+    quantized_out = np.concatenate([quantized.run(image) for image in images])
+    quantized_secs = _median_secs(quantized.run, images[:num_latency_frames])
+    ret = dict(num_frames=len(images), float_loss={}, quantized_loss={}, max_abs_diff={},
+               float_ms=float_secs * 1000, quantized_ms=quantized_secs * 1000)
+    for i, name in enumerate(TARGET_NAMES):
+        ret['float_loss'][name] = float(0.5 * np.mean(np.square(float_out[:, i] - targets[:, i])))
+        ret['quantized_loss'][name] = float(0.5 * np.mean(np.square(quantized_out[:, i] - targets[:, i])))
+        ret['max_abs_diff'][name] = float(np.max(np.abs(float_out[:, i] - quantized_out[:, i])))
+    return ret
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export an int8 quantized driving net and compare it to float')
+    parser.add_argument('checkpoint', help='i.e. /home/a/DeepDrive/tensorflow/2018-01-01__11-11-11AM_train/model.ckpt-98331')
+    parser.add_argument('--recording-dir', default=None, help='Calibrates on training files, reports on eval files')
+    parser.add_argument('--out', default=None, help='Defaults to <checkpoint>.tflite')
+    parser.add_argument('--calibration-frames', type=int, default=500)
+    parser.add_argument('--report-frames', type=int, default=1000)
+    parser.add_argument('--backbone', default=None, help='Defaults to the one the checkpoint was trained with')
+    args = parser.parse_args()
+    recording_dir = args.recording_dir or c.RECORDING_DIR
+
+    calibration_images, _ = load_frames(recording_dir, train=True, max_frames=args.calibration_frames)
+    tflite_path = export(args.checkpoint, calibration_images, args.out, args.backbone)
+
+    images, targets = load_frames(recording_dir, train=False, max_frames=args.report_frames)
+    result = report(args.checkpoint, tflite_path, images, targets, args.backbone)
+    log.info('%-14s %12s %12s %14s', 'target', 'float loss', 'int8 loss', 'max abs diff')
+    for name in TARGET_NAMES:
+        log.info('%-14s %12.6f %12.6f %14.6f', name, result['float_loss'][name], result['quantized_loss'][name],
+                 result['max_abs_diff'][name])
+    log.info('batch 1 CPU latency: float %.1fms, int8 %.1fms (%.1fx) over %d held-out frames', result['float_ms'],
+             result['quantized_ms'], result['float_ms'] / result['quantized_ms'], result['num_frames'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""Picks the training batch size and file prefetch depth for this host by measurement, instead of hardcoding them.
+
+Batch sizes are timed on the real training graph, computing but not applying gradients so the model is unchanged,
+and cached per host in DEEPDRIVE_DIR. The prefetch depth is the number of files the loader must keep queued to hide
+load time behind training steps, capped by host memory. It depends on the recordings, so file load time is measured
+every run. Results are recorded in the train dir.
+"""
+import math
+import os
+import platform
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import config as c
+from utils import read_json, write_json_atomic
+import logs
+
+log = logs.get_log(__name__)
+
+AUTOTUNE_FILENAME = 'autotune.json'
+CANDIDATE_BATCH_SIZES = [16, 32, 64, 128, 256]
+MIN_THROUGHPUT_GAIN = 0.05  # Larger batches change optimization, so only use them if they're clearly faster
+MEMORY_BUDGET_FRACTION = 0.5
+
+
+def get_host_key(devices, backbone):
+    from tensorflow_agent.train.towers import get_gpu_names
+    from tensorflow.python.client import device_lib
+    gpu_descriptions = [d.physical_device_desc for d in device_lib.list_local_devices() if d.name in get_gpu_names()]
+    return '|'.join([platform.node(), ','.join(devices), ';'.join(gpu_descriptions), backbone])
+
+
+def get_total_memory_bytes():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def get_peak_bytes_op():
+    """Peak GPU allocator bytes, or None if memory stats aren't available. Create this before the graph is
+    finalized."""
+    try:
+        from tensorflow.contrib.memory_stats import MaxBytesInUse
+        return MaxBytesInUse()
+    except (ImportError, tf.errors.NotFoundError) as e:
+        log.debug('memory stats unavailable %r', e)
+        return None
+
+
+def get_candidate_batch_sizes(num_devices, candidates=CANDIDATE_BATCH_SIZES):
+    """Candidates rounded up to multiples of num_devices, as batches are split evenly across towers"""
+    return sorted(set(int(math.ceil(batch_size / num_devices)) * num_devices for batch_size in candidates))
+
+
+def measure_batch_sizes(sess, x, y, grads_op, num_devices, peak_bytes_op=None, candidates=CANDIDATE_BATCH_SIZES,
+                        steps=10, warmup=2):
+    """Frames / sec of computing gradients per batch size, stopping at the first that runs out of memory"""
+    rng = np.random.RandomState(c.RNG_SEED)
+    results = []
+    for batch_size in get_candidate_batch_sizes(num_devices, candidates):
+        feed_dict = {x: rng.randint(0, 256, (batch_size,) + c.BASELINE_IMAGE_SHAPE).astype(np.uint8),
+                     y: rng.rand(batch_size, c.NUM_TARGETS).astype(np.float32)}
+        try:
+            for _ in range(warmup):
+                sess.run(grads_op, feed_dict)
+            start = time.time()
+            for _ in range(steps):
+                sess.run(grads_op, feed_dict)
+            steps_per_sec = steps / (time.time() - start)
+            peak_bytes = None
+            if peak_bytes_op is not None:
+                try:
+                    peak_bytes = int(sess.run(peak_bytes_op))
+                except tf.errors.OpError:
+                    peak_bytes_op = None
+        except tf.errors.ResourceExhaustedError:
+            log.info('autotune: batch size %d does not fit in memory', batch_size)
+            results.append(dict(batch_size=batch_size, feasible=False))
+            break
+        results.append(dict(batch_size=batch_size, feasible=True, steps_per_sec=steps_per_sec,
+                            frames_per_sec=steps_per_sec * batch_size, peak_bytes=peak_bytes))
+        log.info('autotune: batch size %d %.1f frames/s', batch_size, steps_per_sec * batch_size)
+    return results
+
+
+def pick_batch_size(results, min_gain=MIN_THROUGHPUT_GAIN):
+    """Smallest feasible batch size within min_gain of the best throughput"""
+    if not results:
+        raise ValueError('No batch sizes were measured')
+    feasible = [r for r in results if r['feasible']]
+    if not feasible:
+        raise RuntimeError('No candidate batch size fits in memory')
+    best = max(r['frames_per_sec'] for r in feasible)
+    return min(r['batch_size'] for r in feasible if r['frames_per_sec'] >= best * (1 - min_gain))
+
+
+def measure_file_load(file_names, num_files=2):
+    """Seconds, bytes and frames per loaded file"""
+    from tensorflow_agent.train.data_utils import load_file
+    secs, num_bytes, num_frames = [], [], []
+    for file_name in file_names[:num_files]:
+        start = time.time()
+        images, targets = load_file(file_name)
+        secs.append(time.time() - start)
+        num_bytes.append(sum(image.nbytes for image in images) + np.asarray(targets).nbytes)
+        num_frames.append(len(images))
+    return float(np.mean(secs)), float(np.mean(num_bytes)), float(np.mean(num_frames))
+
+
+def pick_queue_size(load_secs, file_bytes, frames_per_file, frames_per_sec, memory_bytes=None,
+                    memory_fraction=MEMORY_BUDGET_FRACTION):
+    """Enough queued files that training doesn't wait on loading, as long as they fit in the memory budget"""
+    consume_secs = max(frames_per_file / frames_per_sec, 1e-3)
+    queue_size = int(math.ceil(load_secs / consume_secs)) + 1
+    if memory_bytes and file_bytes:
+        queue_size = min(queue_size, int(memory_bytes * memory_fraction // file_bytes))
+    return max(queue_size, 1)
+
+
+def autotune(sess, x, y, grads_op, devices, backbone, file_names, peak_bytes_op=None, train_dir=None,
+             use_cache=True):
+    """Returns (batch_size, queue_size), measuring the batch size if this host, device set and backbone haven't
+    been tuned"""
+    host_key = get_host_key(devices, backbone)
+    cache_filename = os.path.join(c.DEEPDRIVE_DIR, AUTOTUNE_FILENAME)
+    cache = read_json(cache_filename, default={})
+    if use_cache and host_key in cache:
+        batch_results = cache[host_key]['batch_sizes']
+        log.info('autotune: using batch sizes measured earlier on this host')
+    else:
+        batch_results = measure_batch_sizes(sess, x, y, grads_op, len(devices), peak_bytes_op)
+        cache[host_key] = dict(batch_sizes=batch_results, host_key=host_key, time=time.time())
+        os.makedirs(c.DEEPDRIVE_DIR, exist_ok=True)
+        write_json_atomic(cache, cache_filename)
+    batch_size = pick_batch_size(batch_results)
+    frames_per_sec = [r for r in batch_results if r['batch_size'] == batch_size][0]['frames_per_sec']
+    load_secs, file_bytes, frames_per_file = measure_file_load(file_names)
+    queue_size = pick_queue_size(load_secs, file_bytes, frames_per_file, frames_per_sec, get_total_memory_bytes())
+    result = dict(batch_size=batch_size, queue_size=queue_size, batch_sizes=batch_results,
+                  file_load_secs=load_secs, file_bytes=file_bytes, frames_per_file=frames_per_file,
+                  host_key=host_key, time=time.time())
+    log.info('autotune: picked batch size %d (%.1f frames/s), queue size %d (%.1fs to load a file)', batch_size,
+             frames_per_sec, queue_size, load_secs)
+    if train_dir is not None:
+        write_json_atomic(result, os.path.join(train_dir, AUTOTUNE_FILENAME))
+    return result['batch_size'], result['queue_size']
@@ -0,0 +1,160 @@
+import glob
+import os
+import threading
+
+import tensorflow as tf
+
+from utils import read_json, write_json_atomic
+import logs
+
+log = logs.get_log(__name__)
+
+CHECKPOINT_PREFIX = 'model.ckpt'
+EVAL_LOSSES_FILENAME = 'eval_losses.json'
+BEST_CHECKPOINTS_FILENAME = 'best_checkpoints.json'
+BACKBONE_FILENAME = 'backbone.json'
+
+
+def get_checkpoint_step(checkpoint_path):
+    return int(checkpoint_path[checkpoint_path.rindex('-') + 1:])
+
+
+def record_eval_loss(train_dir, checkpoint_path, eval_loss):
+    """Called by the eval process so the trainer can retain the best checkpoints by eval loss"""
+    filename = os.path.join(train_dir, EVAL_LOSSES_FILENAME)
+    eval_losses = read_json(filename, default={})
+    eval_losses[str(get_checkpoint_step(checkpoint_path))] = eval_loss
+    write_json_atomic(eval_losses, filename)
+
+
+def get_eval_losses(train_dir):
+    eval_losses = read_json(os.path.join(train_dir, EVAL_LOSSES_FILENAME), default={})
+    return {int(step): loss for step, loss in eval_losses.items()}
+
+
+def record_backbone(train_dir, backbone, fc_rank=None):
+    write_json_atomic(dict(backbone=backbone, fc_rank=fc_rank), os.path.join(train_dir, BACKBONE_FILENAME))
+
+
+def _read_backbone(checkpoint_path):
+    train_dir = checkpoint_path if os.path.isdir(checkpoint_path) else os.path.dirname(checkpoint_path)
+    return read_json(os.path.join(train_dir, BACKBONE_FILENAME), default={})
+
+
+def read_backbone_name(checkpoint_path, default='alexnet'):
+    """Backbone a checkpoint was trained with. Checkpoints from before backbones were recorded are AlexNet."""
+    return _read_backbone(checkpoint_path).get('backbone', default)
+
+
+def get_fc_rank(checkpoint_path):
+    """Rank of the factorized fully connected layers, or None if they aren't factorized"""
+    return _read_backbone(checkpoint_path).get('fc_rank')
+
+
+def get_best_checkpoint(train_dir):
+    """Path of the retained checkpoint with the lowest eval loss in train_dir, or None if none have been evaluated"""
+    best = read_json(os.path.join(train_dir, BEST_CHECKPOINTS_FILENAME), default=[])
+    for checkpoint in best:
+        if glob.glob(checkpoint['path'] + '.index'):
+            return checkpoint['path']
+    return None
+
+
+class BackgroundCheckpointer(object):
+    """Saves checkpoints without stalling training.
+
+    The training thread only fetches a snapshot of the variables. A background thread loads the snapshot into a
+    mirror graph and writes it with a Saver, so variable names match checkpoints written by tf.train.Saver.
+
+    The keep_last most recent checkpoints are always kept, so that training can resume and the eval process has
+    time to evaluate them. Beyond those, only the keep_best checkpoints with the lowest eval loss are retained.
+    """
+    def __init__(self, train_dir, variables, every_steps=1000, keep_best=3, keep_last=2):
+        self.train_dir = train_dir
+        self.variables = variables
+        self.every_steps = every_steps
+        self.keep_best = keep_best
+        self.keep_last = keep_last
+        self.last_save_step = None
+        self.is_deferred = False
+        self.thread = None
+        self.checkpoint_paths = self._get_existing_checkpoint_paths()
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.placeholders = []
+            self.init_ops = []
+            mirror_vars = {}
+            for v in variables:
+                placeholder = tf.placeholder(v.dtype.base_dtype, v.get_shape())
+                mirror_var = tf.Variable(placeholder, trainable=False, name=v.op.name)
+                self.placeholders.append(placeholder)
+                self.init_ops.append(mirror_var.initializer)
+                mirror_vars[v.op.name] = mirror_var
+            self.saver = tf.train.Saver(mirror_vars, max_to_keep=None)  # We do our own retention
+        self.sess = tf.Session(graph=self.graph, config=tf.ConfigProto(device_count={'GPU': 0}))
+
+    def _get_existing_checkpoint_paths(self):
+        state = tf.train.get_checkpoint_state(self.train_dir)
+        if state is None:
+            return []
+        return [p for p in state.all_model_checkpoint_paths if glob.glob(p + '.index')]
+
+    def maybe_save(self, sess, step):
+        if self.last_save_step is None:
+            self.last_save_step = step
+        elif step - self.last_save_step >= self.every_steps:
+            if self.is_saving():
+                # Retried every step until the previous write finishes
+                if not self.is_deferred:
+                    log.warning('Previous checkpoint still being written at step %d, deferring save', step)
+                    self.is_deferred = True
+            else:
+                self.is_deferred = False
+                self.save(sess, step)
+
+    def is_saving(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def save(self, sess, step):
+        """Snapshots the variables and writes them in the background. Only call when is_saving() is False."""
+        self.last_save_step = step
+        values = sess.run(self.variables)  # Snapshot - the only part that happens on the training thread
+        self.thread = threading.Thread(target=self._write, args=(values, step))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+
+    def _write(self, values, step):
+        try:
+            self.sess.run(self.init_ops, feed_dict=dict(zip(self.placeholders, values)))
+            path = self.saver.save(self.sess, os.path.join(self.train_dir, CHECKPOINT_PREFIX), global_step=step,
+                                   write_meta_graph=False)
+            self.checkpoint_paths.append(path)
+            self.apply_retention()
+            log.info('Saved checkpoint %s', path)
+        except Exception as e:
+            log.error('Error saving checkpoint at step %d - error was %r', step, e)
+
+    def apply_retention(self):
+        eval_losses = get_eval_losses(self.train_dir)
+        by_step = sorted(self.checkpoint_paths, key=get_checkpoint_step)
+        evaluated = [p for p in by_step if get_checkpoint_step(p) in eval_losses]
+        best = sorted(evaluated, key=lambda p: eval_losses[get_checkpoint_step(p)])[:self.keep_best]
+        keep = set(by_step[-self.keep_last:]) | set(best)
+        for path in by_step:
+            if path not in keep:
+                for filename in glob.glob(path + '.*'):
+                    os.remove(filename)
+        self.checkpoint_paths = [p for p in by_step if p in keep]
+        tf.train.update_checkpoint_state(self.train_dir, self.checkpoint_paths[-1],
+                                         all_model_checkpoint_paths=self.checkpoint_paths)
+        write_json_atomic([dict(path=p, step=get_checkpoint_step(p), eval_loss=eval_losses[get_checkpoint_step(p)])
+                           for p in best], os.path.join(self.train_dir, BEST_CHECKPOINTS_FILENAME))
+
+    def close(self):
+        self.wait()
+        self.sess.close()
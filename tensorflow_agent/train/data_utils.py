@@ -1,9 +1,9 @@
-import glob
 import threading
 from collections import deque
 
 import numpy as np
 
+from catalog import get_split_files
 from utils import read_hdf5
 import config as c
 import logs
@@ -12,9 +12,10 @@ log = logs.get_log(__name__)
 
 
 class BackgroundGenerator(threading.Thread):
-    def __init__(self, generator, should_shuffle=False):
+    def __init__(self, generator, should_shuffle=False, queue_size=None):
         threading.Thread.__init__(self)
         self.queue = deque()
+        self.queue_size = queue_size or c.NUM_TRAIN_FILES_TO_QUEUE
         self.generator = generator
         self.daemon = True
         self.should_shuffle = should_shuffle
@@ -25,7 +26,7 @@ class BackgroundGenerator(threading.Thread):
         for item in self.generator:
             with self.cv:
                 log.debug('queue length %r', len(self.queue))
-                while len(self.queue) > c.NUM_TRAIN_FILES_TO_QUEUE:
+                while len(self.queue) > self.queue_size:
                     log.debug('waiting for queue size to decrease')
                     self.cv.wait()
                 if self.should_shuffle:
@@ -61,11 +62,7 @@ class BackgroundGenerator(threading.Thread):
 
 
 def get_file_names(hdf5_path, train=True):
-    files = glob.glob(hdf5_path + '/**/*.hdf5', recursive=True)
-    if train:
-        files = files[1:]
-    else:
-        files = files[0:1]
+    files = get_split_files(hdf5_path, train)
     if len(files) == 0:
         raise Exception('zero %s hdf5 files, aborting!' % 'train' if train else 'eval')
     return files
@@ -87,6 +84,17 @@ def load_file(h5_filename):
     return out_images, out_targets
 
 
+def resize_to_baseline(images):
+    """Resizes, in place, images that aren't c.BASELINE_IMAGE_SHAPE, i.e. from camera rigs with randomized capture
+    sizes, so they can be stacked into a batch"""
+    for i, image in enumerate(images):
+        if image.shape != c.BASELINE_IMAGE_SHAPE:
+            import scipy.misc
+            log.debug('invalid image shape %s - resizing', str(image.shape))
+            images[i] = scipy.misc.imresize(image, (c.BASELINE_IMAGE_SHAPE[0], c.BASELINE_IMAGE_SHAPE[1]))
+    return images
+
+
 def normalize_frame(frame):
     spin = frame['angular_velocity'][2]
     if spin <= -c.SPIN_THRESHOLD:
@@ -110,8 +118,9 @@ def file_loader(file_stream):
     log.info('finished training files')
 
 
-def batch_gen(file_stream, batch_size):
-    gen = BackgroundGenerator(file_loader(file_stream), should_shuffle=False)
+def batch_gen(file_stream, batch_size, queue_size=None):
+    """queue_size: Number of loaded files to prefetch, defaults to c.NUM_TRAIN_FILES_TO_QUEUE"""
+    gen = BackgroundGenerator(file_loader(file_stream), should_shuffle=False, queue_size=queue_size)
     for images, targets in gen:
         num_iters = len(images) // batch_size
         print('num iters', num_iters)
@@ -127,14 +136,14 @@ class Dataset(object):
         self._files = files
         self.log = log
 
-    def iterate_once(self, batch_size):
+    def iterate_once(self, batch_size, queue_size=None):
         def file_stream():
             for file_name in self._files:
                 self.log.info('queueing data from %s for iterate once', file_name)
                 yield file_name
-        yield from batch_gen(file_stream(), batch_size)
+        yield from batch_gen(file_stream(), batch_size, queue_size)
 
-    def iterate_forever(self, batch_size):
+    def iterate_forever(self, batch_size, queue_size=None):
         def file_stream():
             while True:
                 c.RNG.shuffle(self._files)  # File order will be the same every epoch
@@ -145,7 +154,7 @@ class Dataset(object):
         # TODO: Make Python 2 compatible with something like
         # for x in batch_gen(file_stream(), batch_size):
         #     yield x
-        yield from batch_gen(file_stream(), batch_size)
+        yield from batch_gen(file_stream(), batch_size, queue_size)
 
 
 def get_dataset(hdf5_path, log, train=True):
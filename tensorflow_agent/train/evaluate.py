@@ -0,0 +1,105 @@
+import time
+from multiprocessing import Process
+
+import numpy as np
+import tensorflow as tf
+
+import config as c
+from tensorflow_agent.net import Net
+from tensorflow_agent.train.checkpoints import get_checkpoint_step, read_backbone_name, record_eval_loss
+from tensorflow_agent.train.data_utils import get_file_names, load_file, resize_to_baseline
+import logs
+
+log = logs.get_log(__name__)
+
+TARGET_NAMES = ["spin", "direction", "speed", "speed_change", "steering", "throttle"]
+
+
+def load_eval_set(recording_dir):
+    """Decode the eval files once and keep them in memory for the life of the eval process"""
+    images = []
+    targets = []
+    for file_name in get_file_names(recording_dir, train=False):
+        log.info('loading eval data from %s', file_name)
+        file_images, file_targets = load_file(file_name)
+        images += resize_to_baseline(file_images)
+        targets += file_targets
+    if not images:
+        raise Exception('No eval frames found in %s, aborting!' % recording_dir)
+    return np.array(images, dtype=np.uint8), np.array(targets, dtype=np.float32)
+
+
+def wait_for_new_checkpoint(train_dir, last_checkpoint, poll_secs):
+    while True:
+        checkpoint_path = tf.train.latest_checkpoint(train_dir)
+        if checkpoint_path is not None and checkpoint_path != last_checkpoint:
+            return checkpoint_path
+        time.sleep(poll_secs)
+
+
+def compute_losses(sess, model, x, images, targets, batch_size):
+    losses = []
+    for i in range(0, len(images), batch_size):
+        preds = sess.run(model.p, {x: images[i:i + batch_size]})
+        losses.append(np.square(targets[i:i + batch_size] - preds))
+    return np.concatenate(losses)
+
+
+def run(train_dir, eval_dir, recording_dir, batch_size=32, poll_secs=10, use_gpu=False, backbone=c.DEFAULT_BACKBONE):
+    """Evaluate each new checkpoint written to train_dir, writing eval/* summaries to eval_dir.
+
+    Runs in its own process (see start) so that training never blocks on evaluation.
+    """
+    images, targets = load_eval_set(recording_dir)
+    log.info('loaded %d eval frames', len(images))
+    with tf.Graph().as_default():
+        x = tf.placeholder(tf.uint8, (None,) + c.BASELINE_IMAGE_SHAPE)
+        with tf.variable_scope("model"):
+            model = Net(x, c.NUM_TARGETS, is_training=False, backbone=backbone)
+        saver = tf.train.Saver()
+        eval_sw = tf.summary.FileWriter(eval_dir)
+
+        config = tf.ConfigProto(allow_soft_placement=True)
+        if not use_gpu:
+            config.device_count['GPU'] = 0  # Leave the GPU to training
+        with tf.Session(config=config) as sess:
+            checkpoint_path = None
+            while True:
+                checkpoint_path = wait_for_new_checkpoint(train_dir, checkpoint_path, poll_secs)
+                try:
+                    saver.restore(sess, checkpoint_path)
+                except (tf.errors.NotFoundError, tf.errors.DataLossError) as e:
+                    log.warning('Could not restore %s for eval, skipping - error was %r', checkpoint_path, e)
+                    continue
+                step = get_checkpoint_step(checkpoint_path)
+                losses = compute_losses(sess, model, x, images, targets, batch_size)
+                eval_loss = float(0.5 * losses.sum() / losses.shape[0])
+                summary = tf.Summary()
+                summary.value.add(tag="eval/loss", simple_value=eval_loss)
+                for i in range(len(TARGET_NAMES)):
+                    summary.value.add(tag="eval/{}".format(TARGET_NAMES[i]),
+                                      simple_value=float(0.5 * losses[:, i].mean()))
+                eval_sw.add_summary(summary, step)
+                eval_sw.flush()
+                record_eval_loss(train_dir, checkpoint_path, eval_loss)
+                log.info('eval loss at step %d is %f', step, eval_loss)
+
+
+def start(train_dir, eval_dir, recording_dir, batch_size=32, backbone=c.DEFAULT_BACKBONE):
+    """Starts the evaluator in a separate process - call this before building any graph in the training process"""
+    p = Process(target=run, args=(train_dir, eval_dir, recording_dir, batch_size), kwargs=dict(backbone=backbone))
+    p.daemon = True  # Dies with the training process
+    p.start()
+    return p
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Evaluate checkpoints as they are written by training')
+    parser.add_argument('train_dir')
+    parser.add_argument('--eval-dir', default=None)
+    parser.add_argument('--recording-dir', default=c.RECORDING_DIR)
+    parser.add_argument('--use-gpu', action='store_true', default=False)
+    args = parser.parse_args()
+    run(args.train_dir, args.eval_dir or args.train_dir.replace('_train', '_eval'), args.recording_dir,
+        use_gpu=args.use_gpu, backbone=read_backbone_name(args.train_dir))
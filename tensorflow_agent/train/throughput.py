@@ -0,0 +1,66 @@
+import time
+
+import tensorflow as tf
+
+import logs
+
+log = logs.get_log(__name__)
+
+
+class ThroughputMeter(object):
+    """Splits training step time into time blocked on input, time in sess.run and summary overhead so that it's
+    obvious whether training is input-bound or compute-bound"""
+    def __init__(self, report_every=100):
+        self.report_every = report_every
+        self.reset()
+
+    # noinspection PyAttributeOutsideInit
+    def reset(self):
+        self.start_time = time.time()
+        self.steps = 0
+        self.images = 0
+        self.input_secs = 0.
+        self.run_secs = 0.
+        self.summary_steps = 0
+        self.summary_run_secs = 0.
+
+    def add_step(self, num_images, input_secs, run_secs, summarized=False):
+        self.steps += 1
+        self.images += num_images
+        self.input_secs += input_secs
+        if summarized:
+            self.summary_steps += 1
+            self.summary_run_secs += run_secs
+        else:
+            self.run_secs += run_secs
+
+    def should_report(self):
+        return self.steps >= self.report_every
+
+    def get_stats(self):
+        elapsed = max(time.time() - self.start_time, 1e-9)
+        plain_steps = self.steps - self.summary_steps
+        plain_run_secs = self.run_secs / max(plain_steps, 1)
+        summary_overhead_secs = max(self.summary_run_secs - plain_run_secs * self.summary_steps, 0.)
+        return dict(
+            images_per_sec=self.images / elapsed,
+            steps_per_sec=self.steps / elapsed,
+            input_wait_ms=1000. * self.input_secs / max(self.steps, 1),
+            run_ms=1000. * plain_run_secs,
+            summary_overhead_ms=1000. * summary_overhead_secs / max(self.steps, 1),
+            input_wait_fraction=self.input_secs / elapsed,
+        )
+
+    def report(self, step, summary_writer=None):
+        stats = self.get_stats()
+        log.info('step %d - %.1f images/s, %.1f steps/s, input wait %.1fms (%d%%), sess.run %.1fms, '
+                 'summary overhead %.1fms/step',
+                 step, stats['images_per_sec'], stats['steps_per_sec'], stats['input_wait_ms'],
+                 round(100 * stats['input_wait_fraction']), stats['run_ms'], stats['summary_overhead_ms'])
+        if summary_writer is not None:
+            summary = tf.Summary()
+            for name, value in stats.items():
+                summary.value.add(tag="throughput/{}".format(name), simple_value=float(value))
+            summary_writer.add_summary(summary, step)
+        self.reset()
+        return stats
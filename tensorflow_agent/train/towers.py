@@ -0,0 +1,78 @@
+import tensorflow as tf
+
+import logs
+
+log = logs.get_log(__name__)
+
+VARIABLE_OPS = ('Variable', 'VariableV2', 'VarHandleOp')
+
+
+def get_gpu_names():
+    from tensorflow.python.client import device_lib
+    return [x.name for x in device_lib.list_local_devices() if x.device_type == 'GPU']
+
+
+def get_tower_devices(num_towers=None):
+    """One device per tower. Uses all local GPUs by default, or virtual CPU devices when there are no GPUs
+    (see get_session_config) so multi-tower training can be run and tested on CPU only hosts."""
+    gpus = get_gpu_names()
+    if gpus:
+        if num_towers is not None and num_towers > len(gpus):
+            raise ValueError('Requested %d towers but only found %d GPUs' % (num_towers, len(gpus)))
+        return gpus[:num_towers or len(gpus)]
+    else:
+        return ['/cpu:%d' % i for i in range(num_towers or 1)]
+
+
+def get_session_config(devices):
+    config = tf.ConfigProto(allow_soft_placement=True)
+    num_cpus = len([d for d in devices if 'cpu' in d.lower()])
+    if num_cpus > 1:
+        config.device_count['CPU'] = num_cpus
+    return config
+
+
+def _place_variables_on(variable_device, compute_device):
+    def device_fn(op):
+        if op.type in VARIABLE_OPS:
+            return variable_device
+        return compute_device
+    return device_fn
+
+
+def build_towers(x, y, devices, build_tower):
+    """Splits the batch in x and y evenly across devices and calls build_tower(tower_x, tower_y) on each, sharing
+    variables between towers. Variables live on the first device.
+
+    Returns a list of whatever build_tower returns, one per device.
+    """
+    if len(devices) == 1:
+        # Keep the single device graph exactly as it was, i.e. no device pinning or tower name scopes
+        return [build_tower(x, y)]
+    x_splits = tf.split(x, len(devices))
+    y_splits = tf.split(y, len(devices))
+    towers = []
+    for i, device in enumerate(devices):
+        with tf.device(_place_variables_on(devices[0], device)), tf.name_scope('tower_%d' % i), \
+                tf.variable_scope(tf.get_variable_scope(), reuse=True if i > 0 else None):
+            towers.append(build_tower(x_splits[i], y_splits[i]))
+    return towers
+
+
+def average_gradients(tower_grads_and_vars):
+    """Averages the gradients for each variable across towers.
+
+    tower_grads_and_vars is a list (one per tower) of lists of (gradient, variable) as returned by
+    Optimizer.compute_gradients
+    """
+    if len(tower_grads_and_vars) == 1:
+        return tower_grads_and_vars[0]
+    ret = []
+    for grads_and_vars in zip(*tower_grads_and_vars):
+        var = grads_and_vars[0][1]
+        grads = [g for g, _ in grads_and_vars if g is not None]
+        if not grads:
+            ret.append((None, var))
+        else:
+            ret.append((tf.add_n(grads) / len(grads), var))
+    return ret
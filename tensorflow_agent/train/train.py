@@ -1,14 +1,16 @@
 from __future__ import print_function
 
 import os
+import time
 
-import numpy as np
-import scipy.misc
 import tensorflow as tf
 
 import config as c
 from tensorflow_agent.net import Net
-from tensorflow_agent.train.data_utils import get_dataset
+from tensorflow_agent.train import autotune, evaluate, towers
+from tensorflow_agent.train.checkpoints import BackgroundCheckpointer, read_backbone_name, record_backbone
+from tensorflow_agent.train.data_utils import Dataset, get_file_names, resize_to_baseline
+from tensorflow_agent.train.throughput import ThroughputMeter
 from utils import download, has_stuff
 import logs
 
@@ -40,7 +42,19 @@ def visualize_gradients(grads_and_vars):
     tf.summary.scalar("model/var_global_norm", tf.global_norm(var_list))
 
 
-def run(resume_dir=None, recording_dir=c.RECORDING_DIR):
+def run(resume_dir=None, recording_dir=None, batch_size=None, num_towers=None,
+        checkpoint_every_steps=1000, keep_best_checkpoints=3, backbone=None):
+    """Train on recorded driving data.
+
+    batch_size: Defaults to the fastest that fits in memory on this host, see autotune.py
+    num_towers: Number of model replicas to split each batch across, defaults to one per local GPU.
+        On hosts without GPUs, that many virtual CPU devices are created.
+    checkpoint_every_steps: Checkpoints are written in the background at this cadence
+    keep_best_checkpoints: Number of checkpoints with the lowest eval loss to retain in addition to the most recent
+    backbone: Name of the network backbone in tensorflow_agent/net.py, defaults to the one being resumed or
+        c.DEFAULT_BACKBONE. Resuming with a different backbone is an error.
+    """
+    recording_dir = recording_dir or c.RECORDING_DIR
     os.makedirs(c.TENSORFLOW_OUT_DIR, exist_ok=True)
     if resume_dir is not None:
         date_str = resume_dir[resume_dir.rindex('/') + 1:resume_dir.rindex('_')]
@@ -50,17 +64,41 @@ def run(resume_dir=None, recording_dir=c.RECORDING_DIR):
     sess_eval_dir = '%s/%s_eval' % (c.TENSORFLOW_OUT_DIR, date_str)
     os.makedirs(sess_train_dir, exist_ok=True)
     os.makedirs(sess_eval_dir, exist_ok=True)
-    batch_size = 32  # Change this to fit in your GPU's memory
-    x = tf.placeholder(tf.float32, (None,) + c.BASELINE_IMAGE_SHAPE)
+    if resume_dir:
+        recorded_backbone = read_backbone_name(sess_train_dir, default=c.DEFAULT_BACKBONE)
+        if backbone is not None and backbone != recorded_backbone:
+            raise ValueError('Can\'t resume %s with the %s backbone as it was trained with %s' %
+                             (sess_train_dir, backbone, recorded_backbone))
+        backbone = recorded_backbone
+    else:
+        backbone = backbone or c.DEFAULT_BACKBONE
+    record_backbone(sess_train_dir, backbone)
+    log.info('training %s backbone', backbone)
+
+    # Evaluate checkpoints in a separate process so training never stops for eval.
+    # Started before building the graph as forking a process with a live session is unsafe.
+    evaluate.start(sess_train_dir, sess_eval_dir, recording_dir, batch_size or 32, backbone)
+
+    devices = towers.get_tower_devices(num_towers)
+    if batch_size is not None and batch_size % len(devices) != 0:
+        raise ValueError('Batch size %d is not divisible by the number of towers %d' % (batch_size, len(devices)))
+
+    x = tf.placeholder(tf.uint8, (None,) + c.BASELINE_IMAGE_SHAPE)
     y = tf.placeholder(tf.float32, (None, c.NUM_TARGETS))
-    log.info('creating model')
-    with tf.variable_scope("model") as vs:
-        model = Net(x, c.NUM_TARGETS)
-        vs.reuse_variables()
-        eval_model = Net(x, c.NUM_TARGETS, is_training=False)
+    log.info('creating model on %s', ', '.join(devices))
+
+    def build_tower(tower_x, tower_y):
+        with tf.variable_scope("model"):
+            tower_model = Net(tower_x, c.NUM_TARGETS, backbone=backbone)
+        tower_loss = 0.5 * tf.reduce_sum(tf.square(tower_model.p - tower_y)) / tf.to_float(tf.shape(tower_x)[0])
+        return tower_model, tower_y, tower_loss
+
+    model_towers = towers.build_towers(x, y, devices, build_tower)
+    model, tower_0_y, _ = model_towers[0]
+    tower_losses = [tower_loss for _, _, tower_loss in model_towers]
 
     l2_norm = tf.global_norm(tf.trainable_variables())
-    loss = 0.5 * tf.reduce_sum(tf.square(model.p - y)) / tf.to_float(tf.shape(x)[0])
+    loss = tf.add_n(tower_losses) / len(tower_losses)
     tf.summary.scalar("model/loss", loss)
     tf.summary.scalar("model/l2_norm", l2_norm)
     total_loss = loss + 0.0005 * l2_norm
@@ -73,13 +111,21 @@ def run(resume_dir=None, recording_dir=c.RECORDING_DIR):
 
     opt = tf.train.AdamOptimizer(learning_rate)
     tf.summary.scalar("model/learning_rate", learning_rate)
-    grads_and_vars = opt.compute_gradients(total_loss)
-    visualize_model(model, y)
+    grads_and_vars = towers.average_gradients(
+        [opt.compute_gradients(tower_loss + 0.0005 * l2_norm, colocate_gradients_with_ops=True)
+         for tower_loss in tower_losses])
+    # Gradients without updating variables, to time batch sizes
+    grads_op = tf.group(*[g for g, v in grads_and_vars if g is not None])
+    peak_bytes_op = autotune.get_peak_bytes_op() if batch_size is None else None
+    visualize_model(model, tower_0_y)
     visualize_gradients(grads_and_vars)
     summary_op = tf.summary.merge_all()
     update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
     with tf.control_dependencies(update_ops):
         train_op = opt.apply_gradients(grads_and_vars, model.global_step)
+    with tf.control_dependencies([train_op]):
+        # Fetched along with train_op to avoid an extra session call for the step
+        train_step = model.global_step.read_value()
 
     init_op = tf.global_variables_initializer()
     pretrained_var_map = {}
@@ -93,34 +139,40 @@ def run(resume_dir=None, recording_dir=c.RECORDING_DIR):
 
         pretrained_var_map[v.op.name[6:]] = v
 
-    alexnet_saver = tf.train.Saver(pretrained_var_map)
+    # ImageNet weights are only available for AlexNet, other backbones train from scratch
+    alexnet_saver = tf.train.Saver(pretrained_var_map) if backbone == 'alexnet' else None
 
     def init_fn(ses):
         log.info('Initializing parameters.')
-        if not has_stuff(c.BVLC_CKPT_PATH):
+        if alexnet_saver is not None and not has_stuff(c.BVLC_CKPT_PATH):
             print('\n--------- ImageNet checkpoint not found, downloading ----------')
             download(c.BVLC_CKPT_URL, c.WEIGHTS_DIR, warn_existing=False, overwrite=True)
         ses.run(init_op)
-        alexnet_saver.restore(ses, c.BVLC_CKPT_PATH)
+        if alexnet_saver is not None:
+            alexnet_saver.restore(ses, c.BVLC_CKPT_PATH)
 
-    saver = tf.train.Saver()
+    saver = tf.train.Saver()  # Only used by the Supervisor to restore when resuming
+    checkpointer = BackgroundCheckpointer(sess_train_dir, tf.global_variables(), every_steps=checkpoint_every_steps,
+                                          keep_best=keep_best_checkpoints)
     sv = tf.train.Supervisor(is_chief=True,
                              logdir=sess_train_dir,
                              summary_op=None,  # Automatic summaries don't work with placeholders.
                              saver=saver,
                              global_step=model.global_step,
                              save_summaries_secs=30,
-                             save_model_secs=60,
+                             save_model_secs=0,  # Saving on the training thread stalls steps, see checkpointer
                              init_op=None,
                              init_fn=init_fn)
 
-    eval_sw = tf.summary.FileWriter(sess_eval_dir)
-
-    train_dataset = get_dataset(recording_dir, log)
-    eval_dataset = get_dataset(recording_dir, log, train=False)
-    config = tf.ConfigProto(allow_soft_placement=True)
+    train_files = get_file_names(recording_dir, train=True)
+    train_dataset = Dataset(train_files, log)
+    config = towers.get_session_config(devices)
     with sv.managed_session(config=config) as sess, sess.as_default():
-        train_data_provider = train_dataset.iterate_forever(batch_size)
+        queue_size = None
+        if batch_size is None:
+            batch_size, queue_size = autotune.autotune(sess, x, y, grads_op, devices, backbone, train_files,
+                                                       peak_bytes_op, train_dir=sess_train_dir)
+        train_data_provider = train_dataset.iterate_forever(batch_size, queue_size)
         log.info('\n\n*********************************************************************\n'
                  'Start tensorboard with \n\n\ttensorboard --logdir="' + c.TENSORFLOW_OUT_DIR +
                  '"\n\n(In Windows tensorboard will be in your python env\'s Scripts folder, '
@@ -129,55 +181,45 @@ def run(resume_dir=None, recording_dir=c.RECORDING_DIR):
                  'started / has tabs open. If so, shut down Tenosrboard first and close all Tensorboard tabs. '
                  'Sometimes you may just need to restart training if you get CUDA device errors.'
                  '\n*********************************************************************\n\n')
-        while True:
-            for i in range(1000):
+        throughput = ThroughputMeter()
+        try:
+            i = 0
+            while True:
+                i += 1
+                input_start = time.time()
                 images, targets = next(train_data_provider)
+                input_secs = time.time() - input_start
                 log.debug('num images %r', len(images))
                 log.debug('num targets %r', len(targets))
                 valid = True
-                for img_idx, img in enumerate(images):
-                    img = images[img_idx]
-                    if img.shape != c.BASELINE_IMAGE_SHAPE:
-                        log.debug('invalid image shape %s - resizing', str(img.shape))
-                        images[img_idx] = scipy.misc.imresize(img, (c.BASELINE_IMAGE_SHAPE[0],
-                                                                    c.BASELINE_IMAGE_SHAPE[1]))
+                resize_to_baseline(images)
                 for tgt in targets:
                     if len(tgt) != 6:
                         log.error('invalid target shape %r skipping' % len(tgt))
                         valid = False
                 if valid:
                     feed_dict = {x: images, y: targets}  # , 'phase:0': 1}
-                    if i % 10 == 0 and i > 0:
-                        # Summarize: Do this less frequently to speed up training time, more frequently to debug issues
-                        try:
-                            _, summ = sess.run([train_op, summary_op], feed_dict)
-                        except ValueError as e:
-                            print('Error processing batch, skipping - error was %r' % e)
-                        sv.summary_computed(sess, summ)
+                    # Summarize: Do this less frequently to speed up training time, more frequently to debug issues
+                    should_summarize = i % 10 == 0
+                    run_start = time.time()
+                    try:
+                        if should_summarize:
+                            step, summ = sess.run([train_step, summary_op], feed_dict)
+                            sv.summary_computed(sess, summ)
+                        else:
+                            # print('evaluating %r' % feed_dict)
+                            step = sess.run(train_step, feed_dict)
+                    except ValueError as e:
+                        print('Error processing batch, skipping - error was %r' % e)
+                        continue
+                    throughput.add_step(len(images), input_secs, time.time() - run_start, summarized=should_summarize)
+                    log.debug('step %d', step)
+                    if throughput.should_report():
+                        throughput.report(step, sv.summary_writer)
                         sv.summary_writer.flush()
-                    else:
-                        # print('evaluating %r' % feed_dict)
-                        try:
-                            sess.run(train_op, feed_dict)
-                        except ValueError as e:
-                            print('Error processing batch, skipping - error was %r' % e)
-                    step = model.global_step.eval()
-                    log.info('step %d', step)
-
-            step = model.global_step.eval()
-            # Do evaluation
-            losses = []
-            for images, targets in eval_dataset.iterate_once(batch_size):
-                preds = sess.run(eval_model.p, {x: images})
-                losses += [np.square(targets - preds)]
-            losses = np.concatenate(losses)
-            summary = tf.Summary()
-            summary.value.add(tag="eval/loss", simple_value=float(0.5 * losses.sum() / losses.shape[0]))
-            names = ["spin", "direction", "speed", "speed_change", "steering", "throttle"]
-            for i in range(len(names)):
-                summary.value.add(tag="eval/{}".format(names[i]), simple_value=float(0.5 * losses[:, i].mean()))
-            eval_sw.add_summary(summary, step)
-            eval_sw.flush()
+                    checkpointer.maybe_save(sess, step)
+        finally:
+            checkpointer.close()
 
 
 if __name__ == "__main__":
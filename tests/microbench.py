@@ -0,0 +1,259 @@
+"""Micro-benchmarks for hot functions at realistic camera sizes, with per-machine JSON baselines.
+
+    python -m tests.microbench --save before        # Record a baseline
+    python -m tests.microbench --compare before     # Exit with an error if anything got more than 10% slower
+
+Baselines are stored in <DEEPDRIVE_DIR>/microbench. Benchmarks whose dependencies (i.e. tensorflow) aren't
+installed are skipped.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import config as c
+import logs
+import utils
+
+log = logs.get_log(__name__)
+
+BENCHMARKS = OrderedDict()
+DEFAULT_THRESHOLD = 0.1
+HEIGHT = c.DEFAULT_CAM['capture_height']
+WIDTH = c.DEFAULT_CAM['capture_width']
+NUM_FRAMES = 100
+FRAMES_PER_FILE = 25  # Keeps the HDF5 benchmarks to a few seconds
+
+
+def benchmark(fn):
+    """Registers a setup function which returns the function to time"""
+    BENCHMARKS[fn.__name__] = fn
+    return fn
+
+
+def _raw_image(rng):
+    return rng.rand(HEIGHT, WIDTH, 3).astype(np.float32)
+
+
+def _raw_depth(rng):
+    return (rng.rand(HEIGHT, WIDTH) * 10000 + 1).astype(np.float32)
+
+
+def _recorded_frames(rng, num_frames=FRAMES_PER_FILE):
+    """Frames as the agent records them"""
+    frames = []
+    for _ in range(num_frames):
+        camera = dict(name='forward cam', field_of_view=60, capture_width=WIDTH, capture_height=HEIGHT,
+                      image=utils.preprocess_image(_raw_image(rng)),
+                      depth=utils.preprocess_depth(_raw_depth(rng)), image_data=0, depth_data=0)
+        frames.append(dict(cameras=[camera], speed=rng.rand() * 2000, steering=rng.rand() * 2 - 1,
+                           throttle=rng.rand(), brake=0., handbrake=0., is_game_driving=1,
+                           angular_velocity=rng.rand(3), acceleration=rng.rand(3), forward_vector=rng.rand(3)))
+    return frames
+
+
+def _save_frames(rng, directory, name):
+    filename = os.path.join(directory, name + '.hdf5')
+    utils.save_hdf5_thread(_recorded_frames(rng), filename)
+    return filename
+
+
+@benchmark
+def preprocess_image(rng, tmp_dir):
+    image = _raw_image(rng)
+    return lambda: utils.preprocess_image(image)
+
+
+@benchmark
+def preprocess_depth(rng, tmp_dir):
+    depth = _raw_depth(rng)
+    return lambda: utils.preprocess_depth(depth)
+
+
+@benchmark
+def depth_heatmap(rng, tmp_dir):
+    depth = utils.preprocess_depth(_raw_depth(rng))
+    return lambda: utils.depth_heatmap(depth)
+
+
+class _Camera(object):
+    def __init__(self, rng):
+        self.name = 'forward cam'
+        self.field_of_view = 60
+        self.capture_width = WIDTH
+        self.capture_height = HEIGHT
+        self.relative_position = [150, 1, 200]
+        self.relative_rotation = [0, 0, 0]
+        self.image_data = _raw_image(rng).ravel()
+        self.depth_data = _raw_depth(rng).ravel()
+        self.id = 1
+        self.type = 0
+
+
+@benchmark
+def obj2dict(rng, tmp_dir):
+    camera = _Camera(rng)
+    return lambda: utils.obj2dict(camera, exclude=['image', 'depth'])
+
+
+@benchmark
+def obj2dict_lazy(rng, tmp_dir):
+    camera = _Camera(rng)
+    return lambda: utils.obj2dict(camera, exclude=['image', 'depth'], lazy=True)
+
+
+@benchmark
+def save_hdf5(rng, tmp_dir):
+    import h5py  # Skip when it's not installed, rather than failing in the timed function
+    frames = _recorded_frames(rng)
+    filename = os.path.join(tmp_dir, 'save.hdf5')
+
+    def save():
+        # save_hdf5 deletes the data it writes
+        utils.save_hdf5_thread([dict(f, cameras=[dict(cam) for cam in f['cameras']]) for f in frames], filename)
+    return save
+
+
+@benchmark
+def read_hdf5(rng, tmp_dir):
+    filename = _save_frames(rng, tmp_dir, 'read')
+    return lambda: utils.read_hdf5(filename)
+
+
+@benchmark
+def load_file(rng, tmp_dir):
+    from tensorflow_agent.train import data_utils
+    filename = _save_frames(rng, tmp_dir, 'load')
+    return lambda: data_utils.load_file(filename)
+
+
+@benchmark
+def batch_gen(rng, tmp_dir):
+    from tensorflow_agent.train import data_utils
+    filenames = [_save_frames(rng, tmp_dir, 'batch_%d' % i) for i in range(2)]
+    return lambda: list(data_utils.batch_gen(iter(filenames), batch_size=32))
+
+
+@benchmark
+def reward_scalar(rng, tmp_dir):
+    from gym_deepdrive.envs.deepdrive_gym_env import DeepDriveRewardCalculator as Rewards
+    lane_deviation = rng.rand(NUM_FRAMES) * 500
+    gforces = rng.rand(NUM_FRAMES) * 2
+    progress = rng.rand(NUM_FRAMES) * 300
+
+    def rewards():
+        for i in range(NUM_FRAMES):
+            Rewards.get_lane_deviation_penalty(lane_deviation[i], 0.125)
+            Rewards.get_gforce_penalty(gforces[i], 0.125)
+            Rewards.get_progress_reward(progress[i], 0.125)
+    return rewards
+
+
+@benchmark
+def reward_vectorized(rng, tmp_dir):
+    from gym_deepdrive.envs.deepdrive_gym_env import DeepDriveRewardCalculator as Rewards
+    lane_deviation = rng.rand(NUM_FRAMES) * 500
+    gforces = rng.rand(NUM_FRAMES) * 2
+    progress = rng.rand(NUM_FRAMES) * 300
+    time_passed = np.full(NUM_FRAMES, 0.125)
+
+    def rewards():
+        Rewards.get_lane_deviation_penalties(lane_deviation, time_passed)
+        Rewards.get_gforce_penalties(gforces, time_passed)
+        Rewards.get_progress_rewards(progress, time_passed)
+    return rewards
+
+
+def time_fn(fn, min_time=0.2, repeat=5):
+    """Seconds per call. Calls are batched so each of the repeats takes at least min_time / repeat."""
+    fn()  # Warm up
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / repeat:
+            break
+        number *= 2
+    times = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+    return dict(min=min(times), median=float(np.median(times)), number=number, repeat=repeat)
+
+
+def run(names=None, min_time=0.2, repeat=5):
+    """Returns {benchmark name: timings}, with None for benchmarks that couldn't be run here"""
+    results = OrderedDict()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for name, setup in BENCHMARKS.items():
+            if names and name not in names:
+                continue
+            try:
+                fn = setup(np.random.RandomState(c.RNG_SEED), tmp_dir)
+            except ImportError as e:
+                log.info('%s skipped - %s', name, e)
+                results[name] = None
+                continue
+            results[name] = time_fn(fn, min_time, repeat)
+            log.info('%s %.3fms', name, results[name]['min'] * 1000)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Returns a list of (name, baseline secs, current secs, ratio) for benchmarks that got more than threshold
+    slower, comparing the fastest repeat"""
+    regressions = []
+    for name, result in results.items():
+        if result is None or baseline.get(name) is None:
+            continue
+        before = baseline[name]['min']
+        ratio = result['min'] / before
+        if ratio > 1 + threshold:
+            regressions.append((name, before, result['min'], ratio))
+    return regressions
+
+
+def get_baseline_filename(name):
+    return os.path.join(c.MICROBENCH_DIR, name + '.json')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks for hot functions')
+    parser.add_argument('--save', default=None, help='Save results as a baseline with this name')
+    parser.add_argument('--compare', default=None, help='Compare results against the baseline with this name')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Relative slowdown that counts as a regression')
+    parser.add_argument('--min-time', type=float, default=0.2, help='Seconds to spend timing each benchmark')
+    parser.add_argument('names', nargs='*', help='Benchmarks to run, defaults to all of %s' % list(BENCHMARKS))
+    args = parser.parse_args()
+    results = run(args.names, min_time=args.min_time)
+    if args.save:
+        os.makedirs(c.MICROBENCH_DIR, exist_ok=True)
+        utils.write_json_atomic(results, get_baseline_filename(args.save))
+        log.info('Saved baseline to %s', get_baseline_filename(args.save))
+    if args.compare:
+        baseline = utils.read_json(get_baseline_filename(args.compare))
+        if baseline is None:
+            raise RuntimeError('No baseline named %s in %s' % (args.compare, c.MICROBENCH_DIR))
+        regressions = compare(results, baseline, args.threshold)
+        for name, before, after, ratio in regressions:
+            log.error('%s regressed %.0f%%: %.3fms -> %.3fms', name, (ratio - 1) * 100, before * 1000, after * 1000)
+        if regressions:
+            sys.exit(1)
+        log.info('No regressions over %.0f%% compared to %s', args.threshold * 100, args.compare)
+
+
+if __name__ == '__main__':
+    main()
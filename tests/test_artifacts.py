@@ -0,0 +1,193 @@
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+os.environ['DEEPDRIVE_DIR'] = os.path.join(tempfile.gettempdir(), 'testdeepdrive')
+
+pytest.importorskip('requests')
+pytest.importorskip('clint')
+
+import artifacts
+from utils import write_json_atomic
+
+
+def _make_zip():
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as z:
+        z.writestr('sim/', '')
+        for i in range(10):
+            z.writestr('sim/file_%d.bin' % i, os.urandom(50000))
+    return buf.getvalue()
+
+
+def _etag(content):
+    return '"%s"' % hashlib.md5(content).hexdigest()
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    """Serves the server's content, honoring single byte range and If-Range requests like S3"""
+    def do_GET(self):
+        content = self.server.content
+        self.server.requests.append(self.headers.get('Range'))
+        self.server.if_ranges.append(self.headers.get('If-Range'))
+        start = 0
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        is_current = if_range is None or if_range == _etag(content) or not self.server.support_if_range
+        if range_header and self.server.support_range and is_current:
+            start = int(range_header[len('bytes='):].rstrip('-'))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(content) - 1, len(content)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(content) - start))
+        self.send_header('ETag', _etag(content))
+        self.end_headers()
+        self.wfile.write(content[start:])
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.server.content)))
+        self.send_header('ETag', _etag(self.server.content))
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def server():
+    httpd = HTTPServer(('127.0.0.1', 0), _RangeHandler)
+    httpd.content = _make_zip()
+    httpd.requests = []
+    httpd.if_ranges = []
+    httpd.support_range = True
+    httpd.support_if_range = True
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _url(httpd):
+    return 'http://127.0.0.1:%d/sim.zip' % httpd.server_address[1]
+
+
+def test_fetch_caches_by_checksum(server):
+    cache = artifacts.ArtifactCache(tempfile.mkdtemp(), chunk_size=4096)
+    sha256 = hashlib.sha256(server.content).hexdigest()
+    path = cache.fetch(_url(server), sha256=sha256)
+    assert os.path.basename(path) == sha256
+    assert cache.fetch(_url(server)) == path
+    assert len(server.requests) == 1
+
+
+def _write_partial(cache, url, content, etag):
+    os.makedirs(cache.partial_dir)
+    part_filename = os.path.join(cache.partial_dir, hashlib.sha256(url.encode('utf-8')).hexdigest() + '.part')
+    with open(part_filename, 'wb') as f:
+        f.write(content)
+    write_json_atomic(dict(etag=etag), part_filename + '.etag.json')
+    return part_filename
+
+
+def test_fetch_resumes_partial_download(server):
+    cache = artifacts.ArtifactCache(tempfile.mkdtemp(), chunk_size=4096)
+    url = _url(server)
+    part_filename = _write_partial(cache, url, server.content[:12345], _etag(server.content))
+    path = cache.fetch(url)
+    assert server.requests == ['bytes=12345-']
+    assert server.if_ranges == [_etag(server.content)]
+    with open(path, 'rb') as f:
+        assert f.read() == server.content
+    assert os.listdir(cache.partial_dir) == []
+
+
+def test_fetch_restarts_when_range_unsupported(server):
+    server.support_range = False
+    cache = artifacts.ArtifactCache(tempfile.mkdtemp(), chunk_size=4096)
+    url = _url(server)
+    _write_partial(cache, url, b'stale', _etag(server.content))
+    with open(cache.fetch(url), 'rb') as f:
+        assert f.read() == server.content
+
+
+@pytest.mark.parametrize('support_if_range', [True, False])
+def test_fetch_restarts_when_changed_since_partial_download(server, support_if_range):
+    server.support_if_range = support_if_range
+    old_content = server.content
+    server.content = _make_zip()
+    cache = artifacts.ArtifactCache(tempfile.mkdtemp(), chunk_size=4096)
+    url = _url(server)
+    _write_partial(cache, url, old_content[:12345], _etag(old_content))
+    with open(cache.fetch(url), 'rb') as f:
+        assert f.read() == server.content
+
+
+def test_fetch_restarts_partial_download_without_etag(server):
+    cache = artifacts.ArtifactCache(tempfile.mkdtemp(), chunk_size=4096)
+    url = _url(server)
+    _write_partial(cache, url, b'stale', None)
+    with open(cache.fetch(url), 'rb') as f:
+        assert f.read() == server.content
+    assert server.requests == [None]
+
+
+def test_fetch_checksum_mismatch(server):
+    cache = artifacts.ArtifactCache(tempfile.mkdtemp())
+    with pytest.raises(RuntimeError):
+        cache.fetch(_url(server), sha256='0' * 64)
+    assert cache.lookup(_url(server)) is None
+
+
+def test_extract(server):
+    cache = artifacts.ArtifactCache(tempfile.mkdtemp())
+    directory = tempfile.mkdtemp()
+    artifacts.extract(cache.fetch(_url(server)), directory, num_workers=3)
+    with zipfile.ZipFile(io.BytesIO(server.content)) as z:
+        for name in z.namelist():
+            if not name.endswith('/'):
+                with open(os.path.join(directory, name), 'rb') as f:
+                    assert f.read() == z.read(name)
+
+
+def test_manifest_cached_until_stale():
+    cache = artifacts.ArtifactCache(tempfile.mkdtemp())
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return ['sim/deepdrive-sim-linux-2.0.20180101.zip']
+
+    assert cache.get_manifest('sims', fetch) == fetch()
+    cache.get_manifest('sims', fetch)
+    assert len(calls) == 2  # Including the one in the assert
+
+    def fail():
+        raise IOError('offline')
+
+    assert cache.get_manifest('sims', fail, max_age_secs=0) == fetch()
+
+
+def test_fetch_revalidates_etag_and_evicts(server):
+    cache = artifacts.ArtifactCache(tempfile.mkdtemp())
+    url = _url(server)
+    old_path = cache.fetch(url)
+    assert cache.fetch(url) == old_path
+    assert len(server.requests) == 1
+    server.content = _make_zip()  # Updated on the server, so the ETag changes
+    new_path = cache.fetch(url)
+    assert new_path != old_path and len(server.requests) == 2
+    with open(new_path, 'rb') as f:
+        assert f.read() == server.content
+    cache.evict(url)
+    assert cache.lookup(url) is None and not os.path.exists(new_path)
+    cache.evict(url)  # No-op
@@ -0,0 +1,56 @@
+import os
+import tempfile
+
+import pytest
+
+os.environ['DEEPDRIVE_DIR'] = os.path.join(tempfile.gettempdir(), 'testdeepdrive')
+
+tf = pytest.importorskip('tensorflow')
+
+from tensorflow_agent.train import autotune
+
+
+def test_pick_batch_size():
+    results = [dict(batch_size=16, feasible=True, frames_per_sec=100.),
+               dict(batch_size=32, feasible=True, frames_per_sec=190.),
+               dict(batch_size=64, feasible=True, frames_per_sec=198.),
+               dict(batch_size=128, feasible=False)]
+    assert autotune.pick_batch_size(results) == 32  # 64 isn't clearly faster
+    assert autotune.pick_batch_size(results, min_gain=0) == 64
+    with pytest.raises(RuntimeError):
+        autotune.pick_batch_size([dict(batch_size=16, feasible=False)])
+    with pytest.raises(ValueError):
+        autotune.pick_batch_size([])
+
+
+def test_candidate_batch_sizes():
+    assert autotune.get_candidate_batch_sizes(1) == autotune.CANDIDATE_BATCH_SIZES
+    assert autotune.get_candidate_batch_sizes(2) == autotune.CANDIDATE_BATCH_SIZES
+    assert autotune.get_candidate_batch_sizes(3) == [18, 33, 66, 129, 258]
+    assert autotune.get_candidate_batch_sizes(7) == [21, 35, 70, 133, 259]
+    assert autotune.get_candidate_batch_sizes(32, [16, 32]) == [32]
+
+
+def test_pick_queue_size():
+    # Loading a file takes 3x as long as training on it
+    assert autotune.pick_queue_size(load_secs=3., file_bytes=1e8, frames_per_file=1000, frames_per_sec=1000) == 4
+    # Capped by memory
+    assert autotune.pick_queue_size(load_secs=3., file_bytes=1e8, frames_per_file=1000, frames_per_sec=1000,
+                                    memory_bytes=4e8) == 2
+    assert autotune.pick_queue_size(load_secs=0., file_bytes=1e10, frames_per_file=1000, frames_per_sec=1000,
+                                    memory_bytes=1e9) == 1
+
+
+def test_measure_batch_sizes():
+    x = tf.placeholder(tf.uint8, (None, 227, 227, 3))
+    y = tf.placeholder(tf.float32, (None, 6))
+    w = tf.get_variable('w', [6], initializer=tf.zeros_initializer)
+    loss = tf.reduce_mean(tf.square(tf.reduce_mean(tf.to_float(x)) * w - y))
+    grads_op = tf.group(*tf.gradients(loss, [w]))
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        results = autotune.measure_batch_sizes(sess, x, y, grads_op, num_devices=1, candidates=[2, 4], steps=1,
+                                               warmup=0)
+        assert sess.run(w).tolist() == [0] * 6
+    assert [r['batch_size'] for r in results] == [2, 4]
+    assert all(r['feasible'] and r['frames_per_sec'] > 0 for r in results)
@@ -0,0 +1,119 @@
+import csv
+import json
+import os
+import tempfile
+
+import numpy as np
+import pytest
+
+os.environ['DEEPDRIVE_DIR'] = os.path.join(tempfile.gettempdir(), 'testdeepdrive')
+
+from benchmark import BenchmarkWriter, RunningStats
+
+
+class _Score(object):
+    def __init__(self, total):
+        self.total = total
+        self.progress_reward = total
+        self.lane_deviation_penalty = 0
+        self.gforce_penalty = 0
+        self.got_stuck = False
+        self.start_time = 0
+        self.end_time = 10
+        self.episode_time = 10
+
+
+def test_running_stats():
+    rng = np.random.RandomState(0)
+    scores = rng.normal(1000, 200, 500)
+    stats = RunningStats()
+    for i, score in enumerate(scores):
+        stats.add(score)
+        if i < 5:
+            assert stats.median == pytest.approx(np.median(scores[:i + 1]))
+    assert stats.count == len(scores)
+    assert stats.mean == pytest.approx(np.mean(scores))
+    assert stats.std == pytest.approx(np.std(scores))
+    assert stats.sample_variance == pytest.approx(np.var(scores, ddof=1))
+    assert stats.min == np.min(scores)
+    assert stats.max == np.max(scores)
+    assert stats.median == pytest.approx(np.median(scores), rel=0.02)
+
+
+def test_benchmark_writer_appends():
+    benchmark_dir = tempfile.mkdtemp()
+    writer = BenchmarkWriter('test', benchmark_dir=benchmark_dir)
+    for total in [10., 20., 30.]:
+        writer.add_lap(_Score(total))
+    with open(writer.csv_filename) as f:
+        rows = list(csv.reader(f))
+    assert len(rows) == 4
+    assert [float(r[1]) for r in rows[1:]] == [10., 20., 30.]
+    with open(writer.summary_filename) as f:
+        summary = json.load(f)
+    assert summary['count'] == 3
+    assert summary['mean'] == pytest.approx(20.)
+    assert summary['median'] == pytest.approx(20.)
+
+
+def test_t_quantile():
+    from benchmark import normal_quantile, t_quantile
+    assert normal_quantile(0.975) == pytest.approx(1.959964, abs=1e-5)
+    assert t_quantile(0.975, 9) == pytest.approx(2.262157, abs=2e-3)
+    assert t_quantile(0.975, 30) == pytest.approx(2.042272, abs=1e-4)
+    assert t_quantile(0.995, 4) == pytest.approx(4.604095, abs=5e-2)
+
+
+def test_early_stopping():
+    from benchmark import EarlyStopping
+    rng = np.random.RandomState(0)
+
+    def laps_until_stop(stopping, mean, std):
+        stats = RunningStats()
+        while True:
+            stats.add(rng.normal(mean, std))
+            reason = stopping.check(stats)
+            if reason is not None:
+                return stats.count, reason
+
+    count, reason = laps_until_stop(EarlyStopping(max_laps=50), 1000, 200)
+    assert count == 50 and 'reached' in reason
+    count, reason = laps_until_stop(EarlyStopping(max_laps=1000, ci_half_width=50), 1000, 100)
+    assert 10 <= count < 50 and 'interval' in reason
+    reference = dict(count=50, mean=1000., sample_variance=100. ** 2)
+    count, reason = laps_until_stop(EarlyStopping(max_laps=1000, reference=reference), 1300, 100)
+    assert count < 20 and reason.startswith('better')
+    count, reason = laps_until_stop(EarlyStopping(max_laps=30, reference=reference), 1000, 100)
+    assert count == 30 and 'reached' in reason
+
+
+def test_collect_laps_merges_workers():
+    from queue import Queue
+    from threading import Event
+    from benchmark import EarlyStopping, to_lap
+    from benchmark_runner import LapQueueWriter, collect_laps
+
+    class _Worker(object):
+        def is_alive(self):
+            return False
+
+    benchmark_dir = tempfile.mkdtemp()
+    writer = BenchmarkWriter('parallel', benchmark_dir=benchmark_dir, stopping=EarlyStopping(max_laps=4))
+    lap_queue = Queue()
+    stop_event = Event()
+    worker_writers = [LapQueueWriter(lap_queue, stop_event, i, writer.csv_filename) for i in range(2)]
+    for total in [10., 20., 30.]:
+        for worker_writer in worker_writers:
+            worker_writer.add_lap(_Score(total))
+    for i in range(2):
+        lap_queue.put((i, None))
+    collect_laps(writer, lap_queue, stop_event, [_Worker(), _Worker()])
+    assert stop_event.is_set() and all(w.is_done() for w in worker_writers)
+    assert writer.stop_reason == 'reached 4 laps'
+    with open(writer.csv_filename) as f:
+        rows = list(csv.reader(f))
+    assert [float(r[1]) for r in rows[1:]] == [10., 10., 20., 20.]
+    with open(writer.summary_filename) as f:
+        summary = json.load(f)
+    assert summary['count'] == 4 and summary['stop_reason'] == 'reached 4 laps'
+    assert to_lap(_Score(5.)).total == 5.
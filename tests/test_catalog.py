@@ -0,0 +1,83 @@
+import os
+import tempfile
+
+import numpy as np
+import pytest
+
+os.environ['DEEPDRIVE_DIR'] = os.path.join(tempfile.gettempdir(), 'testdeepdrive')
+os.environ['DEEPDRIVE_NO_THREAD_SAVE'] = '1'
+
+pytest.importorskip('h5py')
+
+import utils
+from catalog import Catalog, CATALOG_FILENAME, get_split_files
+
+
+def _frames(steerings):
+    frames = []
+    for steering in steerings:
+        camera = dict(name='forward cam', field_of_view=60, capture_width=4, capture_height=2,
+                      image=np.zeros((2, 4, 3), dtype=np.uint8), depth=np.zeros((2, 4), dtype=np.float32),
+                      image_data=0, depth_data=0)
+        frames.append(dict(cameras=[camera], speed=1000., steering=steering, throttle=1., is_game_driving=1,
+                           angular_velocity=np.array([0., 0., steering * 2])))
+    return frames
+
+
+def _record(recording_dir, session, index, steerings, catalog=True):
+    filename = os.path.join(recording_dir, session, '%s.hdf5' % str(index).zfill(10))
+    utils.save_hdf5(_frames(steerings), filename, catalog_dir=recording_dir if catalog else None)
+    return filename
+
+
+def test_catalog_incremental_and_rebuild():
+    recording_dir = tempfile.mkdtemp()
+    _record(recording_dir, 'session_a', 1, [0., 0., 0.5])
+    _record(recording_dir, 'session_b', 1, [-0.5, 0.])
+    catalog = Catalog(recording_dir)
+    assert catalog.count_frames() == 5
+    assert catalog.update() == 0  # Already cataloged by the recorder
+    sessions = catalog.get_sessions()
+    assert sessions['session_a']['num_frames'] == 3
+    assert sessions['session_a']['camera_configs'] == [[dict(name='forward cam', field_of_view=60, capture_width=4,
+                                                             capture_height=2)]]
+    assert [r['spin'] for r in catalog.query('steering < ?', (0,))] == [-1.]
+
+    # Files recorded without the catalog are picked up by update and deleted ones dropped
+    _record(recording_dir, 'session_c', 1, [0.9], catalog=False)
+    os.remove(os.path.join(recording_dir, 'session_b', '0000000001.hdf5'))
+    assert catalog.update(num_workers=2) == 1
+    assert catalog.count_frames() == 4
+    assert catalog.update(num_workers=2, rebuild=True) == 2
+    assert catalog.count_frames() == 4
+    catalog.close()
+
+
+def test_split_and_read_only_catalog():
+    import glob
+    import sqlite3
+    recording_dir = tempfile.mkdtemp()
+    for session in ['session_b', 'session_a', 'session_c']:
+        _record(recording_dir, session, 1, [0.])
+    # The split follows glob's listing order, whether or not the recordings are cataloged
+    files = glob.glob(recording_dir + '/**/*.hdf5', recursive=True)
+    assert get_split_files(recording_dir, train=False) == files[0:1]
+    assert get_split_files(recording_dir, train=True) == files[1:]
+    catalog_filename = os.path.join(recording_dir, CATALOG_FILENAME)
+    mtime = os.stat(catalog_filename).st_mtime
+    catalog = Catalog(recording_dir, read_only=True)
+    assert catalog.count_frames() == 3
+    with pytest.raises(sqlite3.OperationalError):
+        catalog.remove_file(catalog.get_rel_path(files[0]))
+    catalog.close()
+    assert os.stat(catalog_filename).st_mtime == mtime
+
+
+def test_select_balanced():
+    recording_dir = tempfile.mkdtemp()
+    _record(recording_dir, 'session', 1, [0.] * 20 + [0.5] * 3 + [-0.5] * 4)
+    catalog = Catalog(recording_dir)
+    selected = catalog.select_balanced(bins=4)
+    steering = sorted(r['steering'] for r in selected)
+    assert steering == [-0.5] * 3 + [0.] * 3 + [0.5] * 3
+    catalog.close()
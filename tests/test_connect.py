@@ -0,0 +1,148 @@
+import os
+import tempfile
+import time
+
+import pytest
+
+os.environ['DEEPDRIVE_DIR'] = os.path.join(tempfile.gettempdir(), 'testdeepdrive')
+
+pytest.importorskip('gym')
+
+import config as c
+from benchmark import BenchmarkWriter, Lap
+from gym_deepdrive.envs import deepdrive_gym_env
+
+
+class _FakeClient(object):
+    """Stands in for the deepdrive_client extension. The RPC server comes up after not_ready_calls attempts."""
+    class time_out(Exception):
+        pass
+
+    def __init__(self, not_ready_calls):
+        self.not_ready_calls = not_ready_calls
+        self.create_calls = 0
+
+    def create(self, host, port):
+        self.create_calls += 1
+        if self.create_calls <= self.not_ready_calls:
+            raise self.time_out()
+        return dict(client_id=1, max_capture_resolution=[1920, 1080], server_protocol_version='2.0.0')
+
+    def register_camera(self, *args):
+        return 1
+
+    def get_shared_memory(self, client_id):
+        return 'deepdrive_shared_mem', 1024
+
+    def release_agent_control(self, client_id):
+        pass
+
+    def set_control_values(self, client_id, **controls):
+        pass
+
+    def close(self, client_id):
+        pass
+
+
+class _FakeCapture(object):
+    """Stands in for the deepdrive_capture extension, producing a frame after frames_until_ready steps"""
+    def __init__(self, frames_until_ready):
+        self.frames_until_ready = frames_until_ready
+        self.stalled = False
+
+    def reset(self, name, size):
+        return True
+
+    def step(self):
+        if self.stalled:
+            return None
+        self.frames_until_ready -= 1
+        return None if self.frames_until_ready > 0 else {'cameras': []}
+
+    def close(self):
+        pass
+
+
+class _FakeSimProcess(object):
+    """A sim that has exited, restarting it un-stalls capture"""
+    returncode = 1
+
+    def __init__(self, capture):
+        self.capture = capture
+
+    def poll(self):
+        return self.returncode
+
+    def kill(self):
+        self.capture.stalled = False
+
+    def wait(self):
+        pass
+
+
+@pytest.fixture()
+def env(monkeypatch):
+    monkeypatch.setattr(c, 'REUSE_OPEN_SIM', True)
+    monkeypatch.setattr(deepdrive_gym_env, 'get_client_version', lambda: '2.0.1')
+    monkeypatch.setattr(deepdrive_gym_env, 'deepdrive_client', _FakeClient(not_ready_calls=0))
+    monkeypatch.setattr(deepdrive_gym_env, 'deepdrive_capture', _FakeCapture(frames_until_ready=1))
+    env = deepdrive_gym_env.DeepDriveEnv()
+    yield env
+    env.close()
+
+
+def test_attach_polls_until_ready(env, monkeypatch):
+    client = _FakeClient(not_ready_calls=3)
+    monkeypatch.setattr(deepdrive_gym_env, 'deepdrive_client', client)
+    monkeypatch.setattr(deepdrive_gym_env, 'deepdrive_capture', _FakeCapture(frames_until_ready=3))
+    env.connect()
+    assert client.create_calls == 4
+    assert list(env.startup_timings) == ['rpc', 'shared_mem', 'first_frame']
+    assert sum(env.startup_timings.values()) < 1  # Short polling intervals, no multi-second sleeps
+    assert env.has_control is False
+
+
+def test_attach_deadline(env, monkeypatch):
+    monkeypatch.setattr(c, 'SIM_CONNECT_TIMEOUT', 0.2)
+    monkeypatch.setattr(deepdrive_gym_env, 'deepdrive_client', _FakeClient(not_ready_calls=10 ** 6))
+    monkeypatch.setattr(deepdrive_gym_env, 'deepdrive_capture', _FakeCapture(frames_until_ready=1))
+    with pytest.raises(RuntimeError):
+        env.connect()
+
+
+def test_watchdog_restarts_dead_sim(env, monkeypatch):
+    capture = _FakeCapture(frames_until_ready=1)
+    monkeypatch.setattr(deepdrive_gym_env, 'deepdrive_client', _FakeClient(not_ready_calls=0))
+    monkeypatch.setattr(deepdrive_gym_env, 'deepdrive_capture', capture)
+    env.connect()
+    benchmark_writer = BenchmarkWriter(benchmark_dir=tempfile.mkdtemp())
+    env.init_benchmarking(benchmark_writer)
+    for total in [10., 20.]:
+        benchmark_writer.add_lap(Lap(total, total, 0., 0., False, time.time() - 60, time.time(), 60.))
+    capture.stalled = True
+    env.sim_process = _FakeSimProcess(capture)
+    obz, reward, done, info = env.step(deepdrive_gym_env.gym_action(has_control=False))
+    assert done and info['sim_restarted']
+    assert env.sim_restarts == 1
+    assert env.benchmark_writer is benchmark_writer
+    assert benchmark_writer.stats.count == 2 and benchmark_writer.stats.mean == 15.
+
+
+def test_watchdog_does_not_restart_sims_it_did_not_start(env, monkeypatch):
+    capture = _FakeCapture(frames_until_ready=1)
+    monkeypatch.setattr(deepdrive_gym_env, 'deepdrive_capture', capture)
+    env.connect()
+    assert env.sim_process is None  # Reused an open sim
+    with pytest.raises(RuntimeError, match='not started by this process'):
+        env.restart_sim('no frames for 10s')
+    assert env.sim_restarts == 0
+
+
+def test_watchdog_detects_stall(env, monkeypatch):
+    monkeypatch.setattr(c, 'SIM_STALL_PERIODS', 10)
+    env.period = 0.01
+    env.last_frame_time = time.time()
+    assert env.check_sim_health({'cameras': []}) is None
+    assert env.check_sim_health(None) is None
+    env.last_frame_time -= 1
+    assert 'no frames' in env.check_sim_health(None)
@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pytest
+
+os.environ['DEEPDRIVE_DIR'] = os.path.join(tempfile.gettempdir(), 'testdeepdrive')
+
+pytest.importorskip('h5py')
+
+import utils
+import export_recordings
+
+
+def _record(recording_dir, num_files=2, num_frames=3, size=(31, 27)):
+    rng = np.random.RandomState(0)
+    for session in ['2018-01-01__01-01-01AM', '2018-01-02__01-01-01AM']:
+        for i in range(num_files):
+            frames = [dict(cameras=[dict(image=rng.randint(0, 256, size + (3,)).astype(np.uint8),
+                                         depth=rng.rand(*size), image_data=0, depth_data=0)])
+                      for _ in range(num_frames)]
+            utils.save_hdf5_thread(frames, os.path.join(recording_dir, session, '%s.hdf5' % str(i).zfill(10)))
+
+
+def test_iter_cameras_streams_and_skips():
+    recording_dir = tempfile.mkdtemp()
+    _record(recording_dir)
+    sessions = export_recordings.get_sessions(recording_dir)
+    assert list(sessions) == ['2018-01-01__01-01-01AM', '2018-01-02__01-01-01AM']
+    filename = sessions['2018-01-01__01-01-01AM'][0]
+    expected = utils.read_hdf5(filename)
+    cameras = list(export_recordings.iter_cameras(filename))
+    assert [(i, j) for i, j, _ in cameras] == [(0, 0), (1, 0), (2, 0)]
+    for (_, _, rgbs), frame in zip(cameras, expected):
+        assert np.array_equal(rgbs['image'], frame['cameras'][0]['image'])
+        assert np.array_equal(rgbs['depth'], utils.depth_heatmap(frame['cameras'][0]['depth']))
+    skipped = list(export_recordings.iter_cameras(filename, ['depth'], skip=lambda i, j: i != 1))
+    assert len(skipped) == 1 and skipped[0][0] == 1 and list(skipped[0][2]) == ['depth']
+
+
+def test_export_pngs_skips_exported_frames():
+    pytest.importorskip('PIL')
+    recording_dir = tempfile.mkdtemp()
+    out_dir = tempfile.mkdtemp()
+    _record(recording_dir)
+    results = export_recordings.export(recording_dir, out_dir, num_workers=2)
+    assert sorted(count for _, count in results) == [6] * 4
+    session_dir = os.path.join(out_dir, '2018-01-01__01-01-01AM')
+    assert len(os.listdir(session_dir)) == 12
+    os.remove(os.path.join(session_dir, 'z_0000000001_00002_00.png'))
+    results = export_recordings.export(recording_dir, out_dir, num_workers=2)
+    assert sorted(count for _, count in results) == [0, 0, 0, 2]
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg not installed')
+def test_export_videos_per_session():
+    recording_dir = tempfile.mkdtemp()
+    out_dir = tempfile.mkdtemp()
+    _record(recording_dir)
+    results = export_recordings.export(recording_dir, out_dir, video=True, num_workers=2)
+    assert all(len(paths) == 2 for _, paths in results)
+    assert all(os.path.getsize(path) > 0 for _, paths in results for path in paths)
+    results = export_recordings.export(recording_dir, out_dir, video=True, num_workers=2)
+    assert all(paths == [] for _, paths in results)
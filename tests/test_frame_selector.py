@@ -0,0 +1,36 @@
+import os
+import random
+import tempfile
+
+import numpy as np
+
+os.environ['DEEPDRIVE_DIR'] = os.path.join(tempfile.gettempdir(), 'testdeepdrive')
+
+from tensorflow_agent.frame_selector import FrameSelector
+
+
+def _obz(image, steering=0., spin=0.):
+    return {'cameras': [{'image': image}], 'steering': steering, 'angular_velocity': [0., 0., spin]}
+
+
+def _image(value):
+    return np.full((64, 64, 3), value, dtype=np.uint8)
+
+
+def test_skips_near_duplicates():
+    selector = FrameSelector(straight_keep_prob=1.)
+    assert selector.select(_obz(_image(100))) == 1.
+    assert selector.select(_obz(_image(101))) is None
+    assert selector.select(_obz(_image(140))) == 1.
+    assert selector.select(_obz(_image(140)), recovering=True) == 1.
+    assert selector.skipped_duplicate == 1
+
+
+def test_samples_straights_sparsely():
+    selector = FrameSelector(min_diff=0, straight_keep_prob=0.25, rng=random.Random(0))
+    straight = [selector.select(_obz(_image(i % 255))) for i in range(2000)]
+    kept = [w for w in straight if w is not None]
+    assert 0.2 < len(kept) / len(straight) < 0.3
+    assert all(w == 4. for w in kept)
+    assert selector.select(_obz(_image(0), steering=0.5)) == 1.
+    assert selector.select(_obz(_image(0), spin=-2.)) == 1.
@@ -0,0 +1,50 @@
+import os
+import tempfile
+
+import numpy as np
+import pytest
+
+os.environ['DEEPDRIVE_DIR'] = os.path.join(tempfile.gettempdir(), 'testdeepdrive')
+
+pytest.importorskip('gym')
+
+from gym_deepdrive.envs.history import ObservationHistory, RingHistory
+
+
+def test_ring_history_views_last_k():
+    history = RingHistory(3, (2,), np.int64, capacity=6)
+    buffer = history.buffer
+    assert len(history.last()) == 0
+    for i in range(20):
+        history.push([i, -i])
+        expected = list(range(max(0, i - 2), i + 1))
+        assert history.last()[:, 0].tolist() == expected
+        assert np.shares_memory(history.last(), buffer)
+    assert history.last(2)[:, 0].tolist() == [18, 19]
+    assert history.buffer is buffer
+    history.clear()
+    assert len(history.last()) == 0
+    with pytest.raises(ValueError):
+        RingHistory(3, (), np.float32, capacity=5)
+
+
+def test_observation_history():
+    history = ObservationHistory(4)
+
+    def obz(i, size=8):
+        return {'cameras': [{'image': np.full((size, size, 3), i, dtype=np.uint8)}], 'speed': float(i),
+                'angular_velocity': np.array([0., 0., i])}
+
+    for i in range(10):
+        history.push(obz(i))
+    frames = history.get_frames()
+    assert frames.shape == (4, 8, 8, 3) and frames.dtype == np.uint8
+    assert frames[:, 0, 0, 0].tolist() == [6, 7, 8, 9]
+    assert history.get_telemetry('speed').tolist() == [6., 7., 8., 9.]
+    assert history.get_telemetry('angular_velocity')[:, 2].tolist() == [6., 7., 8., 9.]
+
+    # Camera size changed, i.e. after change_viewpoint
+    history.push(obz(10, size=4))
+    assert history.get_frames().shape == (1, 4, 4, 3)
+    history.clear()
+    assert len(history.get_frames()) == 0
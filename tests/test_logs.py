@@ -0,0 +1,82 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+
+os.environ['DEEPDRIVE_DIR'] = os.path.join(tempfile.gettempdir(), 'testdeepdrive')
+
+import logs
+
+
+def test_get_log_does_not_duplicate_handlers():
+    log = logs.get_log('test_logs_dup')
+    logs.get_log('test_logs_dup')
+    assert len(log.handlers) == 1
+    assert logs.all_loggers.count(log) == 1
+
+
+def test_set_level_updates_debug_flag():
+    try:
+        logs.set_level(logging.DEBUG)
+        assert logs.DEBUG_ENABLED
+        logs.set_level(logging.INFO)
+        assert not logs.DEBUG_ENABLED
+    finally:
+        logs.set_level(logging.INFO)
+
+
+def test_json_sink():
+    filename = os.path.join(tempfile.mkdtemp(), 'log.jsonl')
+    handler = logs.AsyncHandler([])
+    sink = logs.LazyRotatingFileHandler(filename)
+    sink.setFormatter(logs.JsonFormatter())
+    handler.add_sink(sink)
+    log = logging.getLogger('test_logs_json')
+    log.propagate = False
+    log.setLevel(logging.INFO)
+    log.addHandler(handler)
+    log.warning('lap %d', 3, extra={'score': 1.5})
+    handler.stop()  # Flushes the queue
+    with open(filename) as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == 1
+    assert records[0]['message'] == 'lap 3'
+    assert records[0]['level'] == 'WARNING'
+    assert records[0]['score'] == 1.5
+
+
+def test_async_handler_formats_on_listener_thread():
+    format_threads = []
+
+    class _Formatter(logging.Formatter):
+        def format(self, record):
+            format_threads.append(threading.current_thread())
+            return logging.Formatter.format(self, record)
+
+    class _Sink(logging.Handler):
+        def __init__(self):
+            logging.Handler.__init__(self)
+            self.lines = []
+
+        def emit(self, record):
+            self.lines.append(self.format(record))
+
+    sink = _Sink()
+    sink.setFormatter(_Formatter())
+    handler = logs.AsyncHandler([sink])
+    log = logging.getLogger('test_logs_async')
+    log.propagate = False
+    log.setLevel(logging.INFO)
+    log.addHandler(handler)
+    scores = [1]
+    log.info('scores %r', scores)
+    scores.append(2)  # Logged objects are snapshotted when logging
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        log.exception('failed')
+    handler.stop()
+    assert sink.lines[0] == 'scores [1]'
+    assert sink.lines[1].startswith('failed') and 'ValueError: boom' in sink.lines[1]
+    assert format_threads and threading.current_thread() not in format_threads
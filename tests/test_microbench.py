@@ -0,0 +1,20 @@
+import os
+import tempfile
+
+os.environ['DEEPDRIVE_DIR'] = os.path.join(tempfile.gettempdir(), 'testdeepdrive')
+
+from tests import microbench
+
+
+def test_microbench_runs():
+    results = microbench.run(['preprocess_image', 'obj2dict_lazy', 'load_file'], min_time=0.01, repeat=2)
+    assert results['preprocess_image']['min'] > 0
+    assert results['obj2dict_lazy']['number'] >= 1
+    assert 'load_file' in results  # None when tensorflow isn't installed
+
+
+def test_microbench_compare():
+    baseline = {'a': dict(min=1.), 'b': dict(min=1.), 'c': dict(min=1.)}
+    results = {'a': dict(min=1.05), 'b': dict(min=1.5), 'c': None, 'd': dict(min=9.)}
+    regressions = microbench.compare(results, baseline, threshold=0.1)
+    assert [r[0] for r in regressions] == ['b']
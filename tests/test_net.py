@@ -0,0 +1,120 @@
+import os
+import tempfile
+
+import numpy as np
+import pytest
+
+os.environ['DEEPDRIVE_DIR'] = os.path.join(tempfile.gettempdir(), 'testdeepdrive')
+
+tf = pytest.importorskip('tensorflow')
+
+import config as c
+from tensorflow_agent.net import BACKBONES, Net, get_backbone
+from tensorflow_agent.train import checkpoints
+
+
+@pytest.mark.parametrize('backbone', list(BACKBONES))
+def test_backbone_outputs_targets(backbone):
+    with tf.Graph().as_default():
+        x = tf.placeholder(tf.uint8, (None,) + c.BASELINE_IMAGE_SHAPE)
+        with tf.variable_scope('model'):
+            net = Net(x, c.NUM_TARGETS, is_training=False, backbone=backbone)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            out = sess.run(net.p, {x: np.zeros((2,) + c.BASELINE_IMAGE_SHAPE, dtype=np.uint8)})
+    assert out.shape == (2, c.NUM_TARGETS)
+
+
+def test_mobilenet_is_smaller_than_alexnet():
+    num_params = {}
+    for backbone in ['alexnet', 'mobilenet']:
+        with tf.Graph().as_default():
+            x = tf.placeholder(tf.uint8, (None,) + c.BASELINE_IMAGE_SHAPE)
+            Net(x, c.NUM_TARGETS, backbone=backbone)
+            num_params[backbone] = sum(np.prod(v.get_shape().as_list()) for v in tf.trainable_variables())
+    assert num_params['mobilenet'] * 10 < num_params['alexnet']
+
+
+def test_backbone_recorded_with_checkpoints():
+    with pytest.raises(ValueError):
+        get_backbone('nope')
+    train_dir = tempfile.mkdtemp()
+    assert checkpoints.read_backbone_name(os.path.join(train_dir, 'model.ckpt-1')) == 'alexnet'
+    checkpoints.record_backbone(train_dir, 'mobilenet')
+    assert checkpoints.read_backbone_name(os.path.join(train_dir, 'model.ckpt-1')) == 'mobilenet'
+    assert checkpoints.read_backbone_name(train_dir) == 'mobilenet'
+
+
+def test_quantized_export_matches_float():
+    from tensorflow_agent import quantize
+    train_dir = tempfile.mkdtemp()
+    checkpoint_path = os.path.join(train_dir, 'model.ckpt-1')
+    checkpoints.record_backbone(train_dir, 'mobilenet')
+    with tf.Graph().as_default():
+        x = tf.placeholder(tf.uint8, (None,) + c.BASELINE_IMAGE_SHAPE)
+        with tf.variable_scope('model'):
+            Net(x, c.NUM_TARGETS, is_training=False, backbone='mobilenet')
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            tf.train.Saver().save(sess, checkpoint_path)
+    rng = np.random.RandomState(0)
+    images = rng.randint(0, 256, (8,) + c.BASELINE_IMAGE_SHAPE).astype(np.uint8)
+    targets = rng.rand(8, c.NUM_TARGETS).astype(np.float32)
+    tflite_path = quantize.export(checkpoint_path, images)
+    assert tflite_path.endswith(quantize.TFLITE_EXTENSION)
+    assert quantize.QuantizedNet(tflite_path).run(images[0]).shape == (1, c.NUM_TARGETS)
+    result = quantize.report(checkpoint_path, tflite_path, images, targets, num_latency_frames=2)
+    assert set(result['max_abs_diff']) == set(quantize.TARGET_NAMES)
+    assert result['quantized_ms'] > 0
+
+
+def test_factorized_checkpoint():
+    from tensorflow_agent import factorize
+    w = np.random.RandomState(0).randn(40, 30).astype(np.float32)
+    u, v = factorize.factorize_weights(w, 30)
+    assert np.allclose(u.dot(v), w, atol=1e-4)
+    u, v = factorize.factorize_weights(w, 5)
+    assert u.shape == (40, 5) and v.shape == (5, 30)
+
+    train_dir = tempfile.mkdtemp()
+    checkpoint_path = os.path.join(train_dir, 'model.ckpt-1')
+    checkpoints.record_backbone(train_dir, 'mobilenet')
+    images = np.random.RandomState(0).randint(0, 256, (2,) + c.BASELINE_IMAGE_SHAPE).astype(np.uint8)
+    with tf.Graph().as_default():
+        x = tf.placeholder(tf.uint8, (None,) + c.BASELINE_IMAGE_SHAPE)
+        with tf.variable_scope('model'):
+            net = Net(x, c.NUM_TARGETS, is_training=False, backbone='mobilenet')
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            tf.train.Saver().save(sess, checkpoint_path)
+            expected = sess.run(net.p, {x: images})
+
+    # fc6 is 512 x 256, so rank 256 is exact
+    path = factorize.factorize_checkpoint(checkpoint_path, 256)
+    assert checkpoints.get_fc_rank(path) == 256
+    assert checkpoints.read_backbone_name(path) == 'mobilenet'
+    result = factorize.evaluate_checkpoint(path, images, np.zeros((2, c.NUM_TARGETS)))
+    assert result['fc_params'] == 512 * 256 + 256 * 256 + 256
+    with tf.Graph().as_default():
+        x = tf.placeholder(tf.uint8, (None,) + c.BASELINE_IMAGE_SHAPE)
+        with tf.variable_scope('model'):
+            net = Net(x, c.NUM_TARGETS, is_training=False, backbone='mobilenet', fc_rank=256)
+        with tf.Session() as sess:
+            tf.train.Saver().restore(sess, path)
+            assert np.allclose(sess.run(net.p, {x: images}), expected, atol=1e-4)
+
+    # Default ranks on mobilenet: 512 doesn't fit, and 256 is exact but has more parameters than the dense layer
+    assert factorize.get_fc_shapes(checkpoint_path) == {'fc6': [512, 256]}
+    assert factorize.get_useful_ranks(factorize.get_fc_shapes(checkpoint_path), [64, 128, 256, 512]) == [64, 128]
+    assert factorize.is_useful_rank([512, 256], 170) and not factorize.is_useful_rank([512, 256], 171)
+    with pytest.raises(ValueError):
+        factorize.factorize_checkpoint(checkpoint_path, 512)
+
+
+def test_quantized_export_rejects_alexnet():
+    from tensorflow_agent import quantize
+    train_dir = tempfile.mkdtemp()
+    checkpoints.record_backbone(train_dir, 'alexnet')
+    images = np.zeros((1,) + c.BASELINE_IMAGE_SHAPE, dtype=np.uint8)
+    with pytest.raises(ValueError):
+        quantize.export(os.path.join(train_dir, 'model.ckpt-1'), images)
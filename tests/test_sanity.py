@@ -3,6 +3,7 @@ import pytest
 from numpy.random import RandomState
 import tempfile
 import os
+import time
 
 os.environ['DEEPDRIVE_DIR'] = os.path.join(tempfile.gettempdir(), 'testdeepdrive')
 
@@ -131,3 +132,184 @@ def test_preprocess_depth(tf_sess):
                 0.0019493655410045428, 8.9598907012599079e-05, 0.028066647603396212, 0.00017480272492269728,
                 0.0043565111781060008, 0.00094263459389571725, 0.021517855433459819, 0.002208296477107196]
     assert np.max(actual - np.array(expected)) < 1e-7
+
+
+def test_legacy_float_image_to_uint8():
+    from utils import to_uint8_image
+    import config as c
+    rng = RandomState(0)
+    raw = rng.randint(0, 256, size=(227, 227, 3)).astype(np.uint8)
+    legacy = raw.astype(np.float32) - c.MEAN_PIXEL
+    assert to_uint8_image(legacy).dtype == np.uint8
+    assert np.array_equal(to_uint8_image(legacy), raw)
+    assert to_uint8_image(raw) is raw
+
+
+def test_hdf5_uint8_and_legacy_recordings():
+    h5py = pytest.importorskip('h5py')
+    import config as c
+    rng = RandomState(0)
+    raw = rng.randint(0, 256, size=(227, 227, 3)).astype(np.uint8)
+    depth = rng.rand(227, 227)
+    directory = tempfile.mkdtemp()
+
+    filename = os.path.join(directory, 'v2.hdf5')
+    utils.save_hdf5_thread([dict(cameras=[dict(image=raw, depth=depth, image_data=0, depth_data=0)], speed=1.)],
+                           filename)
+    with h5py.File(filename, 'r') as f:
+        assert utils.get_hdf5_format_version(f) == c.HDF5_FORMAT_VERSION
+        assert f['frame_0000000000/camera_00000/image'].dtype == np.uint8
+    image = utils.read_hdf5(filename)[0]['cameras'][0]['image']
+    assert image.dtype == np.uint8 and np.array_equal(image, raw)
+
+    legacy_filename = os.path.join(directory, 'v1.hdf5')
+    with h5py.File(legacy_filename, 'w') as f:
+        camera = f.create_group('frame_0000000000/camera_00000')
+        camera.create_dataset('image', data=raw.astype(np.float32) - c.MEAN_PIXEL)
+        camera.create_dataset('depth', data=depth)
+    assert np.array_equal(utils.read_hdf5(legacy_filename)[0]['cameras'][0]['image'], raw)
+
+
+def test_vectorized_rewards_match_scalar():
+    calc = DeepDriveRewardCalculator
+    lane_cases = [(100, 0.1), (300, 0.1), (300, 1e8), (300, 1e-8), (0, 0.1), (1e8, 0.1)]
+    gforce_cases = [(1, 0.1), (5, 1e8), (5, 1e-8), (0, 0.1), (1e8, 0.1)]
+    progress_cases = [(100, 0.1), (100, 1), (3, 0.1), (3, 1e-8), (0, 0.1), (-10, 0.1), (1e8, 0.1), (-1e8, 0.1)]
+    for cases, scalar_fn, vector_fn in [(lane_cases, calc.get_lane_deviation_penalty, calc.get_lane_deviation_penalties),
+                                        (gforce_cases, calc.get_gforce_penalty, calc.get_gforce_penalties),
+                                        (progress_cases, calc.get_progress_reward, calc.get_progress_rewards)]:
+        values, times = zip(*cases)
+        expected = [scalar_fn(v, t) for v, t in cases]
+        assert list(vector_fn(np.array(values), np.array(times))) == expected
+    assert calc.get_progress_rewards([5.], [np.nan])[0] == calc.get_progress_reward(5., None)
+    assert calc.get_lane_deviation_penalties([300.], [np.nan])[0] == calc.get_lane_deviation_penalty(300., None)
+    with pytest.raises(ValueError):
+        calc.get_lane_deviation_penalties([1, -1], [0.1, 0.1])
+    with pytest.raises(ValueError):
+        calc.get_gforce_penalties([1, -5], [0.1, 0.1])
+
+
+def test_clocks():
+    from gym_deepdrive.envs.clock import StepClock, ObservationClock
+    assert abs(StepClock(period=0.125).now() - time.time()) < 60  # Epoch times, so laps have real dates
+    clock = StepClock(period=0.125, start=0.)
+    for _ in range(8):
+        clock.tick(None)
+    assert clock.now() == pytest.approx(1.)
+    assert abs(ObservationClock().now() - time.time()) < 60
+    clock = ObservationClock(start=0.)
+    clock.tick({'capture_timestamp': 1000.})
+    assert clock.now() == 0
+    clock.tick(None)
+    clock.tick({'capture_timestamp': 1002.5})
+    assert clock.now() == pytest.approx(2.5)
+
+
+def test_poll():
+    calls = []
+
+    def probe():
+        calls.append(1)
+        return len(calls) >= 3 and 'ready'
+
+    assert utils.poll(probe, timeout=1, poll_secs=0.001) == 'ready'
+    assert len(calls) == 3
+    assert utils.poll(lambda: None, timeout=0.01, poll_secs=0.001) is None
+
+
+def test_lazy_dict():
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return 42
+
+    d = utils.LazyDict({'a': 1}, lazy={'b': compute})
+    assert 'b' in d and len(d) == 2 and not calls
+    assert d['b'] == 42 and d['b'] == 42
+    assert len(calls) == 1
+    d['b'] = 3
+    del d['a']
+    assert dict(d) == {'b': 3}
+    import pickle
+    assert pickle.loads(pickle.dumps(utils.LazyDict(lazy={'c': compute}))) == {'c': 42}
+
+
+def test_observation_fields_are_lazy():
+    from gym_deepdrive.envs.deepdrive_gym_env import DeepDriveEnv
+
+    class Camera(object):
+        capture_width = 4
+        capture_height = 2
+        image_data = np.full(4 * 2 * 3, 0.5, dtype=np.float32)
+        depth_data = np.arange(1, 4 * 2 + 1, dtype=np.float32)
+
+    class Observation(object):
+        camera_count = 1
+        cameras = [Camera()]
+        speed = 100.
+
+    class Env(DeepDriveEnv):
+        def __del__(self):
+            pass  # Not connected
+
+    env = Env.__new__(Env)
+    env.preprocess_with_tensorflow = False
+    env.pyglet_render = False
+    env.required_fields = []
+    obz = env.preprocess_observation(Observation())
+    camera = obz['cameras'][0]
+    assert not camera.is_computed('image') and not camera.is_computed('depth')
+    assert camera['image'].shape == (2, 4, 3)
+    assert not camera.is_computed('depth')
+
+    env.set_required_fields(['speed', 'cameras.depth'])
+    obz = env.preprocess_observation(Observation())
+    assert obz.is_computed('speed') and obz['cameras'][0].is_computed('depth')
+    assert not obz['cameras'][0].is_computed('image')
+
+
+def test_lazy_camera_fields_survive_capture_buffer_reuse():
+    from gym_deepdrive.envs.deepdrive_gym_env import DeepDriveEnv
+
+    class Camera(object):
+        capture_width = 4
+        capture_height = 2
+        image_data = np.full(4 * 2 * 3, 0.5, dtype=np.float32)
+        depth_data = np.arange(1, 4 * 2 + 1, dtype=np.float32)
+
+    class Observation(object):
+        camera_count = 1
+        cameras = [Camera()]
+
+    class Env(DeepDriveEnv):
+        def __del__(self):
+            pass  # Not connected
+
+    env = Env.__new__(Env)
+    env.preprocess_with_tensorflow = False
+    env.pyglet_render = False
+    env.required_fields = []
+    observation = Observation()
+    expected = env.preprocess_observation(observation)['cameras'][0]
+    expected_image, expected_depth = expected['image'], expected['depth']
+    camera = env.preprocess_observation(observation)['cameras'][0]
+    assert not camera.is_computed('image')
+    # The sim writes the next frame into the same capture memory
+    observation.cameras[0].image_data[:] = 0.9
+    observation.cameras[0].depth_data[:] = 7.
+    assert np.array_equal(camera['image'], expected_image)
+    assert np.array_equal(camera['depth'], expected_depth)
+    assert np.array_equal(camera['image_data'], np.full(4 * 2 * 3, 0.5, dtype=np.float32))
+
+
+def test_resize_to_baseline():
+    scipy_misc = pytest.importorskip('scipy.misc')
+    if not hasattr(scipy_misc, 'imresize'):
+        pytest.skip('scipy.misc.imresize was removed in scipy 1.3')
+    from tensorflow_agent.train.data_utils import resize_to_baseline
+    import config as c
+    images = [np.zeros(c.BASELINE_IMAGE_SHAPE, dtype=np.uint8), np.zeros((229, 225, 3), dtype=np.uint8)]
+    same = images[0]
+    assert np.array(resize_to_baseline(images)).shape == (2,) + c.BASELINE_IMAGE_SHAPE
+    assert images[0] is same
@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that should only be imported once they're used
+HEAVY_MODULES = ['tensorflow', 'h5py', 'requests', 'boto', 'arrow', 'gym', 'pkg_resources', 'deepdrive_client',
+                 'deepdrive_capture', 'pyglet', 'scipy', 'clint']
+
+# Cumulative import time budget for main.py, most of which is numpy
+MAIN_IMPORT_BUDGET_SECS = 1.0
+
+
+def _run_python(code, home, *args):
+    env = dict(os.environ)
+    env.pop('DEEPDRIVE_DIR', None)
+    env['HOME'] = home
+    env['PYTHONPATH'] = ROOT_DIR
+    return subprocess.run([sys.executable] + list(args) + ['-c', code], env=env, cwd=home, stdin=subprocess.DEVNULL,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, timeout=60)
+
+
+def _parse_importtime(stderr):
+    """Returns {module: cumulative seconds} from python -X importtime output"""
+    ret = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, module = line[len('import time:'):].split('|')
+        ret[module.strip()] = int(cumulative_us) / 1e6
+    return ret
+
+
+def test_import_has_no_side_effects():
+    home = tempfile.mkdtemp()
+    result = _run_python('import config, logs, utils, benchmark, main; logs.get_log("test")', home)
+    assert result.returncode == 0, result.stderr
+    assert not os.path.exists(os.path.join(home, '.deepdrive'))
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason='-X importtime requires Python 3.7')
+def test_main_import_time():
+    home = tempfile.mkdtemp()
+    result = _run_python('import sys, main; print(" ".join(sys.modules))', home, '-X', 'importtime')
+    assert result.returncode == 0, result.stderr
+    imported = set(m.split('.')[0] for m in result.stdout.split())
+    assert not imported & set(HEAVY_MODULES)
+    import_times = _parse_importtime(result.stderr)
+    assert import_times['main'] < MAIN_IMPORT_BUDGET_SECS
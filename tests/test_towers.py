@@ -0,0 +1,45 @@
+import os
+import tempfile
+
+import numpy as np
+import pytest
+
+os.environ['DEEPDRIVE_DIR'] = os.path.join(tempfile.gettempdir(), 'testdeepdrive')
+
+tf = pytest.importorskip('tensorflow')
+
+from tensorflow_agent.train import towers
+
+
+def _build_linear_tower(tower_x, tower_y):
+    w = tf.get_variable('w', [3, 1], initializer=tf.constant_initializer([[1.], [2.], [3.]]))
+    p = tf.matmul(tower_x, w)
+    return 0.5 * tf.reduce_mean(tf.square(p - tower_y))
+
+
+def _grads(devices, x_val, y_val):
+    with tf.Graph().as_default():
+        x = tf.placeholder(tf.float32, (None, 3))
+        y = tf.placeholder(tf.float32, (None, 1))
+        tower_losses = towers.build_towers(x, y, devices, _build_linear_tower)
+        opt = tf.train.GradientDescentOptimizer(0.1)
+        grads_and_vars = towers.average_gradients(
+            [opt.compute_gradients(l, colocate_gradients_with_ops=True) for l in tower_losses])
+        assert len(tf.trainable_variables()) == 1  # Variables are shared between towers
+        with tf.Session(config=towers.get_session_config(devices)) as sess:
+            sess.run(tf.global_variables_initializer())
+            return sess.run(grads_and_vars[0][0], {x: x_val, y: y_val})
+
+
+def test_tower_gradients_match_single_device():
+    rng = np.random.RandomState(0)
+    x_val = rng.rand(8, 3).astype(np.float32)
+    y_val = rng.rand(8, 1).astype(np.float32)
+    single = _grads(['/cpu:0'], x_val, y_val)
+    multi = _grads(['/cpu:0', '/cpu:1'], x_val, y_val)
+    assert np.allclose(single, multi, atol=1e-6)
+
+
+def test_session_config_creates_virtual_cpus():
+    config = towers.get_session_config(['/cpu:0', '/cpu:1', '/cpu:2'])
+    assert config.device_count['CPU'] == 3
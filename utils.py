@@ -1,23 +1,83 @@
 import glob
+import importlib
 import inspect
+import json
 import os
 import stat
 import sys
 import threading
 import time
-import zipfile
-import tempfile
+from collections.abc import MutableMapping
+from functools import partial
 
-import h5py
 import numpy as np
-import requests
-from clint.textui import progress
 from subprocess import Popen, PIPE
 
 import config as c
 import logs
 
 
+class LazyImport(object):
+    """Stands in for a module that is only imported on first attribute access, i.e. for heavy or native
+    dependencies that most code paths never touch"""
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+h5py = LazyImport('h5py')
+
+
+class LazyDict(MutableMapping):
+    """A dict whose values can be given as functions that are called on first access, after which the result is
+    memoized. Pickles as a plain dict with every value computed."""
+    def __init__(self, values=None, lazy=None):
+        self._values = dict(values or {})
+        self._lazy = dict(lazy or {})
+
+    def set_lazy(self, key, fn):
+        self._values.pop(key, None)
+        self._lazy[key] = fn
+
+    def is_computed(self, key):
+        return key in self._values
+
+    def __getitem__(self, key):
+        if key in self._lazy:
+            self._values[key] = self._lazy.pop(key)()
+        return self._values[key]
+
+    def __setitem__(self, key, value):
+        self._lazy.pop(key, None)
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        if key in self._lazy:
+            del self._lazy[key]
+        else:
+            del self._values[key]
+
+    def __contains__(self, key):
+        return key in self._values or key in self._lazy
+
+    def __iter__(self):
+        return iter(list(self._values) + list(self._lazy))
+
+    def __len__(self):
+        return len(self._values) + len(self._lazy)
+
+    def __reduce__(self):
+        return dict, (dict(self.items()),)
+
+    def __repr__(self):
+        return 'LazyDict(%r, lazy=%r)' % (self._values, list(self._lazy))
+
+
 def normalize(a):
     amax = a.max()
     amin = a.min()
@@ -33,8 +93,8 @@ def preprocess_image(image):
              * 255.)
     image = np.clip(image, a_min=0, a_max=255)\
         .astype('uint8', copy=False)
-    end = time.time()
-    log.debug('preprocess_capture_image took %rms', (end - start) * 1000.)
+    if logs.DEBUG_ENABLED:
+        log.debug('preprocess_capture_image took %rms', (time.time() - start) * 1000.)
     return image
 
 
@@ -59,31 +119,34 @@ def depth_heatmap(depth):
     return ret
 
 
-def obj2dict(obj, exclude=None):
-    ret = {}
+def obj2dict(obj, exclude=None, lazy=False):
+    """lazy: Return a LazyDict that only reads attributes when they're accessed"""
+    ret = LazyDict() if lazy else {}
     exclude = exclude or []
     for name in dir(obj):
         if not name.startswith('__') and name not in exclude:
-            value = getattr(obj, name)
-            if not inspect.ismethod(value):
-                value = getattr(obj, name)
-            ret[name] = value
+            if lazy:
+                ret.set_lazy(name, partial(getattr, obj, name))
+            else:
+                ret[name] = getattr(obj, name)
     return ret
 
 
-def save_hdf5(out, filename):
+def save_hdf5(out, filename, catalog_dir=None):
+    """catalog_dir: Recording directory whose frame catalog (see catalog.py) the file should be added to"""
     if 'DEEPDRIVE_NO_THREAD_SAVE' in os.environ:
-        save_hdf5_thread(out, filename)
+        save_hdf5_thread(out, filename, catalog_dir)
     else:
-        thread = threading.Thread(target=save_hdf5_thread, args=(out, filename))
+        thread = threading.Thread(target=save_hdf5_thread, args=(out, filename, catalog_dir))
         thread.start()
 
 
-def save_hdf5_thread(out, filename):
+def save_hdf5_thread(out, filename, catalog_dir=None):
     os.makedirs(os.path.dirname(filename), exist_ok=True)
     log.debug('Saving to %s', filename)
     opts = dict(compression='lzf', fletcher32=True)
     with h5py.File(filename, 'w') as f:
+        f.attrs['format_version'] = c.HDF5_FORMAT_VERSION
         for i, frame in enumerate(out):
             frame_grp = f.create_group('frame_%s' % str(i).zfill(10))
             for j, camera in enumerate(frame['cameras']):
@@ -100,11 +163,33 @@ def save_hdf5_thread(out, filename):
             for k, v in frame.items():
                 frame_grp.attrs[k] = v
     log.info('Saved to %s', filename)
+    if catalog_dir is not None:
+        from catalog import Catalog
+        try:
+            catalog = Catalog(catalog_dir)
+            catalog.add_file(filename)
+            catalog.close()
+        except Exception as e:
+            log.error('Could not add %s to the catalog, run catalog.py to rebuild it. Error was %r', filename, e)
+
+
+def get_hdf5_format_version(file):
+    return int(file.attrs.get('format_version', 1))
+
+
+def to_uint8_image(image):
+    """Version 1 recordings store mean subtracted float32 images"""
+    if image.dtype != np.uint8:
+        image = np.clip(np.rint(image + c.MEAN_PIXEL), 0, 255).astype(np.uint8)
+    return image
 
 
 def read_hdf5(filename, save_png_dir=None):
+    """Frames with uint8 camera images, whatever format version the file was recorded with.
+    To export frames in bulk, see export_recordings.py"""
     ret = []
     with h5py.File(filename, 'r') as file:
+        is_legacy = get_hdf5_format_version(file) < 2
         for i, frame_name in enumerate(file):
             frame = file[frame_name]
             out_frame = dict(frame.attrs)
@@ -112,8 +197,10 @@ def read_hdf5(filename, save_png_dir=None):
             for camera_name in frame:
                 camera = frame[camera_name]
                 out_camera = dict(camera.attrs)
-                out_camera['image'] = camera['image'].value
-                out_camera['depth'] = camera['depth'].value
+                out_camera['image'] = camera['image'][()]
+                out_camera['depth'] = camera['depth'][()]
+                if is_legacy:
+                    out_camera['image'] = to_uint8_image(out_camera['image'])
                 out_cameras.append(out_camera)
                 if save_png_dir is not None:
                     save_camera(out_camera['image'], out_camera['depth'], save_dir=save_png_dir, name=str(i).zfill(10))
@@ -122,6 +209,12 @@ def read_hdf5(filename, save_png_dir=None):
     return ret
 
 
+def read_hdf5_frame_attrs(filename):
+    """Per-frame attributes (speed, steering, etc...) without reading or decompressing any camera data"""
+    with h5py.File(filename, 'r') as file:
+        return [dict(file[frame_name].attrs) for frame_name in file]
+
+
 def save_camera(image, depth, save_dir, name):
     from scipy.misc import imsave
     imsave(os.path.join(save_dir, 'i_' + name + '.png'), image)
@@ -148,42 +241,59 @@ def is_debugging():
     return False
 
 
-def download(url, directory, warn_existing=True, overwrite=False):
-    """Useful for downloading a folder / zip file from dropbox/s3/cloudfront and unzipping it to path"""
+def poll(probe, timeout, poll_secs=c.SIM_POLL_SECS, max_poll_secs=c.SIM_MAX_POLL_SECS):
+    """Calls probe until it returns something truthy and returns that, or returns None once timeout seconds have
+    passed. The interval between calls starts at poll_secs and doubles up to max_poll_secs."""
+    deadline = time.time() + timeout
+    while True:
+        ret = probe()
+        if ret:
+            return ret
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return None
+        time.sleep(min(poll_secs, remaining))
+        poll_secs = min(poll_secs * 2, max_poll_secs)
+
+
+def download(url, directory, warn_existing=True, overwrite=False, sha256=None):
+    """Useful for downloading a folder / zip file from dropbox/s3/cloudfront and unzipping it to path.
+
+    Downloads go through the artifact cache, so they resume if interrupted. The zip is deleted once extracted.
+    sha256: Optional expected checksum of the zip
+    """
     if has_stuff(directory, warn_existing, overwrite):
         return
     else:
         os.makedirs(directory, exist_ok=True)
 
-    log.info('Downloading %s to %s...', url, directory)
-
-    request = requests.get(url, stream=True)
-    filename = url.split('/')[-1]
-    if '?' in filename:
-        filename = filename[:filename.index('?')]
-    location = os.path.join(tempfile.gettempdir(), filename)
-    with open(location, 'wb') as f:
-        if request.status_code == 404:
-            raise RuntimeError('Download URL not accessible %s' % url)
-        total_length = int(request.headers.get('content-length'))
-        for chunk in progress.bar(request.iter_content(chunk_size=1024), expected_size=(total_length / 1024) + 1):
-            if chunk:
-                f.write(chunk)
-                f.flush()
-
-    log.info('done.')
-    zip_ref = zipfile.ZipFile(location, 'r')
-    log.info('Unzipping temp file %s to %s...', location, directory)
+    import artifacts
+    cache = artifacts.get_cache()
+    zip_path = cache.fetch(url, sha256=sha256)
     try:
-        zip_ref.extractall(directory)
-        print('done.')
+        artifacts.extract(zip_path, directory)
     except Exception:
         print('You may want to close all programs that may have these files open or delete existing '
               'folders this is trying to overwrite')
         raise
-    finally:
-        zip_ref.close()
-        os.remove(location)
+    cache.evict(url)
+
+
+def write_json_atomic(obj, filename):
+    """Writes to a temp file next to filename and renames it into place, so readers never see a partial file"""
+    tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+    with open(tmp_filename, 'w') as f:
+        json.dump(obj, f, indent=2, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+
+
+def read_json(filename, default=None):
+    if not os.path.exists(filename):
+        return default
+    with open(filename) as f:
+        return json.load(f)
 
 
 def dir_has_stuff(path):